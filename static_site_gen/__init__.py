@@ -1,2 +1,11 @@
 from .cli import runCli
-from .build import buildSite
+
+
+def __getattr__(name):
+    # Importing the package shouldn't load the Markdown stack,
+    # so buildSite is only imported when it's asked for
+    if name == "buildSite":
+        from .build import buildSite
+
+        return buildSite
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
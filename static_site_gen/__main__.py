@@ -1,3 +1,5 @@
 from . import runCli
 
-runCli()
+# Guarded, since processes spawned by `ssg bench` import this module again
+if __name__ == "__main__":
+    runCli()
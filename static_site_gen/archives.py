@@ -0,0 +1,138 @@
+""" Generates the paginated archive pages listed under `archives` in the
+    config: a group split into pages of a fixed size, or one such archive
+    for every tag used in a group.
+
+    Archives are built from the indexes enrichSiteConfig() makes,
+    so each archive page only costs as much as the posts on it.
+"""
+
+from dataclasses import dataclass
+import math
+from typing import Any, List, Optional
+
+from .config_structs import PAGE_TEMPLATE_FIELDS
+
+
+@dataclass
+class ArchivePage:
+    title: str
+    url: str
+    group: str
+    tag: Optional[str]
+    number: int
+    pageCount: int
+    items: List[Any]
+    previous: Optional[str]
+    next: Optional[str]
+
+    def forTemplate(self, view):
+        """ The currentPage templates get for this page, where view turns
+            each listed page into what templates get for it.
+        """
+        data = {name: None for name in PAGE_TEMPLATE_FIELDS}
+        data.update(
+            {
+                "title": self.title,
+                "url": self.url,
+                "group": self.group,
+                "tags": [self.tag] if self.tag is not None else [],
+                "tag": self.tag,
+                "number": self.number,
+                "pageCount": self.pageCount,
+                "entries": [view(page) for page in self.items],
+                "previous": self.previous,
+                "next": self.next,
+            }
+        )
+        return data
+
+    def describe(self):
+        """ Everything about the page except its items,
+            for telling whether it changed since the last build.
+        """
+        return repr(
+            (
+                self.title,
+                self.group,
+                self.tag,
+                self.number,
+                self.pageCount,
+                self.previous,
+                self.next,
+            )
+        )
+
+
+def archivePages(archiveConfig, siteConfig, content):
+    """ Yields the ArchivePages of one archive.
+    """
+    if archiveConfig.group not in content:
+        print(
+            f"Config error: archives.{archiveConfig.name} lists "
+            f"unknown group {archiveConfig.group}"
+        )
+        raise KeyError(archiveConfig.group)
+    if archiveConfig.byTag:
+        for tag in siteConfig.tags:
+            pages = [
+                page
+                for page in siteConfig.tagPages[tag]
+                if page.group == archiveConfig.group
+            ]
+            if pages:
+                yield from paginate(archiveConfig, pages, tag)
+    else:
+        yield from paginate(archiveConfig, content[archiveConfig.group], None)
+
+
+def paginate(archiveConfig, pages, tag):
+    size = archiveConfig.pageSize if archiveConfig.pageSize > 0 else len(pages)
+    pageCount = max(1, math.ceil(len(pages) / size)) if size else 1
+    urls = [archiveUrl(archiveConfig, n, tag) for n in range(1, pageCount + 1)]
+    if len(set(urls)) != len(urls):
+        print(
+            f"Config error: the path of archives.{archiveConfig.name} "
+            "must contain {page}"
+        )
+        raise ValueError(archiveConfig.path)
+    for n in range(1, pageCount + 1):
+        yield ArchivePage(
+            title=archiveConfig.title.format(
+                page=n, tag=tag, group=archiveConfig.group
+            ),
+            url=urls[n - 1],
+            group=archiveConfig.group,
+            tag=tag,
+            number=n,
+            pageCount=pageCount,
+            items=pages[(n - 1) * size : n * size],
+            previous=urls[n - 2] if n > 1 else None,
+            next=urls[n] if n < pageCount else None,
+        )
+
+
+def archiveUrl(archiveConfig, number, tag=None):
+    """ The url of page number (counting from 1) of an archive.
+    """
+    pattern = archiveConfig.firstPath if number == 1 else archiveConfig.path
+    return pattern.format(page=number, tag=tag).lstrip("/")
+
+
+def archiveIndex(archives, siteConfig):
+    """ Maps each archive's name to the url of its first page,
+        or for archives by tag, to a dict of those urls by tag.
+    """
+    index = {}
+    for archiveConfig in archives:
+        if archiveConfig.byTag:
+            index[archiveConfig.name] = {
+                tag: archiveUrl(archiveConfig, 1, tag)
+                for tag in siteConfig.tags
+                if any(
+                    page.group == archiveConfig.group
+                    for page in siteConfig.tagPages[tag]
+                )
+            }
+        else:
+            index[archiveConfig.name] = archiveUrl(archiveConfig, 1)
+    return index
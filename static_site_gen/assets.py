@@ -0,0 +1,265 @@
+""" Copies the site's assets into the output directory.
+
+    Asset directories are walked recursively. The size, mtime and hash of
+    every asset go in the manifest, so incremental builds only hash the
+    assets which were touched since the last build, and only copy the ones
+    whose contents changed. Copies are made from a pool of threads, as
+    cheaply as the filesystem allows: by reflink where it supports them,
+    then with copy_file_range, and only then by reading and writing
+    (or as hard links, if the config asks for them).
+
+    With fingerprinting on, each asset is written under a name with the hash
+    of its contents in it, so it can be served with a long cache lifetime;
+    templates look the names up with asset().
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import errno
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .globals import ASSET_COPY_THREADS
+from .manifest import hashFile
+
+# The ioctl which makes a file share the blocks of another (Linux)
+FICLONE = 0x40049409
+# The errors a way of copying fails with on filesystems which don't support it
+UNSUPPORTED_ERRORS = {
+    errno.EXDEV,
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+    errno.EINVAL,
+    errno.ENOTTY,
+    errno.ENOSYS,
+    errno.EPERM,
+    errno.EMLINK,
+}
+FINGERPRINT_LENGTH = 10
+
+
+def reflink(source, dest):
+    with open(source, "rb") as src, open(dest, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copystat(source, dest)
+
+
+def copyRange(source, dest):
+    with open(source, "rb") as src, open(dest, "wb") as dst:
+        remaining = os.fstat(src.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+            if copied == 0:
+                break
+            remaining -= copied
+    shutil.copystat(source, dest)
+
+
+class Copier:
+    """ Copies files the cheapest way that works, giving up on the ways the
+        filesystem turns out not to support. Keeps the source's mtime,
+        which OutputWriter.copy() relies on.
+
+        Arguments:
+            mode is "auto" (reflink, copy_file_range or a plain copy),
+                "hardlink", or "copy" (always a plain copy)
+    """
+
+    def __init__(self, mode="auto"):
+        self.methods = []
+        if mode == "hardlink":
+            self.methods.append(("hardlink", os.link))
+        elif mode == "auto":
+            if fcntl is not None and sys.platform.startswith("linux"):
+                self.methods.append(("reflink", reflink))
+            if hasattr(os, "copy_file_range"):
+                self.methods.append(("copy_file_range", copyRange))
+        self.methods.append(("copy", shutil.copy2))
+        # How many files were copied each way
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, source, dest):
+        for name, method in list(self.methods):
+            try:
+                method(source, dest)
+            except OSError as e:
+                if name == "copy" or e.errno not in UNSUPPORTED_ERRORS:
+                    raise
+                if os.path.lexists(dest):
+                    os.remove(dest)
+                with self.lock:
+                    if (name, method) in self.methods:
+                        self.methods.remove((name, method))
+                continue
+            with self.lock:
+                self.counts[name] = self.counts.get(name, 0) + 1
+            return
+
+
+class AssetIndex:
+    """ What templates call as asset(name) to get the url of an asset.
+        Assets can be named by their path, or by their path within the
+        asset directory they're in.
+    """
+
+    def __init__(self, urls=None, names=None):
+        # Maps the path of every asset to its path in the output
+        self.urls = urls if urls else {}
+        # Maps the other names assets can be looked up by to their paths
+        self.names = names if names else {}
+
+    def __call__(self, name):
+        url = self.resolve(name)
+        if url is None:
+            print(f"Template error: there's no asset called {name}")
+            raise KeyError(name)
+        return url
+
+    def lookup(self, name):
+        """ Returns the path of the asset called name, or None.
+        """
+        path = os.path.normpath(name.lstrip("/"))
+        path = self.names.get(path, path)
+        return path if path in self.urls else None
+
+    def resolve(self, name):
+        """ Returns the url of the asset called name, or None.
+        """
+        path = self.lookup(name)
+        if path is None:
+            return None
+        return "/" + self.urls[path].replace(os.sep, "/")
+
+    def describe(self):
+        """ Changes whenever the url of an asset does.
+        """
+        return repr(sorted(self.urls.items()))
+
+
+def listAssets(assetsConfig):
+    """ Lists the path of every asset in the config, along with the name
+        it can be found by within its directory.
+    """
+    assets = []
+    for f in assetsConfig.files:
+        assets.append((os.path.normpath(f), os.path.basename(f)))
+    for d in assetsConfig.directories:
+        if not os.path.isdir(d):
+            print(f"Config error: asset directory {d} doesn't exist")
+            raise FileNotFoundError(d)
+        for (dirPath, _, files) in os.walk(d):
+            for f in sorted(files):
+                path = os.path.normpath(os.path.join(dirPath, f))
+                assets.append((path, os.path.relpath(path, d)))
+    return assets
+
+
+def buildAssetFiles(
+    *, assetsConfig, writer, previous=None, changedPaths=None, copy=True, silent=False
+):
+    """ Copies asset files into the output directory.
+
+        Arguments:
+            copy says whether to copy the assets at all; without it, they're
+                only indexed (for the shards of a sharded build which don't
+                write them)
+            previous is the Manifest of the previous build, if any; assets
+                whose size and mtime match their record in it aren't hashed
+            changedPaths is the set of files known to have changed since
+                then, if the caller is watching for changes; other assets
+                aren't even looked at
+
+        Returns the records of the assets for the manifest (mapping each
+        asset's path to its size, mtime and hash), and an AssetIndex.
+    """
+    start = time.perf_counter()
+    copier = Copier(assetsConfig.copyMode)
+    records = {}
+    index = AssetIndex()
+    # The records of the assets which don't need hashing again
+    known = {}
+    # The paths of the assets which might need copying, with their hashes
+    # if they're known
+    toCopy = []
+    for path, name in listAssets(assetsConfig):
+        if name not in index.names:
+            index.names[name] = path
+        record = previous.assets.get(path) if previous is not None else None
+        if record is None:
+            toCopy.append((path, None))
+        elif changedPaths is not None and path not in changedPaths:
+            known[path] = record
+        else:
+            stat = os.stat(path)
+            if record[:2] == (stat.st_size, stat.st_mtime_ns):
+                known[path] = record
+            else:
+                toCopy.append((path, None))
+
+    # Assets whose hash is known only need copying if they're missing
+    for path, record in known.items():
+        dest = outputPath(path, record[2], assetsConfig)
+        if not copy or writer.existingHash(dest) == record[2]:
+            if copy:
+                writer.keep(dest)
+            records[path] = record
+            index.urls[path] = dest
+        else:
+            toCopy.append((path, record[2]))
+
+    def copyAsset(path, sourceHash):
+        stat = os.stat(path)
+        if sourceHash is None:
+            sourceHash = hashFile(path)
+        dest = outputPath(path, sourceHash, assetsConfig)
+        if copy:
+            writer.copy(path, dest, sourceHash, copier)
+        return (stat.st_size, stat.st_mtime_ns, sourceHash), dest
+
+    written = writer.written
+    with ThreadPoolExecutor(max_workers=ASSET_COPY_THREADS) as executor:
+        futures = [
+            (path, executor.submit(copyAsset, path, sourceHash))
+            for path, sourceHash in toCopy
+        ]
+        for path, future in futures:
+            records[path], index.urls[path] = future.result()
+    copied = writer.written - written
+    # Names which are also the path of an asset refer to that asset
+    index.names = {
+        name: path for name, path in index.names.items() if name not in index.urls
+    }
+
+    if copy and assetsConfig.fingerprint and assetsConfig.manifestPath:
+        urls = {
+            path.replace(os.sep, "/"): url.replace(os.sep, "/")
+            for path, url in sorted(index.urls.items())
+        }
+        writer.write(assetsConfig.manifestPath, json.dumps(urls, indent=2))
+    if not silent and toCopy:
+        hashed = sum(1 for _, sourceHash in toCopy if sourceHash is None)
+        methods = ", ".join(f"{n} by {name}" for name, n in copier.counts.items())
+        print(
+            f"Hashed {hashed} of {len(records)} assets and copied {copied}"
+            + (f" ({methods})" if methods else "")
+            + f" in {(time.perf_counter() - start) * 1000:.0f} ms"
+        )
+    return records, index
+
+
+def outputPath(path, sourceHash, assetsConfig):
+    """ The path an asset is written to in the output.
+    """
+    if not assetsConfig.fingerprint:
+        return path
+    base, extension = os.path.splitext(path)
+    return f"{base}.{sourceHash[:FINGERPRINT_LENGTH]}{extension}"
@@ -0,0 +1,225 @@
+""" The markdown backends pages can be converted with.
+
+    Python-Markdown, with all of the site's extensions, can convert any page.
+    With `backend = "auto"` under `markdown` in the config, pages written in
+    the plain subset of markdown which both engines turn into the same HTML
+    are converted with markdown-it-py (a much faster CommonMark engine)
+    instead, if it's installed. Whether a page is plain is decided from its
+    body alone, erring on the side of Python-Markdown: anything which needs
+    one of the extensions (code blocks, math, admonitions, tables), or where
+    the two engines are known to disagree (like raw HTML, entities, images,
+    quotes and dashes), sends a page down the full pipeline.
+
+    `ssg parity` (see parity.py) checks that both backends agree on a set of
+    examples and on the plain pages of a site.
+"""
+
+import re
+import time
+
+try:
+    import markdown_it
+    from markdown_it import MarkdownIt
+except ImportError:
+    markdown_it = None
+
+from .manifest import plainData
+from .mdExtensions.meta import parseFrontMatter
+
+# Characters and sequences which never appear in a plain page
+UNSAFE_RE = re.compile(
+    r"""
+    ["\\<&$|\t~]            # quotes, escapes, HTML, entities, math, tables
+    | ``                    # fenced code, and code spans with backticks in them
+    | --                    # dashes, and horizontal rules
+    | \.\.\.                # ellipses
+    | !!!                   # admonitions
+    | [\u2018\u2019\u201c\u201d\u2013\u2014\u2026]  # what smarty makes
+    | (?<!\w)'|'(?!\w)      # quotes; only apostrophes within words are safe
+    | ^[ ] | [ ]$           # indented code, nested lists, hard breaks
+    """,
+    re.MULTILINE | re.VERBOSE,
+)
+# The kinds of lines a plain page is made of; anything else isn't plain
+HEADING_RE = re.compile(r"#{1,6} (?P<text>.*[^#])")
+LIST_ITEM_RE = re.compile(r"(?P<marker>[-*+]|\d{1,9}\.) (?P<text>.*)")
+QUOTE_RE = re.compile(r"> (?P<text>.*)")
+# Inline text can't start with anything which could begin another block
+TEXT_START_RE = re.compile(r"[\w`\[(]|[*_](?=[^\s*_])")
+NUMBERED_RE = re.compile(r"\d+[.)](\s|$)")
+# The inline markup which both backends agree on: code spans, links and
+# emphasis with nothing nested inside, and underscores within words
+CODE_SPAN_RE = re.compile(r"`[^`\s]([^`]*[^`\s])?`")
+LINK_RE = re.compile(r"(?<!!)\[([^\[\]]+)\]\([\w./:#?=%+-]+\)")
+EMPHASIS_RE = re.compile(
+    r"(?<![\w*_])(\*\*|__|\*|_)(?=[^\s*_])([^*_]+?)(?<=[^\s*_])\1(?![\w*_])"
+)
+INTRAWORD_RE = re.compile(r"(?<=[A-Za-z0-9])_(?=[A-Za-z0-9])")
+MARKUP_CHARACTERS = set("*_`[]")
+# markdown-it's smart punctuation comes out as characters, smarty's as entities
+SMART_ENTITIES = {"\u2019": "&rsquo;"}
+
+
+def isPlainText(text):
+    """ Says whether a line of inline text only uses markup both backends
+        agree on.
+    """
+    if not TEXT_START_RE.match(text) or NUMBERED_RE.match(text):
+        return False
+    text = CODE_SPAN_RE.sub("x", text)
+    text = LINK_RE.sub(r"\1", text)
+    text = EMPHASIS_RE.sub(r"\2", text)
+    text = INTRAWORD_RE.sub("", text)
+    return not MARKUP_CHARACTERS.intersection(text)
+
+
+def isPlain(body):
+    """ Says whether a page body (without its front matter) is written in
+        the subset of markdown both backends turn into the same HTML:
+        paragraphs, headings, blockquotes and simple lists of inline text.
+    """
+    if UNSAFE_RE.search(body):
+        return False
+    # The kinds of the previous line and the last line which wasn't blank
+    previous = lastKind = "blank"
+    for line in body.split("\n"):
+        if not line:
+            kind = "blank"
+        elif HEADING_RE.fullmatch(line):
+            kind, text = "heading", HEADING_RE.fullmatch(line)["text"]
+        elif LIST_ITEM_RE.fullmatch(line):
+            match = LIST_ITEM_RE.fullmatch(line)
+            kind, text = "item", match["text"]
+            # Lists are tight, follow blank lines and only have one kind of
+            # item, since the backends split, interrupt and loosen lists
+            # differently
+            itemMarker = "." if match["marker"][-1] == "." else match["marker"]
+            if previous == "item":
+                if itemMarker != marker:
+                    return False
+            elif previous != "blank" or lastKind == "item":
+                return False
+            marker = itemMarker
+        elif QUOTE_RE.fullmatch(line):
+            kind, text = "quote", QUOTE_RE.fullmatch(line)["text"]
+            # Blank lines split blockquotes in CommonMark but not in
+            # Python-Markdown
+            if previous != "quote" and (previous != "blank" or lastKind == "quote"):
+                return False
+        else:
+            kind, text = "paragraph", line
+            # No lazy continuation lines in lists and blockquotes
+            if previous in ("item", "quote"):
+                return False
+        if kind != "blank" and not isPlainText(text):
+            return False
+        previous = kind
+        if kind != "blank":
+            lastKind = kind
+    return True
+
+
+def splitFrontMatter(source):
+    """ Returns the front matter of a page (or {}) and the rest of its body,
+        the same way Python-Markdown's preprocessors split them.
+    """
+    lines = source.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    # Whitespace-only lines are emptied before the front matter is read
+    lines = ["" if not line.strip(" ") else line for line in lines]
+    meta, bodyStart = parseFrontMatter(lines)
+    return (meta if meta is not None else {}), "\n".join(lines[bodyStart:])
+
+
+class CommonMarkBackend:
+    """ Converts plain pages with markdown-it-py, set up to produce the
+        same HTML as Python-Markdown with the site's extensions.
+    """
+
+    name = "markdown-it"
+
+    def __init__(self):
+        self.md = MarkdownIt("commonmark", {"xhtmlOut": True, "typographer": True})
+        # Smarty's curly apostrophes; its other replacements are never needed,
+        # since pages which would need them aren't plain
+        self.md.enable("smartquotes")
+
+    def convert(self, body):
+        html = self.md.render(body).rstrip("\n")
+        for character, entity in SMART_ENTITIES.items():
+            html = html.replace(character, entity)
+        return html
+
+
+class Renderer:
+    """ Converts page sources into their metadata and HTML with the backend
+        the page needs.
+
+        Arguments:
+            md is a Markdown object with every extension the site uses
+            backend is "python-markdown" to convert every page with md,
+                or "auto" to convert plain pages with markdown-it-py
+                if it's installed
+    """
+
+    def __init__(self, md, backend="python-markdown"):
+        self.md = md
+        self.backend = backend
+        self.fast = None
+        if backend == "auto" and markdown_it is not None:
+            self.fast = CommonMarkBackend()
+        # How many pages each backend converted
+        self.counts = {}
+
+    def describe(self):
+        """ Changes whenever the choice of backends does.
+        """
+        if self.fast is None:
+            return "python-markdown"
+        return f"auto;markdown-it={markdown_it.__version__}"
+
+    def convert(self, source):
+        """ Returns the metadata and HTML of a page's source.
+        """
+        if self.fast is not None:
+            start = time.perf_counter()
+            meta, body = splitFrontMatter(source)
+            if isPlain(body):
+                html = self.fast.convert(body)
+                self.count(self.fast.name, time.perf_counter() - start)
+                return plainData(meta), html
+        # Without a reset, the previous page's metadata and link references
+        # would leak into this one
+        self.md.reset()
+        html = self.md.convert(source)
+        self.count("python-markdown")
+        return plainData(self.md.Meta), html
+
+    def count(self, name, seconds=None):
+        self.counts[name] = self.counts.get(name, 0) + 1
+        # Shows up in profiles next to Python-Markdown's processors
+        if seconds is not None and hasattr(self.md, "processorTimes"):
+            times = self.md.processorTimes
+            times[name] = times.get(name, 0.0) + seconds
+
+    def takeCounts(self):
+        """ Returns the counts collected since the last call, so they can be
+            added up across worker processes with addCounts().
+        """
+        counts = self.counts
+        self.counts = {}
+        return counts
+
+    def addCounts(self, counts):
+        for name, count in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + count
+
+    def report(self):
+        """ Says how many pages each backend converted since the last report,
+            or returns None if only Python-Markdown is in use.
+        """
+        counts = self.takeCounts()
+        if self.fast is None or not counts:
+            return None
+        return "Converted " + ", ".join(
+            f"{count} pages with {name}" for name, count in sorted(counts.items())
+        )
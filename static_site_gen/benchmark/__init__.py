@@ -0,0 +1,2 @@
+""" Benchmarks of builds of generated sites, for `ssg bench`.
+"""
@@ -0,0 +1,224 @@
+""" Measures how much memory the site's pages take, for `ssg bench --memory`.
+
+    At each scale, a site is generated and indexed the way every build starts
+    (reading the front matter of every page, linking the pages to each other
+    and enriching the site config), and tracemalloc measures what the pages
+    take, and then what the views templates get of them take.
+
+    For comparison, the same pages are also read again and laid out the way
+    they used to be: an object with an attribute dict per page, holding its
+    own copies of the strings in its front matter, and a dict of its
+    template fields for templates to get.
+"""
+
+import dataclasses
+import datetime
+import gc
+import json
+import os
+import platform
+import shutil
+import tempfile
+import tracemalloc
+
+import toml
+
+from ..build import enrichSiteConfig, listGroupFiles, readSiteFiles
+from ..config_structs import (
+    PAGE_TEMPLATE_FIELDS,
+    RelatedConfig,
+    SiteConfig,
+    parseArchives,
+    parseGroups,
+)
+from ..globals import CONFIG_FILE_PATH, PAGE_EXTENSION
+from ..manifest import plainData
+from ..mdExtensions.meta import readFrontMatter
+from ..related import linkPages
+from ..store import PageView
+from .sitegen import generateSite
+
+
+class DictPage:
+    """ A page with its attributes in a dict, like pages used to be.
+    """
+
+
+def tracedBytes(make):
+    """ Calls make(), returning what it returned and how many bytes of what
+        it allocated are still in use.
+    """
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    result = make()
+    gc.collect()
+    return result, tracemalloc.get_traced_memory()[0] - before
+
+
+def dictPages(pagesConfig):
+    """ Reads the pages of the groups in pagesConfig again, laid out the way
+        they used to be. Nothing is shared with the pages readSiteFiles()
+        made, so both take what they would in a build of their own.
+        Returns a dict mapping the path of each page to its copy.
+    """
+    copies = {}
+    for group in pagesConfig:
+        for path in listGroupFiles(group):
+            copies[path] = dictPage(path, group.groupName)
+    return copies
+
+
+def dictPage(path, groupName):
+    meta = plainData(readFrontMatter(path))
+    slug = os.path.splitext(os.path.basename(path))[0]
+    directory = meta["path"] if "path" in meta else os.path.dirname(path)
+    page = DictPage()
+    page.title = meta["title"] if "title" in meta else None
+    page.author = meta["author"] if "author" in meta else None
+    page.date = meta["date"] if "date" in meta else None
+    page.updated = meta["updated"] if "updated" in meta else None
+    page.description = meta["description"] if "description" in meta else None
+    page.template = meta["template"] if "template" in meta else None
+    page.tags = meta["tags"] if "tags" in meta else []
+    page.feed_id = meta["feed_id"] if "feed_id" in meta else None
+    page.extra = meta["extra"] if "extra" in meta else None
+    page.slug = slug
+    page.content = None
+    page.path = path
+    page.url = os.path.join(directory, slug) + PAGE_EXTENSION
+    page.group = groupName
+    page.meta = meta
+    page.sourceHash = None
+    page.contentHash = None
+    page.previous = None
+    page.next = None
+    page.related = []
+    return page
+
+
+def pageViews(content):
+    """ Makes the PageViews templates get, linked to each other
+        like a TemplateContext links them.
+    """
+    views = {id(page): PageView(page) for group in content.values() for page in group}
+    for group in content.values():
+        for page in group:
+            view = views[id(page)]
+            view.previous = views[id(page.previous)] if page.previous else None
+            view.next = views[id(page.next)] if page.next else None
+            view.related = [views[id(other)] for other in page.related]
+    return views
+
+
+def dictViews(content, copies):
+    """ Makes the dicts of template fields templates used to get,
+        linked to each other the same way.
+    """
+    views = {
+        path: {name: getattr(copy, name) for name in PAGE_TEMPLATE_FIELDS}
+        for path, copy in copies.items()
+    }
+    for group in content.values():
+        for page in group:
+            views[page.path].update(
+                previous=views[page.previous.path] if page.previous else None,
+                next=views[page.next.path] if page.next else None,
+                related=[views[other.path] for other in page.related],
+            )
+    return views
+
+
+def measureSite(siteDir):
+    """ Measures the memory the pages of the site in siteDir, and their views,
+        take laid out both ways.
+    """
+    cwd = os.getcwd()
+    os.chdir(siteDir)
+    try:
+        with open(CONFIG_FILE_PATH) as f:
+            config = toml.loads(f.read())
+        pagesConfig = parseGroups(config["pages"] if "pages" in config else {})
+        siteConfig = SiteConfig(config["site"])
+        archives = parseArchives(config["archives"] if "archives" in config else {})
+        relatedConfig = RelatedConfig(config["related"] if "related" in config else {})
+
+        tracemalloc.start()
+        try:
+            content, pageBytes = tracedBytes(lambda: readSiteFiles(pagesConfig))
+            copies, dictPageBytes = tracedBytes(lambda: dictPages(pagesConfig))
+            # The links between pages take the same memory either way
+            enrichSiteConfig(siteConfig, content, archives)
+            linkPages(content, pagesConfig, relatedConfig, silent=True)
+            _, viewBytes = tracedBytes(lambda: pageViews(content))
+            _, dictViewBytes = tracedBytes(lambda: dictViews(content, copies))
+        finally:
+            tracemalloc.stop()
+    finally:
+        os.chdir(cwd)
+    return {
+        "pages": sum(len(group) for group in content.values()),
+        "pageBytes": pageBytes,
+        "viewBytes": viewBytes,
+        "dictPageBytes": dictPageBytes,
+        "dictViewBytes": dictViewBytes,
+    }
+
+
+def runMemoryBenchmark(scales, spec, output=None, workDir=None, silent=False):
+    """ Measures the memory the pages of sites made to spec take at each
+        scale (a number of pages), optionally writing the results to output.
+        Returns the results.
+    """
+    results = {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scales": [],
+    }
+    ownWorkDir = workDir is None
+    if ownWorkDir:
+        workDir = tempfile.mkdtemp(prefix="ssg-bench-")
+    try:
+        if not silent:
+            print(
+                f"{'Pages':>8} {'Layout':<8}{'Per page':>12}{'Per view':>12}"
+                f"{'Total':>10}"
+            )
+        for pages in scales:
+            scaleSpec = dataclasses.replace(spec, pages=pages)
+            siteDir = os.path.join(workDir, f"site-{pages}")
+            generateSite(siteDir, scaleSpec)
+            result = measureSite(siteDir)
+            shutil.rmtree(siteDir)
+            result["spec"] = dataclasses.asdict(scaleSpec)
+            results["scales"].append(result)
+            if not silent:
+                print(describeResult(result))
+    finally:
+        if ownWorkDir:
+            shutil.rmtree(workDir, ignore_errors=True)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote results to {output}")
+    return results
+
+
+def describeResult(result):
+    """ Describes what the pages take laid out each way, and the difference.
+    """
+    count = result["pages"]
+    layouts = (
+        ("dicts", result["dictPageBytes"], result["dictViewBytes"]),
+        ("slots", result["pageBytes"], result["viewBytes"]),
+    )
+    lines = [
+        f"{count:>8} {name:<8}{pageBytes / count:>10.0f} B{viewBytes / count:>10.0f} B"
+        f"{(pageBytes + viewBytes) / 2**20:>7.1f} MB"
+        for name, pageBytes, viewBytes in layouts
+    ]
+    before = layouts[0][1] + layouts[0][2]
+    after = layouts[1][1] + layouts[1][2]
+    lines.append(f"{'':>8} {'saved':<8}{(1 - after / before) * 100:>33.0f}%")
+    return "\n".join(lines)
@@ -0,0 +1,148 @@
+""" Times builds of synthetic sites, for `ssg bench`.
+
+    At each scale, a site is generated and built four times, each in a fresh
+    process so that their peak memory can be measured separately:
+        cold: with no cache directory and no output
+        warm: a full build again, with the caches and output of the first
+        incremental: an incremental build with nothing changed
+        edit: an incremental build after one page was edited
+    The results are written out as JSON, and can be compared with the
+    results of an earlier run.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import dataclasses
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+from ..build import buildSite
+from ..profiling import Profiler
+from ..store import peakMemory
+from .sitegen import generateSite
+
+RUNS = (
+    ("cold", False),
+    ("warm", False),
+    ("incremental", True),
+    ("edit", True),
+)
+
+
+def timeBuild(siteDir, incremental, jobs):
+    """ Builds the site in siteDir, returning how long it took
+        (in total and by phase) and its peak memory.
+        Runs in its own process.
+    """
+    os.chdir(siteDir)
+    profiler = Profiler(traceAllocations=False)
+    start = time.perf_counter()
+    buildSite(silent=True, incremental=incremental, jobs=jobs, profiler=profiler)
+    wall = time.perf_counter() - start
+    own, workers = peakMemory()
+    return {
+        "wall": wall,
+        "phases": {p.name: p.wall for p in profiler.phases},
+        "peakMemory": own,
+        "peakWorkerMemory": workers,
+    }
+
+
+def runBuild(siteDir, incremental, jobs):
+    # Spawned rather than forked, so nothing from earlier builds
+    # (or from this process) counts towards the build's memory
+    with ProcessPoolExecutor(
+        max_workers=1, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        return executor.submit(timeBuild, siteDir, incremental, jobs).result()
+
+
+def benchmarkScale(spec, jobs, workDir, silent=False):
+    """ Generates a site made to spec and times the builds of it.
+    """
+    siteDir = os.path.join(workDir, f"site-{spec.pages}")
+    if os.path.exists(siteDir):
+        shutil.rmtree(siteDir)
+    generateSite(siteDir, spec)
+    # Including the tag pages and the index pages
+    pageCount = spec.pages + spec.tags + 2
+
+    runs = {}
+    for name, incremental in RUNS:
+        if name == "edit":
+            with open(os.path.join(siteDir, "posts", "page0.md"), "a") as f:
+                f.write("\nOne more paragraph.\n")
+        result = runBuild(siteDir, incremental, jobs)
+        result["pagesPerSecond"] = pageCount / result["wall"]
+        runs[name] = result
+        if not silent:
+            print(
+                f"{spec.pages:>8} pages {name:<12}{result['wall']:>9.2f} s"
+                f"{result['pagesPerSecond']:>10.0f} pages/s"
+                f"{result['peakMemory'] / 2**20:>8.0f} MB"
+            )
+    shutil.rmtree(siteDir)
+    return {"pages": pageCount, "spec": dataclasses.asdict(spec), "runs": runs}
+
+
+def runBenchmark(scales, spec, jobs=1, output=None, compare=None, workDir=None):
+    """ Benchmarks builds at each scale (a number of pages) with sites
+        otherwise made to spec, optionally writing the results to output
+        and comparing them with the results in compare.
+        Returns the results.
+    """
+    results = {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "jobs": jobs,
+        "scales": [],
+    }
+    ownWorkDir = workDir is None
+    if ownWorkDir:
+        workDir = tempfile.mkdtemp(prefix="ssg-bench-")
+    try:
+        for pages in scales:
+            scaleSpec = dataclasses.replace(spec, pages=pages)
+            results["scales"].append(benchmarkScale(scaleSpec, jobs, workDir))
+    finally:
+        if ownWorkDir:
+            shutil.rmtree(workDir, ignore_errors=True)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote results to {output}")
+    if compare:
+        with open(compare) as f:
+            print(compareResults(json.load(f), results))
+    return results
+
+
+def compareResults(old, new):
+    """ Describes how the throughput of each run changed between two results.
+    """
+    oldRuns = {
+        (scale["spec"]["pages"], name): run
+        for scale in old["scales"]
+        for name, run in scale["runs"].items()
+    }
+    lines = [f"{'Pages':>8} {'Run':<12}{'Before':>12}{'After':>12}{'Change':>9}"]
+    for scale in new["scales"]:
+        for name, run in scale["runs"].items():
+            key = (scale["spec"]["pages"], name)
+            if key not in oldRuns:
+                continue
+            before = oldRuns[key]["pagesPerSecond"]
+            after = run["pagesPerSecond"]
+            lines.append(
+                f"{key[0]:>8} {name:<12}{before:>10.0f}/s{after:>10.0f}/s"
+                f"{(after / before - 1) * 100:>+8.1f}%"
+            )
+    return "\n".join(lines)
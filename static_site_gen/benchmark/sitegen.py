@@ -0,0 +1,242 @@
+""" Generates synthetic sites to benchmark the generator on.
+
+    The sites are laid out like the example site (and use its templates
+    and assets), with as many groups, pages, tags, code blocks, math blocks,
+    admonitions and assets as asked for. The same spec always generates
+    the same site.
+"""
+
+from dataclasses import dataclass
+import datetime
+import os
+import random
+import shutil
+
+from ..globals import CONFIG_FILE_PATH, EXAMPLE_SITE_DIR
+
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua enim ad minim veniam "
+    "quis nostrud exercitation ullamco laboris nisi aliquip ex ea commodo "
+    "consequat duis aute irure in reprehenderit voluptate velit esse cillum "
+    "fugiat nulla pariatur excepteur sint occaecat cupidatat non proident sunt "
+    "culpa qui officia deserunt mollit anim id est laborum"
+).split()
+LANGUAGES = ("python", "javascript", "c", "rust", "bash")
+ADMONITION_KINDS = ("is-info", "is-warning", "is-danger", "is-success")
+
+
+@dataclass
+class SiteSpec:
+    # The first group is always called posts, since the example templates
+    # list that group; the rest are called notes1, notes2 and so on
+    groups: int = 2
+    # The number of pages across all the groups
+    pages: int = 100
+    tags: int = 30
+    tagsPerPage: int = 3
+    # Pages take turns being written by each author
+    authors: int = 5
+    paragraphs: int = 6
+    wordsPerParagraph: int = 60
+    codeBlocks: int = 1
+    mathBlocks: int = 1
+    admonitions: int = 1
+    assets: int = 20
+    assetBytes: int = 32 * 1024
+    seed: int = 0
+
+
+def groupNames(spec):
+    return ["posts"] + [f"notes{i}" for i in range(1, spec.groups)]
+
+
+def generateSite(directory, spec):
+    """ Writes a site made to spec into directory, which must not exist yet.
+    """
+    rng = random.Random(spec.seed)
+    exampleDir = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "..", "..", EXAMPLE_SITE_DIR
+    )
+    os.makedirs(directory)
+    shutil.copytree(
+        os.path.join(exampleDir, "templates"), os.path.join(directory, "templates")
+    )
+    shutil.copytree(
+        os.path.join(exampleDir, "assets"), os.path.join(directory, "assets")
+    )
+
+    groups = groupNames(spec)
+    with open(os.path.join(directory, CONFIG_FILE_PATH), "w") as f:
+        f.write(makeConfig(groups))
+    writeGeneralPages(directory)
+
+    tags = [f"tag{i}" for i in range(spec.tags)]
+    # A few tags are used a lot and most only a little, like on a real site
+    tagWeights = [1 / (i + 1) for i in range(len(tags))]
+    for tag in tags:
+        with open(os.path.join(directory, "tags", f"{tag}.md"), "w") as f:
+            f.write(
+                frontMatter(
+                    title=tag.title(),
+                    description=f"Posts tagged {tag}",
+                    template="tag.html",
+                )
+                + f'extra = {{tag = "{tag}"}}\n---\n\n'
+                + f"Everything tagged `{tag}`.\n"
+            )
+
+    for group in groups:
+        os.makedirs(os.path.join(directory, group))
+    start = datetime.date(2015, 1, 1)
+    for i in range(spec.pages):
+        group = groups[i % len(groups)]
+        pageTags = set()
+        if tags:
+            while len(pageTags) < min(spec.tagsPerPage, len(tags)):
+                pageTags.add(rng.choices(tags, tagWeights)[0])
+        date = start + datetime.timedelta(days=rng.randrange(365 * 5))
+        author = {"author": f"Author {i % spec.authors}"} if spec.authors else {}
+        with open(os.path.join(directory, group, f"page{i}.md"), "w") as f:
+            f.write(
+                frontMatter(
+                    title=sentence(rng, 5).rstrip("."),
+                    description=sentence(rng, 12),
+                    template="page.html",
+                    **author,
+                )
+                + f"date = {date.isoformat()}\n"
+                + f"tags = {sorted(pageTags)!r}\n---\n\n".replace("'", '"')
+                + makeBody(rng, spec)
+            )
+
+    writeAssets(directory, rng, spec)
+
+
+def makeConfig(groups):
+    lines = [
+        "[site]",
+        'title = "Benchmark Site"',
+        'subtitle = "Generated"',
+        'description = "A synthetic site for benchmarking"',
+        "",
+        "[build]",
+        'buildDirectory = "output"',
+        "",
+        "[templates]",
+        'directories = ["templates"]',
+        "",
+    ]
+    for group in groups:
+        lines += [
+            f"[pages.{group}]",
+            f'directories = ["{group}"]',
+            "sortByDate = true",
+            "sortReverse = true",
+            "",
+        ]
+    lines += [
+        "[pages.general]",
+        'files = ["index.md", "tags.md"]',
+        "",
+        "[pages.tags]",
+        'directories = ["tags"]',
+        "",
+        "[archives.posts]",
+        'group = "posts"',
+        'template = "archive.html"',
+        'path = "posts/page/{page}.html"',
+        'title = "All Posts"',
+        "",
+        "[assets]",
+        'directories = ["assets"]',
+        "",
+    ]
+    return "\n".join(lines)
+
+
+def writeGeneralPages(directory):
+    os.makedirs(os.path.join(directory, "tags"))
+    with open(os.path.join(directory, "index.md"), "w") as f:
+        f.write(
+            frontMatter(title="Benchmark Site", template="page.html")
+            + "---\n\nA synthetic site.\n"
+        )
+    with open(os.path.join(directory, "tags.md"), "w") as f:
+        f.write(frontMatter(title="Tags", template="tag_index.html") + "---\n")
+
+
+def frontMatter(**fields):
+    return "---\n" + "".join(f'{k} = "{v}"\n' for k, v in fields.items())
+
+
+def sentence(rng, length):
+    words = [rng.choice(WORDS) for _ in range(length)]
+    return " ".join(words).capitalize() + "."
+
+
+def makeParagraph(rng, spec):
+    words = []
+    for _ in range(spec.wordsPerParagraph):
+        word = rng.choice(WORDS)
+        roll = rng.random()
+        if roll < 0.03:
+            word = f"**{word}**"
+        elif roll < 0.06:
+            word = f"*{word}*"
+        elif roll < 0.07:
+            word = f"[{word}](https://example.org/{word})"
+        words.append(word)
+    return " ".join(words).capitalize() + "."
+
+
+def makeCodeBlock(rng):
+    language = rng.choice(LANGUAGES)
+    lines = []
+    for _ in range(rng.randrange(5, 20)):
+        name = rng.choice(WORDS)
+        lines.append(f"{name} = compute({rng.choice(WORDS)}, {rng.randrange(1000)})")
+    return f"```{language}\n" + "\n".join(lines) + "\n```"
+
+
+def makeMathBlock(rng):
+    terms = " + ".join(
+        f"{rng.randrange(1, 10)}x_{{{i}}}^{{{rng.randrange(2, 5)}}}"
+        for i in range(rng.randrange(2, 6))
+    )
+    return f"```math\n\\sum_{{i=0}}^{{{rng.randrange(2, 100)}}} {terms}\n```"
+
+
+def makeAdmonition(rng):
+    kind = rng.choice(ADMONITION_KINDS)
+    return f'!!! {kind} "{rng.choice(WORDS).title()}"\n    ' + sentence(rng, 15)
+
+
+def makeBody(rng, spec):
+    blocks = [makeParagraph(rng, spec) for _ in range(spec.paragraphs)]
+    extras = (
+        [makeCodeBlock(rng) for _ in range(spec.codeBlocks)]
+        + [makeMathBlock(rng) for _ in range(spec.mathBlocks)]
+        + [makeAdmonition(rng) for _ in range(spec.admonitions)]
+    )
+    for block in extras:
+        blocks.insert(rng.randrange(len(blocks) + 1), block)
+    return "\n\n".join(blocks) + "\n"
+
+
+def writeAssets(directory, rng, spec):
+    assetsDir = os.path.join(directory, "assets")
+    for i in range(spec.assets):
+        if i % 2 == 0:
+            rules = []
+            while sum(map(len, rules)) < spec.assetBytes:
+                rules.append(
+                    f".{rng.choice(WORDS)}-{i}-{len(rules)} {{ "
+                    f"margin: {rng.randrange(20)}px; "
+                    f"color: #{rng.randrange(4096):03x}; }}\n"
+                )
+            with open(os.path.join(assetsDir, f"generated{i}.css"), "w") as f:
+                f.write("".join(rules))
+        else:
+            with open(os.path.join(assetsDir, f"generated{i}.bin"), "wb") as f:
+                f.write(rng.randbytes(spec.assetBytes))
@@ -3,73 +3,287 @@
     buildSite() is the main method; call it to build the site in the pwd.
 """
 
+from concurrent.futures import ProcessPoolExecutor
+import copy
+import hashlib
 import os
-import shutil
 import sys
+import time
 
-from jinja2 import Environment, FileSystemLoader, select_autoescape
 import markdown
-from markdown_katex import KatexExtension
 import toml
 
 from .mdExtensions.admonition import AdmonitionExtension
-from .mdExtensions.meta import MetaExtension
+from .mdExtensions.highlight import HighlightCacheExtension
+from .mdExtensions.katex import CachedKatexExtension
+from .mdExtensions.meta import MetaExtension, readFrontMatter
 from .globals import *
 from .config_structs import *
+from .cache import *
+from .compress import *
+from .dependencies import *
 from .feed import *
+from .images import *
+from .manifest import *
+from .minify import *
+from .output import *
+from .profiling import *
+from .related import *
+from .search import *
+from .shards import *
+from .archives import *
+from .assets import *
+from .backends import Renderer
+from .store import *
+from .templates import *
 
 
-def readSiteFiles(groups, md):
-    """ Goes through the folders listed in the config
-        and reads all the markdown files in them.
+def readSiteFiles(groups, manifest=None, changedPaths=None, store=None, bodies=None):
+    """ Goes through the folders listed in the config and builds the index
+        of the site: every page's front matter, without converting
+        any of their bodies yet. See convertBodies().
 
         Arguments:
             groups is a list of PagesConfigs
-            md is a Markdown renderer object
+            manifest is the Manifest of the previous build, if any;
+                pages whose source hasn't changed since then are
+                restored from it, converted body and all
+            changedPaths is the set of files known to have changed since
+                the manifest was made, if the caller is watching for changes;
+                other files are then restored without being read at all
+            store is the ContentStore of a streaming build, if any
+            bodies is the ContentStore the manifest's page bodies are kept in,
+                for builds which aren't streaming
 
-        Returns a list of PageInfo structs
+        Returns a dict of lists of PageInfo structs by group name
     """
     global PAGE_EXTENSION
-    content = {}
-
+    content = {group.groupName: [] for group in groups}
     for group in groups:
-        filesList = []
-        for path in group.files:
-            if not os.path.isfile(path):
-                print(f"Couldn't find file {path}")
-                raise FileNotFoundError
-            fileContent = loadPage(path, md, PAGE_EXTENSION)
-            fileContent.group = group.groupName
-            filesList.append(fileContent)
-
-        for topDir in group.directories:
-            for (dirPath, _, childFiles) in os.walk(topDir):
-                for filename in childFiles:
-                    path = os.path.join(dirPath, filename)
-                    if not os.path.isfile(path):
-                        print(f"Couldn't find file {path}")
-                        raise FileNotFoundError
-                    fileContent = loadPage(path, md, PAGE_EXTENSION)
-                    fileContent.group = group.groupName
-                    filesList.append(fileContent)
+        for path in listGroupFiles(group):
+            page = restorePage(path, manifest, changedPaths, store, bodies)
+            if page is None:
+                page = indexPage(path, PAGE_EXTENSION)
+            page.group = group.groupName
+            content[group.groupName].append(page)
 
+    for group in groups:
         if group.sortByDate:
-            filesList.sort(
-                key=lambda x: x.date, reverse=group.sortReverse,
+            content[group.groupName].sort(
+                key=lambda x: (x.date is not None, x.date),
+                reverse=group.sortReverse,
             )
-        content[group.groupName] = filesList
 
     return content
 
 
-def loadPage(path, md, pageExtension):
+def convertBodies(
+    content, renderer, jobs=1, caches=None, store=None, profiler=None, paths=None
+):
+    """ Converts the bodies of the pages in content which weren't restored
+        from the previous build.
+
+        Arguments:
+            content is the dict of pages returned by readSiteFiles()
+            renderer is the Renderer to convert pages with
+            jobs is the number of worker processes to convert pages in
+            caches is the dict of DiskCaches its extensions use, which
+                worker processes open for themselves
+            store is the ContentStore of a streaming build, if any;
+                each page's content is moved into it once it's converted
+            profiler is the Profiler timing the build, if any
+            paths is the set of the source paths of the pages to convert,
+                if not all of them are needed (as in a shard of a build)
+
+        Returns the number of pages converted.
+    """
+    # Indexed pages have no content hash yet (while restored pages in a
+    # streaming build have one, but no content)
+    toConvert = [
+        page
+        for group in content.values()
+        for page in group
+        if page.contentHash is None and (paths is None or page.path in paths)
+    ]
+    paths = [page.path for page in toConvert]
+    for i, converted in convertPages(paths, renderer, jobs, caches, profiler):
+        converted.contentHash = hashBytes(converted.content.encode())
+        if store is not None:
+            store.putContent(converted.content)
+            converted.content = None
+        # The page was indexed from its front matter alone, which is
+        # normally what it was just converted with too; if the file changed
+        # in between, the converted version wins. The indexed page is
+        # updated in place, since the site's indexes (and the pages linked
+        # to it) already refer to it, along with its group and links
+        for name, value in converted.attributes().items():
+            if name != "group" and name not in NAVIGATION_FIELDS:
+                setattr(toConvert[i], name, value)
+    return len(toConvert)
+
+
+def listGroupFiles(group):
+    """ Yields the path of every page in a group, in the order they're listed.
+    """
+    for path in group.files:
+        if not os.path.isfile(path):
+            print(f"Couldn't find file {path}")
+            raise FileNotFoundError
+        yield path
+
+    for topDir in group.directories:
+        for (dirPath, _, childFiles) in os.walk(topDir):
+            for filename in childFiles:
+                path = os.path.join(dirPath, filename)
+                if not os.path.isfile(path):
+                    print(f"Couldn't find file {path}")
+                    raise FileNotFoundError
+                yield path
+
+
+def restorePage(path, manifest, changedPaths=None, store=None, bodies=None):
+    """ Rebuilds a page from the previous build's manifest,
+        or returns None if its source has changed since then
+        (or its content can't be found).
+    """
+    if manifest is None or path not in manifest.pages:
+        return None
+    record = manifest.pages[path]
+    if record.content is None and store is not None:
+        # Streaming builds load the content when it's used
+        if not store.has(record.contentHash):
+            return None
+    if changedPaths is not None and os.path.normpath(path) not in changedPaths:
+        sourceHash = record.sourceHash
+    else:
+        sourceHash = hashFile(path)
+    if record.sourceHash != sourceHash:
+        return None
+    content = record.content
+    if content is None and store is None:
+        data = bodies.get(record.contentHash) if bodies is not None else None
+        if data is None:
+            return None
+        content = data.decode()
+    slug = os.path.splitext(os.path.basename(path))[0]
+    return PageInfo(
+        record.meta,
+        path=path,
+        slug=slug,
+        url=record.url,
+        content=content,
+        sourceHash=sourceHash,
+        contentHash=record.contentHash,
+    )
+
+
+def convertPages(paths, renderer, jobs=1, caches=None, profiler=None):
+    """ Converts the pages at paths, in worker processes if jobs > 1.
+        Yields the index of each path along with its page, as they're done,
+        so callers don't have to hold on to all of them at once.
+        If a Profiler is given, each conversion is timed.
+    """
+    global PAGE_EXTENSION
+    if jobs <= 1 or len(paths) <= 1:
+        if profiler is not None:
+            instrumentMarkdown(renderer.md)
+        for i, path in enumerate(paths):
+            if profiler is None:
+                yield i, convertPage(path, renderer, PAGE_EXTENSION)
+                continue
+            page, timing = timedConvert(
+                lambda: convertPage(path, renderer, PAGE_EXTENSION), renderer.md
+            )
+            profiler.recordConversion(path, timing)
+            yield i, page
+        return
+
+    # Hand out the biggest pages first, so one long page converted at the end
+    # doesn't keep the other workers waiting
+    order = sorted(range(len(paths)), key=lambda i: -os.path.getsize(paths[i]))
+    caches = caches if caches else {}
+    cacheSpecs = {name: c.spec() for name, c in caches.items()}
+    chunksize = max(1, len(paths) // (jobs * 4))
+    with ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=initWorker,
+        initargs=(cacheSpecs, renderer.backend, profiler is not None),
+    ) as executor:
+        results = executor.map(
+            convertInWorker, [paths[i] for i in order], chunksize=chunksize
+        )
+        for i, (page, stats, counts, timing) in zip(order, results):
+            for name, cacheStats in stats.items():
+                caches[name].stats.add(cacheStats)
+            renderer.addCounts(counts)
+            if profiler is not None:
+                profiler.recordConversion(paths[i], timing)
+            yield i, page
+
+
+# Each worker process gets its own Renderer (and Markdown object),
+# since their state can't be shared between pages being converted at once
+workerRenderer = None
+workerCaches = None
+
+
+def initWorker(cacheSpecs, backend, profile=False):
+    global workerRenderer
+    global workerCaches
+    workerCaches = {name: DiskCache(*spec) for name, spec in cacheSpecs.items()}
+    workerRenderer = makeRenderer(workerCaches, backend)[0]
+    if profile:
+        instrumentMarkdown(workerRenderer.md)
+
+
+def convertInWorker(path):
+    """ Converts a page, returning it along with the stats of the caches
+        used while converting it, the backend it was converted with,
+        and how long it took if we're profiling.
+    """
+    global PAGE_EXTENSION
+    timing = None
+    md = workerRenderer.md
+    if hasattr(md, "processorTimes"):
+        page, timing = timedConvert(
+            lambda: convertPage(path, workerRenderer, PAGE_EXTENSION), md
+        )
+    else:
+        page = convertPage(path, workerRenderer, PAGE_EXTENSION)
+    stats = {name: c.takeStats() for name, c in workerCaches.items()}
+    return page, stats, workerRenderer.takeCounts(), timing
+
+
+def convertPage(path, renderer, pageExtension):
+    """ Reads a page from disk and converts it, recording its source hash.
+    """
+    with open(path, "rb") as f:
+        raw = f.read()
+    fileContent = loadPage(path, renderer, pageExtension, body=raw.decode())
+    fileContent.sourceHash = hashBytes(raw)
+    return fileContent
+
+
+def loadPage(path, renderer, pageExtension, body=None):
     """ Loads a markdown file and parses it into a dict of info.
     """
-    with open(path) as f:
-        body = f.read()
+    if body is None:
+        with open(path) as f:
+            body = f.read()
+
+    meta, html = renderer.convert(body)
+    return makePageInfo(path, meta, html, pageExtension)
+
 
-    html = md.convert(body)
-    meta = md.Meta
+def indexPage(path, pageExtension):
+    """ Loads just the front matter of a markdown file, leaving the page's
+        content as None until its body is converted.
+    """
+    meta = plainData(readFrontMatter(path))
+    return makePageInfo(path, meta, None, pageExtension)
+
+
+def makePageInfo(path, meta, content, pageExtension):
     dirname = os.path.dirname(path)
     basename = os.path.basename(path)
     slug = os.path.splitext(basename)[0]
@@ -79,143 +293,892 @@ def loadPage(path, md, pageExtension):
     else:
         url = os.path.join(dirname, slug) + pageExtension
 
-    fileContent = PageInfo(meta, path=path, slug=slug, url=url, content=html,)
+    fileContent = PageInfo(meta, path=path, slug=slug, url=url, content=content,)
     return fileContent
 
 
-def buildAssetFiles(*, assetsConfig, buildConfig):
-    """ Copies asset files into the output directory.
-    """
-    buildDir = buildConfig.buildDirectory
-    try:
-        for f in assetsConfig.files:
-            os.makedirs(os.path.join(buildDir, os.path.dirname(f)), exist_ok=True)
-            shutil.copy(f, os.path.join(buildDir, f))
-    except KeyError:
-        pass
-    try:
-        for d in assetsConfig.directories:
-            for f in os.listdir(d):
-                if os.path.isfile(os.path.join(d, f)):
-                    os.makedirs(os.path.join(buildDir, d), exist_ok=True)
-                    shutil.copy(os.path.join(d, f), os.path.join(buildDir, d, f))
-    except KeyError:
-        pass
-
-
-def buildContentFiles(*, buildConfig, siteConfig, content, templates):
+def buildContentFiles(
+    *,
+    buildConfig,
+    siteConfig,
+    content,
+    templates,
+    pagesToRender=None,
+    writer=None,
+    store=None,
+    context=None,
+    profiler=None,
+):
     """ This renders the pages from the templates and writes them
         into the output directory.
+
+        If pagesToRender is given, only the pages whose source paths
+        are in it are rendered; the rest are kept from the previous build.
+        If store is given, the pages' content is in it, and templates get
+        PageViews which load it when it's used.
+        context is the TemplateContext to render with, if one was made already.
+        profiler is the Profiler timing the build, if any.
+        Returns a dict mapping the source path of each page
+        to the hash of its output (or None, if writer is a Minifier which
+        is still minifying it).
     """
 
-    buildDir = buildConfig.buildDirectory
-    groupsData = {}
-    for groupName, group in content.items():
-        groupsData[groupName] = list(map(PageInfo.forTemplate, group))
-    pagesData = {}
-    for _, group in content.items():
-        for item in group:
-            pagesData[item.slug] = item
+    if writer is None:
+        writer = OutputWriter(buildConfig.buildDirectory, staged=False)
+        writer.begin()
+    if context is None:
+        context = TemplateContext(siteConfig, content, store)
 
+    outputHashes = {}
     for _, group in content.items():
         for page in group:
-            rendered = templates[page.template].render(
-                {
-                    "site": siteConfig,
-                    "pages": pagesData,
-                    "groups": groupsData,
-                    "currentPage": page.forTemplate(),
-                }
-            )
-            path = os.path.join(buildDir, page.url)
-            if not os.path.isdir(os.path.dirname(path)):
-                os.makedirs(os.path.dirname(path))
-            with open(path, "w") as f:
-                f.write(rendered)
-
-
-def loadTempates(templateConfig):
+            if pagesToRender is not None and page.path not in pagesToRender:
+                outputHashes[page.path] = writer.keep(page.url)
+                continue
+            with timeRendering(profiler, page.path) as record:
+                rendered = context.render(templates[page.template], context.view(page))
+                outputHashes[page.path] = writer.write(page.url, rendered)
+                if record is not None:
+                    record.outputBytes = len(rendered.encode())
+    return outputHashes
+
+
+def buildArchiveFiles(
+    *,
+    archives,
+    siteConfig,
+    content,
+    templates,
+    writer,
+    context,
+    fingerprints,
+    previous=None,
+    profiler=None,
+):
+    """ Renders the pages of the archives in the config and writes them
+        into the output directory.
+
+        Pages whose templates, context and listed pages are the same as in
+        the previous build are kept as they are.
+        Returns a dict mapping the url of each archive page to the templates
+        it used and its dependencies, for the manifest.
+    """
+    records = {}
+    for archiveConfig in archives:
+        if archiveConfig.template not in templates:
+            print(
+                f"Config error: archives.{archiveConfig.name} uses "
+                f"unknown template {archiveConfig.template}"
+            )
+            raise KeyError(archiveConfig.template)
+        template = templates[archiveConfig.template]
+        deps = analyseTemplate(template, templates)
+        contextFingerprints = fingerprints.fingerprints(deps)
+        for archivePage in archivePages(archiveConfig, siteConfig, content):
+            dependencies = dict(contextFingerprints)
+            dependencies["archive"] = fingerprints.fingerprintArchive(
+                archivePage, deps
+            )
+            record = (deps.templates, dependencies)
+            if (
+                previous is not None
+                and previous.archives.get(archivePage.url) == record
+                and os.path.isfile(writer.path(archivePage.url))
+            ):
+                writer.keep(archivePage.url)
+            else:
+                with timeRendering(profiler, archivePage.url) as timing:
+                    rendered = context.render(
+                        template, archivePage.forTemplate(context.view)
+                    )
+                    writer.write(archivePage.url, rendered)
+                    if timing is not None:
+                        timing.outputBytes = len(rendered.encode())
+            records[archivePage.url] = record
+    return records
+
+
+class TemplateContext:
+    """ The values every page is rendered with besides currentPage, which are
+        made once per build and shared by every page.
+
+        Pages are given to templates as PageViews, one per page, which read
+        through to the page (and to the ContentStore its content is kept in,
+        if any) rather than copying it.
+    """
+
+    def __init__(self, siteConfig, content, store=None, assets=None, images=None):
+        self.store = store
+        self.asset = assets if assets is not None else AssetIndex()
+        self.srcset = images if images is not None else ImageIndex(self.asset)
+        self.views = {}
+        self.groups = {}
+        for groupName, group in content.items():
+            self.groups[groupName] = [self.view(page) for page in group]
+        self.pages = {}
+        for _, group in content.items():
+            for item in group:
+                self.pages[item.slug] = self.view(item)
+        # Now that every page has a view, each can link to the others' views
+        for group in content.values():
+            for page in group:
+                self.link(page)
+        # The precomputed slices of the site hold pages too
+        self.site = copy.copy(siteConfig)
+        self.site.recent = {
+            groupName: [self.view(page) for page in pages]
+            for groupName, pages in siteConfig.recent.items()
+        }
+        self.site.tagPages = {
+            tag: [self.view(page) for page in pages]
+            for tag, pages in siteConfig.tagPages.items()
+        }
+
+    def view(self, page):
+        if id(page) not in self.views:
+            self.views[id(page)] = PageView(page, self.store)
+        return self.views[id(page)]
+
+    def link(self, page):
+        """ Points the navigation fields of a page's view at the views
+            of the pages it links to.
+        """
+        view = self.view(page)
+        view.previous = self.view(page.previous) if page.previous else None
+        view.next = self.view(page.next) if page.next else None
+        view.related = [self.view(other) for other in page.related]
+
+    def render(self, template, currentPage):
+        return template.render(
+            {
+                "site": self.site,
+                "pages": self.pages,
+                "groups": self.groups,
+                "currentPage": currentPage,
+                "asset": self.asset,
+                "srcset": self.srcset,
+            }
+        )
+
+
+def loadTempates(templateConfig, env=None):
+    """ Loads every template in the config into env (a TemplateEnvironment),
+        timing how long that takes. Returns a dict of the templates by name.
+    """
+    if env is None:
+        env = makeTemplateEnvironment(templateConfig)
+    start = time.perf_counter()
     templates = {}
-    env = Environment(loader=FileSystemLoader(os.curdir))
-    for f in templateConfig.files:
-        templates[os.path.basename(f)] = env.get_template(f)
-    for d in templateConfig.directories:
-        env = Environment(loader=FileSystemLoader(d))
-        for f in os.listdir(d):
-            templates[f] = env.get_template(f)
+    for name in templateMapping(templateConfig):
+        templates[name] = env.get_template(name)
+    env.loadTime += time.perf_counter() - start
     return templates
 
 
-def buildSite(silent=False):
-    """ The main function.
-        Loads configs and builds the website in the pwd.
+def precompileTemplates(silent=False):
+    """ Compiles the templates of the site in the pwd into the bytecode
+        cache, so the next build doesn't have to.
     """
-    # load config
     global CONFIG_FILE_PATH
+    global TEMPLATE_CACHE_DIRECTORY
     with open(CONFIG_FILE_PATH) as f:
         config = toml.loads(f.read())
-    assetsConfig = FilesConfig(config["assets"] if "assets" in config else {})
     buildConfig = BuildConfig(config["build"])
-    pagesConfig = parseGroups(config["pages"] if "pages" in config else {})
-    siteConfig = SiteConfig(config["site"])
     templateConfig = FilesConfig(config["templates"] if "templates" in config else {})
-    feedConfig = FeedConfig(config["feed"] if "feed" in config else {})
-
-    # Load templates
-    templates = loadTempates(templateConfig)
-
-    # init markdown system
-    md = markdown.Markdown(
-        extensions=[
-            "fenced_code",
-            "tables",
-            "codehilite",
-            "smarty",
-            "sane_lists",
-            MetaExtension(),
-            AdmonitionExtension(),
-            KatexExtension(),
-        ]
+    env = makeTemplateEnvironment(
+        templateConfig,
+        os.path.join(buildConfig.cacheDirectory, TEMPLATE_CACHE_DIRECTORY),
+    )
+    templates = loadTempates(templateConfig, env)
+    if not silent:
+        print(env.loadReport(len(templates)))
+
+
+def markdownExtensions(caches=None):
+    """ The markdown extensions every page is converted with.
+        caches is a dict of the DiskCaches they should use.
+    """
+    caches = caches if caches else {}
+    return [
+        "fenced_code",
+        "tables",
+        "codehilite",
+        "smarty",
+        "sane_lists",
+        MetaExtension(),
+        AdmonitionExtension(),
+        CachedKatexExtension(cache=caches.get("katex")),
+        HighlightCacheExtension(cache=caches.get("highlight")),
+    ]
+
+
+def makeRenderer(caches, backend):
+    """ Makes the Renderer pages are converted with, and a string which
+        changes whenever the way it converts them does.
+    """
+    extensions = markdownExtensions(caches)
+    renderer = Renderer(markdown.Markdown(extensions=extensions), backend)
+    return renderer, f"{describeExtensions(extensions)};{renderer.describe()}"
+
+
+def openCaches(buildConfig, cacheConfig):
+    """ Opens the persistent caches used by the markdown extensions,
+        the feeds and the minification, image and compression stages.
+    """
+    global KATEX_CACHE_FILE
+    global HIGHLIGHT_CACHE_FILE
+    global FEED_CACHE_FILE
+    global COMPRESS_CACHE_FILE
+    global MINIFY_CACHE_FILE
+    global IMAGES_CACHE_FILE
+    return {
+        "katex": DiskCache(
+            os.path.join(buildConfig.cacheDirectory, KATEX_CACHE_FILE),
+            cacheConfig.katexMaxBytes,
+        ),
+        "highlight": DiskCache(
+            os.path.join(buildConfig.cacheDirectory, HIGHLIGHT_CACHE_FILE),
+            cacheConfig.highlightMaxBytes,
+            cacheConfig.highlightMemoryBytes,
+        ),
+        "feed": DiskCache(
+            os.path.join(buildConfig.cacheDirectory, FEED_CACHE_FILE),
+            cacheConfig.feedMaxBytes,
+        ),
+        "compress": DiskCache(
+            os.path.join(buildConfig.cacheDirectory, COMPRESS_CACHE_FILE),
+            cacheConfig.compressMaxBytes,
+        ),
+        "minify": DiskCache(
+            os.path.join(buildConfig.cacheDirectory, MINIFY_CACHE_FILE),
+            cacheConfig.minifyMaxBytes,
+        ),
+        "images": DiskCache(
+            os.path.join(buildConfig.cacheDirectory, IMAGES_CACHE_FILE),
+            cacheConfig.imagesMaxBytes,
+        ),
+    }
+
+
+def openContentStore(buildConfig, fileName=None):
+    """ Opens the store streaming builds keep page bodies in.
+        A quarter of the memory limit (if any) goes to keeping
+        recently used bodies in memory.
+    """
+    global CONTENT_STORE_FILE
+    fileName = fileName if fileName else CONTENT_STORE_FILE
+    if buildConfig.memoryLimitBytes:
+        memoryBytes = buildConfig.memoryLimitBytes // 4
+    else:
+        memoryBytes = DEFAULT_CONTENT_MEMORY_BYTES
+    return ContentStore(
+        os.path.join(buildConfig.cacheDirectory, fileName), memoryBytes
     )
 
-    # clear output directory
-    if os.path.exists(buildConfig.buildDirectory):
-        shutil.rmtree(buildConfig.buildDirectory)
+
+def reportMemory(buildConfig, silent):
+    """ Prints the build's peak memory use,
+        warning if it went over the configured limit.
+    """
+    own, workers = peakMemory()
+    limit = buildConfig.memoryLimitBytes
+    if not silent:
+        message = f"Peak memory: {own / 2**20:.0f} MB"
+        if workers:
+            message += f" (largest child process: {workers / 2**20:.0f} MB)"
+        print(message)
+    if limit and max(own, workers) > limit:
+        print(
+            f"Warning: the build used more memory than the limit "
+            f"of {limit / 2**20:.0f} MB"
+        )
+
+
+class BuildState:
+    """ The things a long-running process (like `serve --watch`) keeps around
+        between builds, so they don't have to be loaded again every time.
+
+        With standalone set (as the build daemon does), each build otherwise
+        behaves like a separate `ssg build`: the output is staged, and the
+        manifest is saved to disk.
+    """
+
+    def __init__(self, standalone=False):
+        self.standalone = standalone
+        self.configHash = None
+        self.templates = None
+        self.renderer = None
+        self.caches = None
+        self.extensionsKey = None
+        self.manifest = None
+        self.store = None
+        # The (normalized) paths of the files which changed since the last
+        # build, or None if that isn't known
+        self.changedPaths = None
+        # The size and mtime of the manifest a standalone build saved,
+        # to tell whether another build has replaced it since
+        self.manifestStamp = None
+
+
+def buildSite(
+    silent=False,
+    incremental=False,
+    jobs=1,
+    state=None,
+    profile=False,
+    profiler=None,
+    shard=None,
+):
+    """ The main function.
+        Loads configs and builds the website in the pwd.
+
+        With incremental set, the manifest left behind by the last build is
+        used to only parse and render the pages which changed since then.
+        jobs is the number of processes pages are converted in.
+        state is a BuildState to reuse between builds; when it's given,
+        the manifest is kept in it instead of being saved to disk.
+        With profile set, the build is timed phase by phase and page by page,
+        and the results are printed and saved in the cache directory.
+        Alternatively, a Profiler can be passed in to fill in quietly.
+        shard is the (number, count) of the shard to build, if the build is
+        split across several processes; see shards.py. Each shard builds
+        into a directory of its own, to be merged with mergeShards().
+    """
+    # load config
+    global CONFIG_FILE_PATH
+    global MANIFEST_FILE
+    global TEMPLATE_CACHE_DIRECTORY
+    global PROFILE_DIRECTORY
+    if profile:
+        profiler = Profiler()
+    with profilePhase(profiler, "config"):
+        with open(CONFIG_FILE_PATH, "rb") as f:
+            configBytes = f.read()
+        config = toml.loads(configBytes.decode())
+        assetsConfig = AssetsConfig(config["assets"] if "assets" in config else {})
+        buildConfig = BuildConfig(config["build"])
+        pagesConfig = parseGroups(config["pages"] if "pages" in config else {})
+        siteConfig = SiteConfig(config["site"])
+        templateConfig = FilesConfig(
+            config["templates"] if "templates" in config else {}
+        )
+        feedConfig = FeedConfig(config["feed"]) if "feed" in config else None
+        compressConfig = (
+            CompressConfig(config["compress"]) if "compress" in config else None
+        )
+        minifyConfig = MinifyConfig(config["minify"]) if "minify" in config else None
+        imagesConfig = ImagesConfig(config["images"]) if "images" in config else None
+        searchConfig = SearchConfig(config["search"]) if "search" in config else None
+        relatedConfig = RelatedConfig(config["related"] if "related" in config else {})
+        cacheConfig = CacheConfig(config["cache"] if "cache" in config else {})
+        markdownConfig = MarkdownConfig(
+            config["markdown"] if "markdown" in config else {}
+        )
+        archives = parseArchives(config["archives"] if "archives" in config else {})
+        configHash = hashBytes(configBytes)
+        if shard is not None:
+            buildConfig.buildDirectory = shardDirectory(
+                buildConfig.buildDirectory, *shard
+            )
+
+    changedPaths = None
+    if state is not None and state.configHash == configHash:
+        changedPaths = state.changedPaths
+
+    if changedPaths is None or any(
+        isTemplatePath(path, templateConfig) for path in changedPaths
+    ):
+        # Load templates
+        with profilePhase(profiler, "templates"):
+            templateEnv = makeTemplateEnvironment(
+                templateConfig,
+                os.path.join(buildConfig.cacheDirectory, TEMPLATE_CACHE_DIRECTORY),
+            )
+            templates = loadTempates(templateConfig, templateEnv)
+        if not silent:
+            print(templateEnv.loadReport(len(templates)))
     else:
-        os.mkdir(buildConfig.buildDirectory)
-
-    content = readSiteFiles(pagesConfig, md)
-    enrichSiteConfig(siteConfig, content)
-    buildAssetFiles(assetsConfig=assetsConfig, buildConfig=buildConfig)
-    buildContentFiles(
-        buildConfig=buildConfig,
-        siteConfig=siteConfig,
-        content=content,
-        templates=templates,
+        templates = state.templates
+
+    if (
+        state is not None
+        and state.renderer is not None
+        and state.renderer.backend == markdownConfig.backend
+    ):
+        renderer = state.renderer
+        extensionsKey = state.extensionsKey
+        caches = state.caches
+    else:
+        # init markdown system
+        with profilePhase(profiler, "markdown setup"):
+            if state is not None and state.caches is not None:
+                caches = state.caches
+            else:
+                caches = openCaches(buildConfig, cacheConfig)
+            renderer, extensionsKey = makeRenderer(caches, markdownConfig.backend)
+        if renderer.backend == "auto" and renderer.fast is None and not silent:
+            print(
+                "markdown-it-py isn't installed, so every page is converted "
+                "with Python-Markdown"
+            )
+
+    store = None
+    if buildConfig.streaming:
+        if state is not None and state.store is not None:
+            store = state.store
+        else:
+            store = openContentStore(
+                buildConfig,
+                shardFileName(CONTENT_STORE_FILE, *shard) if shard else None,
+            )
+    # The page bodies saved manifests leave out, which are already in the
+    # store in a streaming build
+    bodies = store
+    if bodies is None:
+        bodies = openContentStore(
+            buildConfig,
+            shardFileName(CONTENT_STORE_FILE, *shard) if shard else None,
+        )
+
+    manifestPath = os.path.join(buildConfig.cacheDirectory, MANIFEST_FILE)
+    if shard is not None:
+        # Kept with the shard's output, which is all merging needs
+        manifestPath = os.path.join(buildConfig.buildDirectory, SHARD_MANIFEST_FILE)
+    manifest = Manifest(configHash=configHash, extensionsKey=extensionsKey)
+    previous = None
+    if incremental:
+        # A standalone build's manifest may have been replaced by another build
+        if (
+            state is not None
+            and state.manifest is not None
+            and (
+                not state.standalone
+                or fileStamp(manifestPath) == state.manifestStamp
+            )
+        ):
+            previous = state.manifest
+        else:
+            with profilePhase(profiler, "load manifest"):
+                previous = loadManifest(manifestPath)
+        if previous is None:
+            reason = "no usable manifest from a previous build"
+        elif previous.configHash != manifest.configHash:
+            reason = f"{CONFIG_FILE_PATH} changed"
+        elif previous.extensionsKey != manifest.extensionsKey:
+            reason = "the markdown extensions changed"
+        elif shard is not None and (
+            previous.shard is None
+            or (previous.shard.number, previous.shard.count) != shard
+        ):
+            reason = "the last build was of a different shard"
+        elif not os.path.isdir(buildConfig.buildDirectory):
+            reason = "the build directory is missing"
+        else:
+            reason = None
+        if reason:
+            if not silent:
+                print(f"Doing a full build: {reason}")
+            previous = None
+            changedPaths = None
+    else:
+        # Without a previous build to compare with, the changes since then
+        # don't matter
+        changedPaths = None
+
+    # Long-running processes write straight into the build directory, since
+    # staging the whole site on every small change would be too slow
+    writer = OutputWriter(
+        buildConfig.buildDirectory,
+        staged=(state is None or state.standalone) and buildConfig.staged,
+        knownHashes=previous.outputs if previous else None,
     )
+    writer.begin()
+    try:
+        manifest = buildOutputs(
+            writer=writer,
+            manifest=manifest,
+            previous=previous,
+            changedPaths=changedPaths,
+            renderer=renderer,
+            caches=caches,
+            jobs=jobs,
+            templates=templates,
+            buildConfig=buildConfig,
+            siteConfig=siteConfig,
+            pagesConfig=pagesConfig,
+            assetsConfig=assetsConfig,
+            feedConfig=feedConfig,
+            compressConfig=compressConfig,
+            minifyConfig=minifyConfig,
+            imagesConfig=imagesConfig,
+            searchConfig=searchConfig,
+            relatedConfig=relatedConfig,
+            archives=archives,
+            silent=silent,
+            store=store,
+            bodies=bodies,
+            profiler=profiler,
+            shard=shard,
+        )
+        with profilePhase(profiler, "commit"):
+            writer.commit()
+            if store is not None:
+                # Drop the bodies of pages which are gone or changed
+                store.retain(
+                    set(record.contentHash for record in manifest.pages.values())
+                )
+    except BaseException:
+        writer.abort()
+        if not writer.staged:
+            # Some outputs may have been rewritten, so the last manifest's
+            # hashes of them can't be trusted by the next build
+            if state is not None:
+                state.manifest = None
+            if os.path.isfile(manifestPath):
+                os.remove(manifestPath)
+        if bodies is not store:
+            bodies.close()
+        raise
+    finally:
+        with profilePhase(profiler, "close caches"):
+            for cache in list(caches.values()) + ([store] if store else []):
+                if state is None:
+                    cache.close()
+                else:
+                    # Long-running processes keep their caches open, so
+                    # they're held to their size limits after every build
+                    cache.flush()
+                    cache.evict()
+    manifest.outputs = writer.hashes
+
+    if state is not None:
+        state.configHash = configHash
+        state.templates = templates
+        state.renderer = renderer
+        state.caches = caches
+        state.extensionsKey = extensionsKey
+        state.manifest = manifest
+        state.store = store
+        state.changedPaths = None
+    if state is None or state.standalone:
+        with profilePhase(profiler, "save manifest"):
+            saveManifest(manifest, manifestPath, bodies)
+            if bodies is not store:
+                # Drop the bodies of pages which are gone or changed
+                bodies.retain(
+                    set(record.contentHash for record in manifest.pages.values())
+                )
+        if state is not None:
+            state.manifestStamp = fileStamp(manifestPath)
+    if bodies is not store:
+        bodies.close()
+
+    backendReport = renderer.report()
+    if not silent:
+        print(writer.summary())
+        if backendReport:
+            print(backendReport)
+        for name, cache in caches.items():
+            if cache.stats.hits or cache.stats.misses:
+                print(f"{name} cache: {cache.stats}")
+                cache.stats = CacheStats()
+    reportMemory(buildConfig, silent)
+    if profile:
+        profiler.stop()
+        print(profiler.report(top=PROFILE_TOP_PAGES))
+        paths = profiler.save(
+            os.path.join(buildConfig.cacheDirectory, PROFILE_DIRECTORY)
+        )
+        print("Wrote profile to {} and {}".format(*paths))
+    return manifest
+
+
+def buildOutputs(
+    *,
+    writer,
+    manifest,
+    previous,
+    changedPaths,
+    renderer,
+    caches,
+    jobs,
+    templates,
+    buildConfig,
+    siteConfig,
+    pagesConfig,
+    assetsConfig,
+    feedConfig,
+    silent,
+    compressConfig=None,
+    minifyConfig=None,
+    imagesConfig=None,
+    searchConfig=None,
+    relatedConfig=None,
+    archives=None,
+    store=None,
+    bodies=None,
+    profiler=None,
+    shard=None,
+):
+    """ Does the actual building for buildSite(), writing everything
+        through writer, and fills in the manifest.
 
-    if feedConfig:
-        makeFeed(
+        A shard only renders the pages it owns, and leaves everything but its
+        pages to the first shard, besides the search index, which is written
+        when the shards are merged.
+    """
+    relatedConfig = relatedConfig if relatedConfig else RelatedConfig({})
+    first = shard is None or shard[0] == 1
+    # The index of the site only needs the pages' front matter,
+    # so it's built before any markdown is converted
+    with profilePhase(profiler, "index"):
+        content = readSiteFiles(
+            pagesConfig,
+            previous,
+            changedPaths=changedPaths,
+            store=store,
+            bodies=bodies,
+        )
+        enrichSiteConfig(siteConfig, content, archives)
+    with profilePhase(profiler, "related"):
+        linkPages(content, pagesConfig, relatedConfig, silent=silent)
+    # The pages this build renders, and the bodies it needs for them
+    ownContent = content
+    toConvert = None
+    if shard is not None:
+        owned = ownedPages(content, *shard)
+        ownContent = {
+            groupName: [page for page in group if page.path in owned]
+            for groupName, group in content.items()
+        }
+        toConvert = pagesToConvert(
+            content=content,
+            owned=owned,
+            templates=templates,
+            archives=archives,
             feedConfig=feedConfig,
+            pagesConfig=pagesConfig,
+            first=first,
+            silent=silent,
+        )
+    with profilePhase(profiler, "convert"):
+        convertBodies(
+            content,
+            renderer,
+            jobs=jobs,
+            caches=caches,
+            store=store,
+            profiler=profiler,
+            paths=toConvert,
+        )
+
+    # Pages, archives and stylesheets are written through the minifier
+    output = writer
+    if minifyConfig:
+        output = Minifier(
+            minifyConfig,
+            writer,
+            cache=caches.get("minify") if caches else None,
+            jobs=jobs,
+        )
+
+    # Assets come first, since their urls are part of the context
+    with profilePhase(profiler, "assets"):
+        manifest.assets, assetIndex = buildAssetFiles(
+            assetsConfig=assetsConfig,
+            writer=output,
+            previous=previous,
+            changedPaths=changedPaths,
+            copy=first,
+            silent=silent,
+        )
+    imageIndex = ImageIndex(assetIndex)
+    if imagesConfig:
+        with profilePhase(profiler, "images"):
+            imageIndex = buildImages(
+                imagesConfig=imagesConfig,
+                assetRecords=manifest.assets,
+                assetIndex=assetIndex,
+                writer=writer,
+                cache=caches.get("images") if caches else None,
+                jobs=jobs,
+                resize=first,
+                silent=silent,
+            )
+
+    # Work out which templates and which parts of the context each page uses
+    with profilePhase(profiler, "dependencies"):
+        templateDeps = {}
+        fingerprints = ContextFingerprints(
+            siteConfig, content, assetIndex, imageIndex
+        )
+        pageDeps = {}
+        for group in ownContent.values():
+            for page in group:
+                if page.template not in templateDeps:
+                    templateDeps[page.template] = analyseTemplate(
+                        templates[page.template], templates
+                    )
+                deps = templateDeps[page.template]
+                pageDeps[page.path] = (
+                    deps.templates,
+                    fingerprints.fingerprints(deps, page),
+                )
+
+    pagesToRender = None
+    if previous is not None:
+        pagesToRender = set()
+        changed = 0
+        for group in ownContent.values():
+            for page in group:
+                record = previous.pages.get(page.path)
+                if record is None or record.sourceHash != page.sourceHash:
+                    changed += 1
+                    pagesToRender.add(page.path)
+                elif (
+                    (record.templates, record.dependencies) != pageDeps[page.path]
+                    or not os.path.isfile(writer.path(page.url))
+                ):
+                    pagesToRender.add(page.path)
+        if not silent:
+            total = sum(len(group) for group in ownContent.values())
+            print(
+                f"{changed} pages changed, "
+                f"rendering {len(pagesToRender)} of {total} pages."
+            )
+
+    with profilePhase(profiler, "content"):
+        context = TemplateContext(siteConfig, content, store, assetIndex, imageIndex)
+        buildContentFiles(
+            buildConfig=buildConfig,
             siteConfig=siteConfig,
-            pages=content,
-            groups="posts",
-            atomFile=os.path.join(buildConfig.buildDirectory, feedConfig.atomPath),
-            rssFile=os.path.join(buildConfig.buildDirectory, feedConfig.rssPath),
+            content=ownContent,
+            templates=templates,
+            pagesToRender=pagesToRender,
+            writer=output,
+            store=store,
+            context=context,
+            profiler=profiler,
+        )
+    if archives and first:
+        with profilePhase(profiler, "archives"):
+            manifest.archives = buildArchiveFiles(
+                archives=archives,
+                siteConfig=siteConfig,
+                content=content,
+                templates=templates,
+                writer=output,
+                context=context,
+                fingerprints=fingerprints,
+                previous=previous,
+                profiler=profiler,
+            )
+
+    if minifyConfig:
+        with profilePhase(profiler, "minify"):
+            output.finish(silent=silent)
+
+    if searchConfig and shard is not None:
+        with profilePhase(profiler, "search"):
+            manifest.search = shardSearchRecords(
+                searchConfig=searchConfig,
+                content=content,
+                owned=owned,
+                previous=previous.search if previous else None,
+                store=store,
+            )
+    elif searchConfig:
+        with profilePhase(profiler, "search"):
+            manifest.search = buildSearchIndex(
+                searchConfig=searchConfig,
+                content=content,
+                writer=writer,
+                previous=previous.search if previous else None,
+                store=store,
+                silent=silent,
+            )
+
+    if feedConfig and first:
+        with profilePhase(profiler, "feed"):
+            writeFeeds(
+                feedConfig=feedConfig,
+                siteConfig=siteConfig,
+                content=content,
+                pagesConfig=pagesConfig,
+                writer=writer,
+                store=store,
+                cache=caches.get("feed") if caches else None,
+            )
+
+    # Last, so that it sees every other output
+    if compressConfig:
+        with profilePhase(profiler, "compress"):
+            compressOutputs(
+                compressConfig=compressConfig,
+                writer=writer,
+                cache=caches.get("compress") if caches else None,
+                jobs=jobs,
+                silent=silent,
+            )
+
+    for group in ownContent.values():
+        for page in group:
+            manifest.pages[page.path] = PageRecord(
+                sourceHash=page.sourceHash,
+                meta=page.meta,
+                template=page.template,
+                url=page.url,
+                outputHash=writer.hashes[os.path.normpath(page.url)],
+                content=page.content,
+                contentHash=page.contentHash,
+                templates=pageDeps[page.path][0],
+                dependencies=pageDeps[page.path][1],
+            )
+    if shard is not None:
+        manifest.shard = ShardRecord(
+            number=shard[0],
+            count=shard[1],
+            indexHash=indexHash(content),
+            pages=tuple(page.path for group in content.values() for page in group),
         )
+    return manifest
+
+
+def isTemplatePath(path, templateConfig):
+    if path in map(os.path.normpath, templateConfig.files):
+        return True
+    for d in templateConfig.directories:
+        if os.path.normpath(os.path.dirname(path)) == os.path.normpath(d):
+            return True
+    return False
 
 
-# Sets the `tags` field in the site config
-def enrichSiteConfig(siteConfig, content):
-    tags = set()
+# Sets the `tags` field in the site config,
+# along with the indexes and slices of the site templates get through `site`
+def enrichSiteConfig(siteConfig, content, archives=None):
+    # Tags are kept in the order they're first seen (rather than in a set) so
+    # that tags with equal counts are always sorted the same way; otherwise
+    # incremental builds would see the site change on every run
     tagCounts = {}
+    tagPages = {}
     for (_, group) in content.items():
         for page in group:
             for tag in page.tags:
-                tags.add(tag)
                 if tag in tagCounts:
                     tagCounts[tag] += 1
+                    tagPages[tag].append(page)
                 else:
                     tagCounts[tag] = 1
-    siteConfig.tags = sorted(list(tags), key=lambda x: tagCounts[x], reverse=True)
+                    tagPages[tag] = [page]
+    siteConfig.tags = sorted(tagCounts, key=lambda x: tagCounts[x], reverse=True)
     siteConfig.tagCounts = tagCounts
+    # The pages with each tag, in the order of their groups
+    siteConfig.tagPages = tagPages
+    # Slices for templates which list a few pages or tags on every page,
+    # so they don't have to loop over the whole site to do it
+    siteConfig.recent = {
+        groupName: group[: siteConfig.recentCount]
+        for groupName, group in content.items()
+    }
+    siteConfig.topTags = siteConfig.tags[: siteConfig.topTagCount]
+    siteConfig.archives = archiveIndex(archives if archives else [], siteConfig)
@@ -0,0 +1,167 @@
+""" A persistent, size-bounded key/value cache kept in the build cache
+    directory, used to avoid redoing expensive work (like rendering math)
+    between builds.
+
+    Entries live in an SQLite database, so several worker processes can share
+    one cache. When the cache grows past its size limit, the least recently
+    used entries are evicted. Caches can also keep recently used entries in
+    memory, up to a separate limit, for values looked up many times a build.
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+import os
+import sqlite3
+import time
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    def add(self, other):
+        self.hits += other.hits
+        self.misses += other.misses
+        self.evictions += other.evictions
+
+    def __str__(self):
+        lookups = self.hits + self.misses
+        rate = 100 * self.hits / lookups if lookups else 0
+        return (
+            f"{self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate), "
+            f"{self.evictions} evicted"
+        )
+
+
+class DiskCache:
+    """ Arguments:
+            path is the SQLite database file to keep the cache in
+            maxBytes is roughly how big the cached values may get in total
+            memoryBytes is how much of them to also keep in memory
+    """
+
+    def __init__(self, path, maxBytes, memoryBytes=0):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.memoryBytes = memoryBytes
+        # Most recently used entries last
+        self.memory = OrderedDict()
+        self.memoryUsed = 0
+        self.stats = CacheStats()
+        # Access times of hits are written in batches
+        self.touched = {}
+        self.connection = None
+
+    def connect(self):
+        if self.connection is None:
+            os.makedirs(os.path.dirname(self.path) or os.curdir, exist_ok=True)
+            # Callers in other threads have to take turns with it,
+            # like the Minifier does when assets are copied through it
+            self.connection = sqlite3.connect(
+                self.path, timeout=60, isolation_level=None, check_same_thread=False
+            )
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value BLOB, size INTEGER, lastUsed REAL)"
+            )
+        return self.connection
+
+    def spec(self):
+        """ The arguments to open this cache again in another process with.
+        """
+        return (self.path, self.maxBytes, self.memoryBytes)
+
+    def get(self, key):
+        """ Returns the cached value for key, or None.
+        """
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.stats.hits += 1
+            self.touched[key] = time.time()
+            return self.memory[key]
+        row = (
+            self.connect()
+            .execute("SELECT value FROM entries WHERE key = ?", (key,))
+            .fetchone()
+        )
+        if row is None:
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        self.touched[key] = time.time()
+        self.remember(key, row[0])
+        return row[0]
+
+    def put(self, key, value):
+        self.connect().execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+            (key, value, len(value), time.time()),
+        )
+        self.remember(key, value)
+
+    def remember(self, key, value):
+        """ Keeps a value in memory, evicting the least recently used ones
+            if that takes us over the memory limit.
+        """
+        if len(value) > self.memoryBytes:
+            return
+        if key in self.memory:
+            self.memoryUsed -= len(self.memory.pop(key))
+        self.memory[key] = value
+        self.memoryUsed += len(value)
+        while self.memoryUsed > self.memoryBytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memoryUsed -= len(evicted)
+
+    def flush(self):
+        """ Records the access times of recent hits.
+        """
+        if self.connection is None or not self.touched:
+            return
+        self.connection.executemany(
+            "UPDATE entries SET lastUsed = ? WHERE key = ?",
+            [(when, key) for key, when in self.touched.items()],
+        )
+        self.touched = {}
+
+    def evict(self):
+        """ Evicts the least recently used entries if the cache is too big.
+        """
+        if self.connection is None:
+            return
+        (total,) = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        if total <= self.maxBytes:
+            return
+        # Evict down to 90% of the limit, so we don't evict on every build
+        excess = total - self.maxBytes * 0.9
+        evicted = []
+        for key, size in self.connection.execute(
+            "SELECT key, size FROM entries ORDER BY lastUsed"
+        ):
+            if excess <= 0:
+                break
+            evicted.append((key,))
+            excess -= size
+        self.connection.executemany("DELETE FROM entries WHERE key = ?", evicted)
+        self.stats.evictions += len(evicted)
+
+    def takeStats(self):
+        """ Flushes the cache and returns the stats collected since the last
+            call, so they can be added up across worker processes.
+        """
+        self.flush()
+        stats = self.stats
+        self.stats = CacheStats()
+        return stats
+
+    def close(self):
+        self.flush()
+        self.evict()
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
@@ -2,18 +2,27 @@
 
     Commands:
         init: create an example site in the pwd
-        build: build the site in the pwd
+        build: build the site in the pwd, or one shard of it
+        merge: merge the shards of a sharded build into the build directory
+        serve: serve the built site from localhost
+        templates precompile: compile the site's templates ahead of a build
+        bench: time builds of generated sites of several sizes
+        parity: check the markdown backends agree on the site's pages
+        daemon start/stop/status: run a build daemon which keeps
+            everything builds load warm between them
+
+    The modules each command needs are imported when it runs, so commands
+    which don't build anything (like init and serve) never load the
+    Markdown stack.
 """
 
-import http.server
-import socketserver
 import os
 import shutil
+import threading
 
 import toml
 import click
 
-from .build import buildSite
 from .globals import *
 
 
@@ -42,26 +51,316 @@ def init(quiet):
 
 @runCli.command()
 @click.option("--quiet", help="Omit standard output.", type=click.BOOL, default=False)
-def build(quiet):
+@click.option(
+    "--incremental",
+    help="Only rebuild the pages which changed since the last build.",
+    is_flag=True,
+)
+@click.option(
+    "--jobs",
+    "-j",
+    help="Number of processes to convert pages in (0 for one per CPU).",
+    type=click.INT,
+    default=1,
+)
+@click.option(
+    "--profile",
+    help="Time each phase of the build, page and markdown processor.",
+    is_flag=True,
+)
+@click.option(
+    "--daemon",
+    "useDaemon",
+    help="Have the build daemon build the site, if it's running.",
+    is_flag=True,
+)
+@click.option("--socket", "socketPath", help="The build daemon's socket.")
+@click.option(
+    "--shard",
+    help="Only build shard i of N (given as i/N), to merge with `ssg merge`.",
+)
+def build(quiet, incremental, jobs, profile, useDaemon, socketPath, shard):
     """ Builds the site at the current working directory.
     """
-    buildSite()
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    if shard:
+        from .shards import parseShard
+
+        shard = parseShard(shard)
+        if useDaemon and not quiet:
+            print("Shards aren't built by the build daemon; building here")
+        useDaemon = False
+    if useDaemon:
+        from .daemon import defaultSocketPath, requestBuild
+
+        socketPath = socketPath if socketPath else defaultSocketPath()
+        succeeded = requestBuild(
+            socketPath,
+            incremental=incremental,
+            jobs=jobs,
+            profile=profile,
+            quiet=quiet,
+        )
+        if succeeded is False:
+            raise SystemExit(1)
+        if succeeded:
+            if not quiet:
+                print("Finished building successfully.")
+            return
+        if not quiet:
+            print(f"No build daemon is listening at {socketPath}; building here")
+
+    from .build import buildSite
+
+    buildSite(
+        silent=quiet,
+        incremental=incremental,
+        jobs=jobs,
+        profile=profile,
+        shard=shard if shard else None,
+    )
 
     if not quiet:
         print("Finished building successfully.")
 
 
+@runCli.command()
+@click.option("--quiet", help="Omit standard output.", type=click.BOOL, default=False)
+@click.option(
+    "--shards", "count", help="The number of shards.", type=click.INT, required=True
+)
+def merge(quiet, count):
+    """ Merges the shards built by `ssg build --shard i/N` into the build
+        directory of the site at the current working directory.
+    """
+    from .shards import mergeShards
+
+    try:
+        mergeShards(count, silent=quiet)
+    except ValueError:
+        raise SystemExit(1)
+
+    if not quiet:
+        print("Finished merging successfully.")
+
+
 @runCli.command()
 @click.option("--port", help="Port to serve from", type=click.INT, default=8000)
-def serve(port):
+@click.option(
+    "--watch",
+    help="Rebuild the site when it changes, and reload open pages.",
+    is_flag=True,
+)
+@click.option(
+    "--cache-mb",
+    "cacheMB",
+    help="How much of the site to keep in memory, in megabytes (0 for none).",
+    type=click.FLOAT,
+    default=64,
+)
+def serve(port, watch, cacheMB):
     """ Serve the current build of the site at the current working directory
         from localhost.
     """
+    from .server import Reloader, makeServer
+
     global CONFIG_FILE_PATH
     with open(CONFIG_FILE_PATH) as f:
         config = toml.loads(f.read())
-    os.chdir(config["build"]["buildDirectory"])
-    handler = http.server.SimpleHTTPRequestHandler
-    with socketserver.TCPServer(("", port), handler) as httpd:
+    buildDir = config["build"]["buildDirectory"]
+    cacheBytes = int(cacheMB * 1024 * 1024)
+
+    if not watch:
+        with makeServer(buildDir, port, cacheBytes=cacheBytes) as httpd:
+            print(f"Serving website at http://localhost:{port}")
+            httpd.serve_forever()
+        return
+
+    from .watch import watchSite
+
+    reloader = Reloader()
+    # The build directory must exist before the server starts
+    os.makedirs(buildDir, exist_ok=True)
+    with makeServer(buildDir, port, reloader, cacheBytes) as httpd:
+        thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        thread.start()
         print(f"Serving website at http://localhost:{port}")
-        httpd.serve_forever()
+        try:
+            watchSite(onRebuild=reloader.notify)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            httpd.shutdown()
+
+
+@runCli.group()
+def templates():
+    """ Manage the site's templates.
+    """
+    pass
+
+
+@templates.command()
+@click.option("--quiet", help="Omit standard output.", type=click.BOOL, default=False)
+def precompile(quiet):
+    """ Compile the templates of the site at the current working directory
+        into the build cache.
+    """
+    from .build import precompileTemplates
+
+    precompileTemplates(silent=quiet)
+
+
+@runCli.command()
+@click.option(
+    "--scales",
+    help="Comma-separated numbers of pages to build sites of.",
+    default="100,1000",
+)
+@click.option("--groups", help="Number of page groups.", type=click.INT, default=2)
+@click.option("--tags", help="Number of distinct tags.", type=click.INT, default=30)
+@click.option("--tags-per-page", type=click.INT, default=3)
+@click.option(
+    "--authors", help="Number of distinct authors.", type=click.INT, default=5
+)
+@click.option("--paragraphs", help="Paragraphs per page.", type=click.INT, default=6)
+@click.option("--code", help="Code blocks per page.", type=click.INT, default=1)
+@click.option("--math", help="Math blocks per page.", type=click.INT, default=1)
+@click.option("--admonitions", help="Admonitions per page.", type=click.INT, default=1)
+@click.option("--assets", help="Number of asset files.", type=click.INT, default=20)
+@click.option(
+    "--jobs",
+    "-j",
+    help="Number of processes to convert pages in (0 for one per CPU).",
+    type=click.INT,
+    default=1,
+)
+@click.option(
+    "--output", help="File to write the results to.", default="benchmark.json"
+)
+@click.option(
+    "--compare",
+    help="Results of an earlier run to compare with.",
+    type=click.Path(exists=True),
+    default=None,
+)
+@click.option(
+    "--memory",
+    help="Measure the memory the pages take instead of timing builds.",
+    is_flag=True,
+)
+def bench(
+    scales,
+    groups,
+    tags,
+    tags_per_page,
+    authors,
+    paragraphs,
+    code,
+    math,
+    admonitions,
+    assets,
+    jobs,
+    output,
+    compare,
+    memory,
+):
+    """ Time cold, warm and incremental builds of generated sites,
+        or measure the memory their pages take.
+    """
+    from .benchmark.sitegen import SiteSpec
+
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    spec = SiteSpec(
+        groups=groups,
+        tags=tags,
+        tagsPerPage=tags_per_page,
+        authors=authors,
+        paragraphs=paragraphs,
+        codeBlocks=code,
+        mathBlocks=math,
+        admonitions=admonitions,
+        assets=assets,
+    )
+    if memory:
+        from .benchmark.memory import runMemoryBenchmark
+
+        runMemoryBenchmark([int(n) for n in scales.split(",")], spec, output=output)
+        return
+
+    from .benchmark.runner import runBenchmark
+
+    runBenchmark(
+        [int(n) for n in scales.split(",")],
+        spec,
+        jobs=jobs,
+        output=output,
+        compare=compare,
+    )
+
+
+@runCli.command()
+@click.option("--quiet", help="Omit standard output.", type=click.BOOL, default=False)
+def parity(quiet):
+    """ Check that markdown-it converts the plain pages of the site
+        at the current working directory (and a set of examples) exactly
+        like Python-Markdown does.
+    """
+    from .parity import runParity
+
+    if runParity(silent=quiet):
+        raise SystemExit(1)
+
+
+@runCli.group()
+def daemon():
+    """ Run or control the build daemon.
+    """
+    pass
+
+
+@daemon.command()
+@click.option("--socket", "socketPath", help="The socket to listen on.")
+def start(socketPath):
+    """ Run a build daemon in the foreground, which `ssg build --daemon`
+        hands builds to.
+    """
+    from .daemon import BuildDaemon, defaultSocketPath
+
+    BuildDaemon(socketPath if socketPath else defaultSocketPath()).serve()
+
+
+@daemon.command()
+@click.option("--socket", "socketPath", help="The build daemon's socket.")
+def stop(socketPath):
+    """ Stop the build daemon.
+    """
+    from .daemon import defaultSocketPath, request
+
+    socketPath = socketPath if socketPath else defaultSocketPath()
+    if request(socketPath, {"command": "stop"}) is None:
+        print(f"No build daemon is listening at {socketPath}")
+        raise SystemExit(1)
+    print("Build daemon stopped.")
+
+
+@daemon.command()
+@click.option("--socket", "socketPath", help="The build daemon's socket.")
+def status(socketPath):
+    """ Show whether the build daemon is running, and which sites it has warm.
+    """
+    from .daemon import defaultSocketPath, request
+
+    socketPath = socketPath if socketPath else defaultSocketPath()
+    response = request(socketPath, {"command": "status"})
+    if response is None:
+        print(f"No build daemon is listening at {socketPath}")
+        raise SystemExit(1)
+    print(
+        f"Build daemon {response['pid']} listening at {socketPath}, up for "
+        f"{response['uptime']:.0f} s, has built {response['builds']} times"
+    )
+    for site in response["sites"]:
+        print(f"    {site}")
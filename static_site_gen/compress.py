@@ -0,0 +1,142 @@
+""" Writes precompressed .gz and .br siblings of the build's output files,
+    for web servers which serve those when the client accepts them
+    (like nginx's gzip_static and brotli_static).
+
+    Compressing the same contents with the same settings always gives the
+    same file, so a cache in the build cache directory maps the hash of a
+    file's contents to the hash of its compressed sibling. Siblings which
+    are already in the output with that hash are kept as they are, and only
+    the files whose contents changed are compressed again.
+
+    Brotli needs the brotli package; without it, only .gz files are written.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import gzip
+import os
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from .manifest import hashBytes
+
+SIBLING_EXTENSIONS = {"gzip": ".gz", "brotli": ".br"}
+
+
+def compressionLevel(compressConfig, compression):
+    if compression == "gzip":
+        return compressConfig.gzipLevel
+    return compressConfig.brotliQuality
+
+
+def compressFile(source, dest, compression, level):
+    """ Compresses the file at source into dest.
+        Returns the hash of the compressed file, or None (writing nothing)
+        if compressing doesn't make the file any smaller.
+    """
+    with open(source, "rb") as f:
+        data = f.read()
+    if compression == "gzip":
+        # No timestamp, so the same contents always compress the same way
+        compressed = gzip.compress(data, compresslevel=level, mtime=0)
+    else:
+        compressed = brotli.compress(data, quality=level)
+    if len(compressed) >= len(data):
+        return None
+    with open(dest, "wb") as f:
+        f.write(compressed)
+    return hashBytes(compressed)
+
+
+def compressInWorker(args):
+    return compressFile(*args)
+
+
+def compressOutputs(
+    *, compressConfig, writer, cache=None, jobs=1, paths=None, silent=False
+):
+    """ Writes compressed siblings of every compressible file in the output
+        (everything written or kept by writer so far).
+
+        Arguments:
+            paths limits the files looked at to those (relative) paths
+            cache is the DiskCache of the hashes of compressed siblings
+            jobs is the number of worker processes to compress files in
+    """
+    start = time.perf_counter()
+    if compressConfig.formats is None:
+        compressions = ["gzip"] + (["brotli"] if brotli is not None else [])
+    else:
+        compressions = list(compressConfig.formats)
+        if "brotli" in compressions and brotli is None:
+            if not silent:
+                print(
+                    "The brotli package isn't installed, so no .br files are written"
+                )
+            compressions.remove("brotli")
+
+    # The bytes before and after compression, by compression
+    before = {compression: 0 for compression in compressions}
+    after = {compression: 0 for compression in compressions}
+    toCompress = []
+    kept = 0
+    for relPath in sorted(writer.hashes if paths is None else paths):
+        if os.path.splitext(relPath)[1] not in compressConfig.extensions:
+            continue
+        size = os.path.getsize(writer.path(relPath))
+        if size < compressConfig.minBytes:
+            continue
+        for compression in compressions:
+            sibling = relPath + SIBLING_EXTENSIONS[compression]
+            level = compressionLevel(compressConfig, compression)
+            key = f"{compression}:{level}:{writer.hashes[relPath]}"
+            cached = cache.get(key) if cache is not None else None
+            if cached == b"":
+                # Known not to get any smaller
+                continue
+            if cached is not None and cached.decode() == writer.existingHash(sibling):
+                writer.keep(sibling)
+                kept += 1
+                before[compression] += size
+                after[compression] += os.path.getsize(writer.path(sibling))
+                continue
+            toCompress.append((relPath, sibling, compression, level, key, size))
+
+    argsList = [
+        (writer.path(relPath), writer.tempPath(sibling), compression, level)
+        for relPath, sibling, compression, level, _, _ in toCompress
+    ]
+    if jobs > 1 and len(argsList) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            chunksize = max(1, len(argsList) // (jobs * 4))
+            results = list(
+                executor.map(compressInWorker, argsList, chunksize=chunksize)
+            )
+    else:
+        results = [compressFile(*args) for args in argsList]
+
+    for (_, sibling, compression, _, key, size), siblingHash in zip(
+        toCompress, results
+    ):
+        if cache is not None:
+            cache.put(key, siblingHash.encode() if siblingHash else b"")
+        if siblingHash is None:
+            continue
+        writer.finishTemp(sibling, siblingHash)
+        before[compression] += size
+        after[compression] += os.path.getsize(writer.path(sibling))
+
+    if not silent and (toCompress or kept):
+        compressed = sum(1 for result in results if result is not None)
+        savings = ", ".join(
+            f"{(before[c] - after[c]) / 1024:.0f} KB saved by {c} "
+            f"({100 * (1 - after[c] / before[c]) if before[c] else 0:.0f}%)"
+            for c in compressions
+        )
+        print(
+            f"Compressed {compressed} files and kept {kept} compressed files "
+            f"in {(time.perf_counter() - start) * 1000:.0f} ms: {savings}"
+        )
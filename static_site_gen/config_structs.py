@@ -3,7 +3,29 @@
 
 from dataclasses import dataclass
 import datetime
-from typing import Any, Dict, List, Optional
+import sys
+from typing import Any, Dict, List, Optional, Set
+
+from .globals import CACHE_DIRECTORY
+
+# The page attributes templates get for each page
+PAGE_TEMPLATE_FIELDS = (
+    "title",
+    "author",
+    "date",
+    "updated",
+    "description",
+    "content",
+    "url",
+    "group",
+    "tags",
+    "extra",
+    "previous",
+    "next",
+    "related",
+)
+# The fields which link to other pages, set by linkPages()
+NAVIGATION_FIELDS = ("previous", "next", "related")
 
 @dataclass
 class SiteConfig:
@@ -19,6 +41,9 @@ class SiteConfig:
             self.description = map["description"]
             self.groups = groups if groups else []
             self.tags = tags if tags else []
+            # The sizes of the site.recent and site.topTags slices
+            self.recentCount = map["recentCount"] if "recentCount" in map else 10
+            self.topTagCount = map["topTagCount"] if "topTagCount" in map else 10
         except KeyError as e:
             print(f"Config error: bad key {e}")
             raise
@@ -27,15 +52,74 @@ class SiteConfig:
 @dataclass
 class BuildConfig:
     buildDirectory: str
+    cacheDirectory: str
+    streaming: bool
+    memoryLimitBytes: Optional[int]
+    staged: bool
 
     def __init__(self, map: Dict[str, Any]):
         try:
             self.buildDirectory = map["buildDirectory"]
+            self.cacheDirectory = (
+                map["cacheDirectory"] if "cacheDirectory" in map else CACHE_DIRECTORY
+            )
+            memoryLimitMB = map["memoryLimitMB"] if "memoryLimitMB" in map else None
+            self.memoryLimitBytes = (
+                int(memoryLimitMB * 1024 * 1024) if memoryLimitMB else None
+            )
+            # Setting a memory limit implies streaming
+            self.streaming = (
+                map["streaming"] if "streaming" in map else bool(memoryLimitMB)
+            )
+            self.staged = map["staged"] if "staged" in map else True
         except KeyError as e:
             print(f"Config error: bad key {e}")
             raise
 
 
+@dataclass
+class CacheConfig:
+    katexMaxBytes: int
+    highlightMaxBytes: int
+    highlightMemoryBytes: int
+    feedMaxBytes: int
+    compressMaxBytes: int
+    minifyMaxBytes: int
+    imagesMaxBytes: int
+
+    def __init__(self, map: Dict[str, Any]):
+        katexMaxMB = map["katexMaxMB"] if "katexMaxMB" in map else 64
+        highlightMaxMB = map["highlightMaxMB"] if "highlightMaxMB" in map else 64
+        highlightMemoryMB = (
+            map["highlightMemoryMB"] if "highlightMemoryMB" in map else 16
+        )
+        self.katexMaxBytes = int(katexMaxMB * 1024 * 1024)
+        self.highlightMaxBytes = int(highlightMaxMB * 1024 * 1024)
+        self.highlightMemoryBytes = int(highlightMemoryMB * 1024 * 1024)
+        feedMaxMB = map["feedMaxMB"] if "feedMaxMB" in map else 16
+        self.feedMaxBytes = int(feedMaxMB * 1024 * 1024)
+        compressMaxMB = map["compressMaxMB"] if "compressMaxMB" in map else 16
+        self.compressMaxBytes = int(compressMaxMB * 1024 * 1024)
+        minifyMaxMB = map["minifyMaxMB"] if "minifyMaxMB" in map else 16
+        self.minifyMaxBytes = int(minifyMaxMB * 1024 * 1024)
+        imagesMaxMB = map["imagesMaxMB"] if "imagesMaxMB" in map else 64
+        self.imagesMaxBytes = int(imagesMaxMB * 1024 * 1024)
+
+
+@dataclass
+class MarkdownConfig:
+    backend: str
+
+    def __init__(self, map: Dict[str, Any]):
+        self.backend = map["backend"] if "backend" in map else "python-markdown"
+        if self.backend not in ("python-markdown", "auto"):
+            print(
+                f"Config error: markdown.backend must be python-markdown or auto, "
+                f"not {self.backend}"
+            )
+            raise ValueError(self.backend)
+
+
 @dataclass
 class FilesConfig:
     files: List[str]
@@ -46,6 +130,27 @@ class FilesConfig:
         self.directories = map["directories"] if "directories" in map else []
 
 
+@dataclass
+class AssetsConfig(FilesConfig):
+    fingerprint: bool
+    manifestPath: str
+    copyMode: str
+
+    def __init__(self, map: Dict[str, Any]):
+        super().__init__(map)
+        self.fingerprint = map["fingerprint"] if "fingerprint" in map else False
+        self.manifestPath = (
+            map["manifestPath"] if "manifestPath" in map else "assets.json"
+        )
+        self.copyMode = map["copyMode"] if "copyMode" in map else "auto"
+        if self.copyMode not in ("auto", "hardlink", "copy"):
+            print(
+                f"Config error: assets.copyMode must be auto, hardlink or copy, "
+                f"not {self.copyMode}"
+            )
+            raise ValueError(self.copyMode)
+
+
 @dataclass
 class PagesConfig(FilesConfig):
     sortByDate: bool
@@ -67,15 +172,82 @@ def parseGroups(groupsDict):
     return groups
 
 
+@dataclass
+class ArchiveConfig:
+    name: str
+    group: str
+    template: str
+    byTag: bool
+    pageSize: int
+    path: str
+    firstPath: str
+    title: str
+
+    def __init__(self, map: Dict[str, Any], name):
+        try:
+            self.name = name
+            self.group = map["group"]
+            self.template = map["template"]
+        except KeyError as e:
+            print(f"Config error: bad key {e} in archives.{name}")
+            raise
+        self.byTag = map["byTag"] if "byTag" in map else False
+        self.pageSize = map["pageSize"] if "pageSize" in map else 10
+        if "path" in map:
+            self.path = map["path"]
+        elif self.byTag:
+            self.path = name + "/{tag}/{page}.html"
+        else:
+            self.path = name + "/{page}.html"
+        self.firstPath = map["firstPath"] if "firstPath" in map else self.path
+        if "title" in map:
+            self.title = map["title"]
+        else:
+            self.title = "{tag}" if self.byTag else name
+
+
+def parseArchives(archivesDict):
+    return [ArchiveConfig(val, key) for key, val in archivesDict.items()]
+
+
 @dataclass
 class PageInfo:
+    """ Everything known about a page. Sites can have a great many pages,
+        so their attributes are kept in slots rather than a dict, and the
+        strings many pages share (like their tags, author and template) are
+        interned.
+        Templates get read-only PageViews of pages rather than copies.
+    """
+
+    __slots__ = (
+        "title",
+        "author",
+        "date",
+        "updated",
+        "description",
+        "template",
+        "tags",
+        "feed_id",
+        "extra",
+        "slug",
+        "content",
+        "path",
+        "url",
+        "group",
+        "meta",
+        "sourceHash",
+        "contentHash",
+        "previous",
+        "next",
+        "related",
+    )
+
     title: str
     author: str
     date: datetime.date
     updated: datetime.date
     description: str
     template: Any
-    content: str
     tags: List[str]
     feed_id: str
     extra: Any
@@ -84,8 +256,26 @@ class PageInfo:
     path: str
     url: str
     group: str
+    meta: Dict[str, Any]
+    sourceHash: str
+    contentHash: str
 
-    def __init__(self, map, *, path, slug, url, content, group=None, iterateOver=None):
+    def __init__(
+        self,
+        map,
+        *,
+        path,
+        slug,
+        url,
+        content,
+        group=None,
+        iterateOver=None,
+        sourceHash=None,
+        contentHash=None,
+    ):
+        # Interned in the front matter itself, so the page's meta shares them
+        for key in ("author", "tags", "template"):
+            internStrings(map, key)
         self.title = map["title"] if "title" in map else None
         self.author = map["author"] if "author" in map else None
         self.date = map["date"] if "date" in map else None
@@ -93,45 +283,210 @@ class PageInfo:
         self.description = map["description"] if "description" in map else None
         self.template = map["template"] if "template" in map else None
         self.tags = map["tags"] if "tags" in map else []
-        self.feed_id = map["feed_id"] if "feed_id" in map else []
+        self.feed_id = map["feed_id"] if "feed_id" in map else None
         self.extra = map["extra"] if "extra" in map else None
         self.slug = slug
         self.content = content
         self.path = path
         self.url = url
-        self.group = group
-
-    def forTemplate(self):
-        return {
-            "title": self.title,
-            "author": self.author,
-            "date": self.date,
-            "updated": self.updated,
-            "description": self.description,
-            "content": self.content,
-            "url": self.url,
-            "group": self.group,
-            "tags": self.tags,
-            "extra": self.extra,
-        }
+        self.group = sys.intern(group) if isinstance(group, str) else group
+        self.meta = map
+        self.sourceHash = sourceHash
+        # Set when the content is kept in a ContentStore instead
+        self.contentHash = contentHash
+        self.previous = None
+        self.next = None
+        self.related = []
+
+    def attributes(self):
+        """ Returns a dict of the page's attributes, like vars() would
+            if pages had a dict of them.
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def internStrings(map, key):
+    """ Interns the string at map[key], or the strings in the list there.
+    """
+    if key not in map:
+        return
+    value = map[key]
+    if isinstance(value, str):
+        map[key] = sys.intern(value)
+    elif isinstance(value, list):
+        value[:] = [sys.intern(v) if isinstance(v, str) else v for v in value]
+
+
+@dataclass
+class CompressConfig:
+    formats: Optional[List[str]]
+    gzipLevel: int
+    brotliQuality: int
+    minBytes: int
+    extensions: List[str]
+
+    def __init__(self, map: Dict[str, Any]):
+        # None means gzip, and brotli too if it's installed
+        self.formats = map["formats"] if "formats" in map else None
+        for compression in self.formats if self.formats else []:
+            if compression not in ("gzip", "brotli"):
+                print(
+                    f"Config error: compress.formats can only hold gzip and brotli, "
+                    f"not {compression}"
+                )
+                raise ValueError(compression)
+        self.gzipLevel = map["gzipLevel"] if "gzipLevel" in map else 9
+        self.brotliQuality = map["brotliQuality"] if "brotliQuality" in map else 11
+        self.minBytes = map["minBytes"] if "minBytes" in map else 1024
+        self.extensions = (
+            map["extensions"]
+            if "extensions" in map
+            else [".html", ".css", ".js", ".json", ".xml", ".svg", ".txt"]
+        )
+
+
+@dataclass
+class MinifyConfig:
+    extensions: List[str]
+
+    def __init__(self, map: Dict[str, Any]):
+        self.extensions = (
+            map["extensions"] if "extensions" in map else [".html", ".css"]
+        )
+        for extension in self.extensions:
+            if extension not in (".html", ".htm", ".css"):
+                print(f"Config error: minify can't minify {extension} files")
+                raise ValueError(extension)
+
+
+@dataclass
+class ImagesConfig:
+    widths: List[int]
+    formats: List[str]
+    quality: int
+    extensions: List[str]
+
+    def __init__(self, map: Dict[str, Any]):
+        self.widths = sorted(map["widths"] if "widths" in map else [480, 960, 1600])
+        for width in self.widths:
+            if not isinstance(width, int) or width <= 0:
+                print(f"Config error: images.widths can't hold {width}")
+                raise ValueError(width)
+        # "original" is whatever format each image is in already
+        self.formats = map["formats"] if "formats" in map else ["original", "webp"]
+        for imageFormat in self.formats:
+            if imageFormat not in ("original", "jpeg", "png", "webp"):
+                print(
+                    f"Config error: images.formats can only hold original, jpeg, "
+                    f"png and webp, not {imageFormat}"
+                )
+                raise ValueError(imageFormat)
+        self.quality = map["quality"] if "quality" in map else 80
+        self.extensions = (
+            map["extensions"] if "extensions" in map else [".jpg", ".jpeg", ".png"]
+        )
+        for extension in self.extensions:
+            if extension not in (".jpg", ".jpeg", ".png", ".webp"):
+                print(f"Config error: images can't resize {extension} files")
+                raise ValueError(extension)
+
+
+@dataclass
+class RelatedConfig:
+    count: int
+    groups: Optional[List[str]]
+
+    def __init__(self, map: Dict[str, Any]):
+        self.count = map["count"] if "count" in map else 5
+        self.groups = map["groups"] if "groups" in map else None
+
+
+# The words left out of the search index unless the config lists its own
+DEFAULT_STOP_WORDS = (
+    "a an and are as at be but by for from has have he her his i if in into is it "
+    "its not of on or our she so that the their them then there these they this "
+    "to was we were what when which who will with you your"
+).split()
+
+
+@dataclass
+class SearchConfig:
+    directory: str
+    groups: Optional[List[str]]
+    prefixLength: int
+    minTermLength: int
+    stopWords: Set[str]
+    boosts: Dict[str, int]
+    descriptions: bool
+
+    def __init__(self, map: Dict[str, Any]):
+        self.directory = map["directory"] if "directory" in map else "search"
+        self.groups = map["groups"] if "groups" in map else None
+        self.prefixLength = map["prefixLength"] if "prefixLength" in map else 2
+        self.minTermLength = map["minTermLength"] if "minTermLength" in map else 2
+        self.stopWords = set(
+            word.lower()
+            for word in (map["stopWords"] if "stopWords" in map else DEFAULT_STOP_WORDS)
+        )
+        self.boosts = {"title": 10, "tags": 5, "description": 3, "content": 1}
+        for field, boost in (map["boosts"] if "boosts" in map else {}).items():
+            if field not in self.boosts:
+                print(
+                    f"Config error: search.boosts can only boost "
+                    f"{', '.join(self.boosts)}, not {field}"
+                )
+                raise KeyError(field)
+            self.boosts[field] = boost
+        self.descriptions = map["descriptions"] if "descriptions" in map else True
+        if self.prefixLength < 1:
+            print("Config error: search.prefixLength must be at least 1")
+            raise ValueError(self.prefixLength)
+
 
 @dataclass
 class FeedConfig:
-    rssPath: str
-    atomPath: str
+    rssPath: Optional[str]
+    atomPath: Optional[str]
     id: str
+    title: Optional[str]
     link: str
     icon: str
+    author: Optional[str]
     contributor: str
     logo: str
     language: str
+    rights: Optional[str]
+    groups: List[str]
+    maxEntries: int
+    fullContent: bool
 
     def __init__(self, map):
-        self.rssPath = map["rssPath"]
-        self.atomPath = map["atomPath"]
-        self.id = map["id"]
+        try:
+            self.id = map["id"]
+        except KeyError as e:
+            print(f"Config error: bad key {e} in feed")
+            raise
+        self.rssPath = map["rssPath"] if "rssPath" in map else None
+        self.atomPath = map["atomPath"] if "atomPath" in map else None
+        if not (self.rssPath or self.atomPath):
+            print("Config error: feed needs an rssPath, an atomPath or both")
+            raise KeyError("atomPath")
+        if self.rssPath == self.atomPath:
+            print("Config error: the RSS and Atom feeds can't have the same path")
+            raise ValueError(self.rssPath)
+        self.title = map["title"] if "title" in map else None
         self.link = map["link"] if "link" in map else None
         self.icon = map["icon"] if "icon" in map else None
+        self.author = map["author"] if "author" in map else None
         self.contributor = map["contributor"] if "contributor" in map else None
         self.logo = map["logo"] if "logo" in map else None
-        self.language = map["language"] if "language" in map else None
\ No newline at end of file
+        self.language = map["language"] if "language" in map else None
+        self.rights = map["rights"] if "rights" in map else None
+        self.groups = map["groups"] if "groups" in map else ["posts"]
+        self.maxEntries = map["maxEntries"] if "maxEntries" in map else 20
+        self.fullContent = map["fullContent"] if "fullContent" in map else True
+
+    def entryKey(self):
+        """ The settings which go into each entry of a feed.
+        """
+        return repr((self.id, self.link, self.author, self.fullContent))
@@ -0,0 +1,287 @@
+""" A build daemon, which keeps everything a build loads before it touches
+    any pages (the Markdown stack, the templates, the markdown pipeline,
+    the caches and the last manifest) in memory between builds, and takes
+    build requests over a Unix socket. Used by `ssg daemon` and
+    `ssg build --daemon`.
+
+    Requests and responses are JSON objects, one per line. A client sends
+    a request like {"command": "build", "directory": ..., "incremental":
+    true}, and gets back the build's output as {"output": ...} messages,
+    then {"status": "ok"} or {"status": "error", "traceback": ...}.
+
+    Builds behave like separate `ssg build` runs (staged output, manifest
+    saved), one at a time. The daemon notes the size and mtime of every
+    source file of each site it builds, so an incremental build knows which
+    files changed since its last one without hashing any of the rest.
+
+    The client half of this module only needs the standard library, so
+    `ssg build --daemon` starts quickly.
+"""
+
+from collections import OrderedDict
+import contextlib
+import json
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from .globals import CONFIG_FILE_PATH, DAEMON_SOCKET_ENV, DAEMON_WARM_SITES
+
+
+def defaultSocketPath():
+    """ The socket the daemon listens on unless told otherwise:
+        $SSG_DAEMON_SOCKET, or one per user in the temp directory.
+    """
+    global DAEMON_SOCKET_ENV
+    if os.environ.get(DAEMON_SOCKET_ENV):
+        return os.environ[DAEMON_SOCKET_ENV]
+    return os.path.join(tempfile.gettempdir(), f"ssg-daemon-{os.getuid()}.sock")
+
+
+def sendMessage(connection, message):
+    connection.sendall((json.dumps(message) + "\n").encode())
+
+
+def readMessages(connection):
+    """ Yields the messages sent over connection until it's closed.
+    """
+    with connection.makefile("rb") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def request(socketPath, message):
+    """ Sends a request to the daemon, printing any output it sends back.
+        Returns its final response, or None if no daemon is listening.
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socketPath)
+    except (FileNotFoundError, ConnectionRefusedError):
+        connection.close()
+        return None
+    with connection:
+        sendMessage(connection, message)
+        for response in readMessages(connection):
+            if "output" in response:
+                sys.stdout.write(response["output"])
+                sys.stdout.flush()
+            else:
+                return response
+    return {"status": "error", "traceback": "The daemon closed the connection\n"}
+
+
+def requestBuild(socketPath, incremental=False, jobs=1, profile=False, quiet=False):
+    """ Asks the daemon to build the site in the pwd.
+        Returns whether it succeeded, or None if no daemon is listening.
+    """
+    response = request(
+        socketPath,
+        {
+            "command": "build",
+            "directory": os.getcwd(),
+            "incremental": incremental,
+            "jobs": jobs,
+            "profile": profile,
+            "quiet": quiet,
+        },
+    )
+    if response is None:
+        return None
+    if response["status"] != "ok":
+        sys.stderr.write(response.get("traceback", ""))
+    return response["status"] == "ok"
+
+
+class OutputStream:
+    """ Stands in for stdout during a build, sending what's printed to the
+        client as it's printed.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def write(self, text):
+        if text:
+            try:
+                sendMessage(self.connection, {"output": text})
+            except OSError:
+                # The client went away, but the build can still finish
+                pass
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+class WarmSite:
+    """ What the daemon keeps for each site it builds.
+    """
+
+    def __init__(self, directory):
+        from .build import BuildState
+
+        self.directory = directory
+        self.state = BuildState(standalone=True)
+        # Notes the size and mtime of the site's sources; None until the
+        # first build, and whenever the config changes
+        self.watcher = None
+
+    def build(self, incremental, jobs, profile, quiet):
+        from .build import buildSite
+        from .watch import PollingWatcher, loadConfig, watchedRoots
+
+        if self.watcher is None:
+            self.state.changedPaths = None
+        else:
+            self.state.changedPaths = self.watcher.wait(timeout=0)
+            if os.path.normpath(CONFIG_FILE_PATH) in self.state.changedPaths:
+                self.watcher = None
+        if self.watcher is None:
+            # Noted before the build, so changes made during it are picked up
+            # by the next one
+            self.watcher = PollingWatcher(watchedRoots(loadConfig()))
+        try:
+            buildSite(
+                silent=quiet,
+                incremental=incremental,
+                jobs=jobs,
+                state=self.state,
+                profile=profile,
+            )
+        except BaseException:
+            # We don't know how far the build got, so the next one has to
+            # check everything
+            self.watcher = None
+            self.state.manifest = None
+            raise
+
+    def close(self):
+        for cache in (self.state.caches or {}).values():
+            cache.close()
+        if self.state.store is not None:
+            self.state.store.close()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            message = json.loads(self.rfile.readline())
+            command = message["command"]
+        except (ValueError, KeyError, TypeError):
+            sendMessage(
+                self.connection, {"status": "error", "traceback": "Bad request\n"}
+            )
+            return
+        if command == "build":
+            self.server.daemon.build(self.connection, message)
+        elif command == "status":
+            sendMessage(self.connection, self.server.daemon.status())
+        elif command == "stop":
+            sendMessage(self.connection, {"status": "ok"})
+            threading.Thread(target=self.server.shutdown).start()
+        else:
+            sendMessage(
+                self.connection,
+                {"status": "error", "traceback": f"Unknown command {command}\n"},
+            )
+
+
+class BuildDaemon:
+    """ Builds sites on request, keeping the last few it built warm.
+    """
+
+    def __init__(self, socketPath):
+        self.socketPath = socketPath
+        self.sites = OrderedDict()
+        # Builds change the pwd and stdout, so only one runs at a time
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.builds = 0
+
+    def build(self, connection, message):
+        global DAEMON_WARM_SITES
+        directory = os.path.realpath(message["directory"])
+        with self.lock:
+            start = time.perf_counter()
+            if directory not in self.sites:
+                self.sites[directory] = WarmSite(directory)
+                if len(self.sites) > DAEMON_WARM_SITES:
+                    _, coldest = self.sites.popitem(last=False)
+                    coldest.close()
+            self.sites.move_to_end(directory)
+            site = self.sites[directory]
+            response = {"status": "ok"}
+            cwd = os.getcwd()
+            try:
+                os.chdir(directory)
+                with contextlib.redirect_stdout(OutputStream(connection)):
+                    site.build(
+                        incremental=bool(message.get("incremental")),
+                        jobs=int(message.get("jobs", 1)),
+                        profile=bool(message.get("profile")),
+                        quiet=bool(message.get("quiet")),
+                    )
+            except (Exception, SystemExit):
+                response = {"status": "error", "traceback": traceback.format_exc()}
+            finally:
+                os.chdir(cwd)
+            self.builds += 1
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f"Built {directory} in {elapsed:.0f} ms ({response['status']})")
+        try:
+            sendMessage(connection, response)
+        except OSError:
+            pass
+
+    def status(self):
+        return {
+            "status": "ok",
+            "pid": os.getpid(),
+            "uptime": time.time() - self.started,
+            "builds": self.builds,
+            "sites": list(self.sites),
+        }
+
+    def serve(self):
+        """ Listens for requests until stopped or interrupted.
+        """
+        if os.path.exists(self.socketPath):
+            if request(self.socketPath, {"command": "status"}) is not None:
+                print(f"A build daemon is already listening at {self.socketPath}")
+                raise SystemExit(1)
+            # Left behind by a daemon which didn't shut down cleanly
+            os.remove(self.socketPath)
+        # Load the Markdown stack before the first request instead of during it
+        from . import build
+
+        server = socketserver.ThreadingUnixStreamServer(
+            self.socketPath, RequestHandler, bind_and_activate=False
+        )
+        server.daemon_threads = True
+        server.daemon = self
+        # Only the user running the daemon may connect to it
+        previousUmask = os.umask(0o177)
+        try:
+            server.server_bind()
+        finally:
+            os.umask(previousUmask)
+        server.server_activate()
+        print(f"Build daemon listening at {self.socketPath}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if os.path.exists(self.socketPath):
+                os.remove(self.socketPath)
+            with self.lock:
+                for site in self.sites.values():
+                    site.close()
+            print("Build daemon stopped")
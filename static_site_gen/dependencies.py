@@ -0,0 +1,272 @@
+""" Works out what each rendered page depends on, so that incremental builds
+    only re-render the pages whose templates or context actually changed.
+
+    Templates are analysed statically: we follow their extends/include/import
+    statements, and look at which parts of the global context (site, pages
+    and groups) they read and which fields they read off other pages.
+    Reading the pages the current page links to (its previous, next and
+    related pages) counts as depending on the "navigation" of the page.
+"""
+
+from dataclasses import dataclass, field
+import hashlib
+from typing import Dict, Optional, Set
+
+from jinja2 import nodes
+import jinja2.meta
+
+from .config_structs import NAVIGATION_FIELDS, PageInfo
+from .manifest import hashFile
+
+# The names of the global values templates get alongside currentPage
+CONTEXT_NAMES = ("site", "pages", "groups", "asset", "srcset")
+
+
+@dataclass
+class TemplateDependencies:
+    # Maps the filename of every template pulled in to the hash of its source
+    templates: Dict[str, str] = field(default_factory=dict)
+    # Which parts of the global context are read, e.g. "site.tags",
+    # "groups.posts", or just "groups" if the whole thing is used
+    context: Set[str] = field(default_factory=set)
+    # The fields read off pages other than currentPage; None means any of them
+    pageFields: Optional[Set[str]] = field(default_factory=set)
+
+
+def analyseTemplate(template, templates):
+    """ Finds everything that a template (and the templates it pulls in)
+        depends on.
+
+        Arguments:
+            template is the jinja2 Template being rendered
+            templates is the dict of every loaded template, which is what
+                we fall back to depending on if a template name is dynamic
+    """
+    deps = TemplateDependencies()
+    env = template.environment
+    toVisit = [template.name]
+    visited = set()
+    while toVisit:
+        name = toVisit.pop()
+        if name in visited:
+            continue
+        visited.add(name)
+
+        source, filename, _ = env.loader.get_source(env, name)
+        deps.templates[filename] = hashFile(filename)
+        ast = env.parse(source)
+
+        for ref in jinja2.meta.find_referenced_templates(ast):
+            if ref is None:
+                # We can't tell which template will be used,
+                # so the page depends on all of them
+                for other in templates.values():
+                    deps.templates[other.filename] = hashFile(other.filename)
+            else:
+                toVisit.append(ref)
+
+        readContext(ast, deps)
+    return deps
+
+
+def readContext(ast, deps):
+    """ Records the parts of the global context and the page fields
+        read anywhere in a template's syntax tree.
+    """
+    qualified = set()
+    for node in ast.find_all((nodes.Getattr, nodes.Getitem)):
+        base = node.node
+        isContext = isinstance(base, nodes.Name) and base.name in CONTEXT_NAMES
+        if isinstance(node, nodes.Getattr):
+            key = node.attr
+        elif isinstance(node.arg, nodes.Const) and isinstance(node.arg.value, str):
+            key = node.arg.value
+        else:
+            key = None
+
+        if isContext and key is not None:
+            deps.context.add(f"{base.name}.{key}")
+            qualified.add(id(base))
+        elif (
+            isinstance(base, nodes.Name)
+            and base.name == "currentPage"
+            and (key is None or key in NAVIGATION_FIELDS)
+        ):
+            # The pages the current page links to, or a dynamic lookup
+            # which might read them
+            deps.context.add("navigation")
+        elif isinstance(base, nodes.Name) and base.name in CONTEXT_NAMES + (
+            "currentPage",
+        ):
+            # Either a dynamic lookup into the context (which is covered by
+            # depending on all of it below), or a field of the current page
+            pass
+        elif key is not None:
+            if deps.pageFields is not None:
+                deps.pageFields.add(key)
+        elif not isRootedAt(base, ("site", "currentPage")):
+            # A dynamic lookup which might read any field of another page
+            deps.pageFields = None
+
+    for node in ast.find_all(nodes.Call):
+        # Assets (and their srcsets) looked up by a constant name only
+        # depend on that asset
+        if (
+            isinstance(node.node, nodes.Name)
+            and node.node.name in ("asset", "srcset")
+            and len(node.args) >= 1
+            and isinstance(node.args[0], nodes.Const)
+            and isinstance(node.args[0].value, str)
+        ):
+            deps.context.add(f"{node.node.name}.{node.args[0].value}")
+            qualified.add(id(node.node))
+
+    for node in ast.find_all((nodes.Filter, nodes.Test)):
+        # Filters like map(attribute="title") or selectattr("tags")
+        for arg in list(node.args) + [kwarg.value for kwarg in node.kwargs]:
+            if isinstance(arg, nodes.Const) and isinstance(arg.value, str):
+                if deps.pageFields is not None:
+                    deps.pageFields.add(arg.value)
+
+    for node in ast.find_all(nodes.Name):
+        if node.name in CONTEXT_NAMES and id(node) not in qualified:
+            deps.context.add(node.name)
+
+
+def isRootedAt(node, names):
+    while isinstance(node, (nodes.Getattr, nodes.Getitem)):
+        node = node.node
+    return isinstance(node, nodes.Name) and node.name in names
+
+
+class ContextFingerprints:
+    """ Hashes the parts of the global context that templates depend on.
+        Results are memoized, since most pages share the same dependencies.
+    """
+
+    def __init__(self, siteConfig, content, assets=None, images=None):
+        self.siteConfig = siteConfig
+        self.content = content
+        self.assets = assets
+        self.images = images
+        self.pagesBySlug = {}
+        for group in content.values():
+            for page in group:
+                self.pagesBySlug[page.slug] = page
+        self.memo = {}
+
+    def fingerprints(self, deps, page=None):
+        """ Returns a dict mapping each context dependency to its hash.
+            page is the page being rendered, whose navigation is hashed
+            if the templates use it.
+        """
+        fields = None if deps.pageFields is None else frozenset(deps.pageFields)
+        result = {}
+        for key in sorted(deps.context):
+            if key == "navigation":
+                result[key] = self.fingerprintNavigation(page, fields)
+            else:
+                result[key] = self.fingerprint(key, fields)
+        return result
+
+    def fingerprintNavigation(self, page, fields):
+        """ Hashes the pages a page links to.
+        """
+        h = hashlib.sha256()
+        if page is not None:
+            for name in NAVIGATION_FIELDS:
+                linked = getattr(page, name)
+                linked = linked if isinstance(linked, list) else [linked]
+                h.update(name.encode())
+                for other in linked:
+                    if other is not None:
+                        h.update(self.describePage(other, fields).encode())
+        return h.hexdigest()
+
+    def fingerprint(self, key, fields):
+        if (key, fields) not in self.memo:
+            h = hashlib.sha256()
+            for part in self.describe(key, fields):
+                h.update(part.encode())
+            self.memo[(key, fields)] = h.hexdigest()
+        return self.memo[(key, fields)]
+
+    def describe(self, key, fields):
+        name, _, member = key.partition(".")
+        if name == "site":
+            if member:
+                yield self.describeValue(getattr(self.siteConfig, member, None), fields)
+            else:
+                yield self.describeValue(
+                    dict(sorted(vars(self.siteConfig).items())), fields
+                )
+        elif name == "groups":
+            for groupName, group in self.content.items():
+                if member and groupName != member:
+                    continue
+                yield groupName
+                for page in group:
+                    yield self.describePage(page, fields)
+        elif name == "pages":
+            for slug, page in self.pagesBySlug.items():
+                if member and slug != member:
+                    continue
+                yield self.describePage(page, fields)
+        elif name == "asset":
+            if self.assets is None:
+                yield ""
+            elif member:
+                yield repr(self.assets.resolve(member))
+            else:
+                yield self.assets.describe()
+        elif name == "srcset":
+            if self.images is None:
+                yield ""
+            elif member:
+                yield self.images.describe(member)
+            else:
+                yield self.images.describe()
+
+    def describeValue(self, value, fields):
+        """ Describes a value from the site config,
+            where any pages in it only count by the fields templates read.
+        """
+        if isinstance(value, PageInfo):
+            return self.describePage(value, fields)
+        if isinstance(value, dict):
+            return repr([(k, self.describeValue(v, fields)) for k, v in value.items()])
+        if isinstance(value, list):
+            return repr([self.describeValue(v, fields) for v in value])
+        return repr(value)
+
+    def fingerprintArchive(self, archivePage, deps):
+        """ Hashes the pages an archive page lists, along with its place
+            in the archive.
+        """
+        fields = None if deps.pageFields is None else frozenset(deps.pageFields)
+        h = hashlib.sha256(archivePage.describe().encode())
+        for page in archivePage.items:
+            h.update(self.describePage(page, fields).encode())
+        return h.hexdigest()
+
+    def describePage(self, page, fields):
+        attrs = page.attributes()
+        names = sorted(attrs if fields is None else fields & attrs.keys())
+        values = [
+            (n, describeLinks(attrs[n]) if n in NAVIGATION_FIELDS else attrs[n])
+            for n in names
+        ]
+        if page.content is None:
+            # The content is in a ContentStore; its hash stands in for it
+            values = [
+                (n, page.contentHash if n == "content" else v) for n, v in values
+            ]
+        return repr((page.slug, values))
+
+
+def describeLinks(linked):
+    """ Pages linked from another page only count by their urls.
+    """
+    if isinstance(linked, list):
+        return [other.url for other in linked]
+    return linked.url if linked is not None else None
@@ -1,67 +1,240 @@
 """ Generates RSS & Atom feeds
+
+    Feeds list the newest pages of the groups in the feed config, at most
+    maxEntries of them, so only those pages are looked at: groups sorted by
+    date are already in order, and the others are searched for their newest
+    pages without sorting them.
+
+    Each entry's XML is kept in a cache keyed by the hashes of the page's
+    source and content, so pages which didn't change aren't serialized
+    again (and in a streaming build, their content isn't even loaded).
+    The feeds are written straight to disk one entry at a time.
 """
 
 import datetime
+import email.utils
+import hashlib
+import heapq
+import itertools
+from xml.sax.saxutils import escape, quoteattr
+
+ATOM_NAMESPACE = "http://www.w3.org/2005/Atom"
+
+
+def writeFeeds(
+    *, feedConfig, siteConfig, content, pagesConfig, writer, store=None, cache=None
+):
+    """ Writes the feeds in the config through writer.
+
+        Arguments:
+            content is the dict of pages by group
+            pagesConfig is the list of PagesConfigs, which say how the groups
+                are sorted
+            store is the ContentStore of a streaming build, if any
+            cache is the DiskCache of serialized entries
+    """
+    entries = selectEntries(feedConfig, content, pagesConfig)
+    if feedConfig.atomPath:
+        with open(writer.tempPath(feedConfig.atomPath), "w") as f:
+            writeAtom(f, feedConfig, siteConfig, entries, store, cache)
+        writer.finishTemp(feedConfig.atomPath)
+    if feedConfig.rssPath:
+        with open(writer.tempPath(feedConfig.rssPath), "w") as f:
+            writeRss(f, feedConfig, siteConfig, entries, store, cache)
+        writer.finishTemp(feedConfig.rssPath)
+
+
+def pageDate(page):
+    """ The date a page was published, as a datetime in UTC.
+    """
+    return toDatetime(page.date)
+
+
+def toDatetime(value):
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime(value.year, value.month, value.day)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+def selectEntries(feedConfig, content, pagesConfig):
+    """ Returns the newest pages of the feed's groups, newest first,
+        leaving out the pages without a date.
+    """
+    sortOrder = {group.groupName: group for group in pagesConfig}
+    newestFirst = []
+    for groupName in feedConfig.groups:
+        if groupName not in content:
+            print(f"Config error: feed lists unknown group {groupName}")
+            raise KeyError(groupName)
+        pages = content[groupName]
+        group = sortOrder[groupName]
+        if group.sortByDate:
+            ordered = pages if group.sortReverse else reversed(pages)
+            newestFirst.append(page for page in ordered if page.date is not None)
+        else:
+            dated = (page for page in pages if page.date is not None)
+            newestFirst.append(
+                heapq.nlargest(feedConfig.maxEntries, dated, key=pageDate)
+            )
+    merged = heapq.merge(*newestFirst, key=pageDate, reverse=True)
+    return list(itertools.islice(merged, feedConfig.maxEntries))
+
+
+def updatedDate(page):
+    return toDatetime(page.updated if page.updated else page.date)
+
+
+def entryId(feedConfig, page):
+    if page.feed_id:
+        return page.feed_id
+    return joinUrl(feedConfig.id, page.url)
+
+
+def entryLink(feedConfig, page):
+    return joinUrl(feedConfig.link if feedConfig.link else feedConfig.id, page.url)
+
 
-from feedgen.feed import FeedGenerator
+def cachedEntry(kind, feedConfig, page, store, cache, serialize):
+    """ Returns the serialized entry for page, from the cache if it's there.
+    """
+    if cache is None:
+        return serialize(feedConfig, page, store)
+    key = hashlib.sha256(
+        repr(
+            (kind, feedConfig.entryKey(), page.sourceHash, page.contentHash, page.url)
+        ).encode()
+    ).hexdigest()
+    entry = cache.get(key)
+    if entry is None:
+        entry = serialize(feedConfig, page, store).encode()
+        cache.put(key, entry)
+    return entry.decode()
 
-def makeFeed(*, feedConfig, siteConfig, pages, groups=None, atomFile=None, rssFile=None):
-    fg = FeedGenerator()
 
-    fg.id = feedConfig.id
-    fg.title = siteConfig.title
-    fg.updated = max(pages, key=lambda x: x.date if x.date else datetime.datetime(1970, 1, 1))
-    if siteConfig.author:
-        fg.author(siteConfig.author)
+def pageContent(page, store):
+    if store is not None:
+        return store.getContent(page)
+    return page.content
+
+
+def element(name, text, indent="    ", **attributes):
+    attrs = "".join(f" {k}={quoteattr(str(v))}" for k, v in attributes.items())
+    return f"{indent}<{name}{attrs}>{escape(str(text))}</{name}>\n"
+
+
+def writeAtom(f, feedConfig, siteConfig, entries, store, cache):
+    f.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+    lang = f" xml:lang={quoteattr(feedConfig.language)}" if feedConfig.language else ""
+    f.write(f'<feed xmlns="{ATOM_NAMESPACE}"{lang}>\n')
+    f.write(element("id", feedConfig.id, "  "))
+    f.write(element("title", feedConfig.title or siteConfig.title, "  "))
+    if siteConfig.subtitle:
+        f.write(element("subtitle", siteConfig.subtitle, "  "))
+    if entries:
+        updated = max(updatedDate(page) for page in entries)
+        f.write(element("updated", updated.isoformat(), "  "))
+    if feedConfig.author:
+        f.write(f"  <author>\n{element('name', feedConfig.author)}  </author>\n")
+    if feedConfig.contributor:
+        f.write(
+            f"  <contributor>\n{element('name', feedConfig.contributor)}"
+            "  </contributor>\n"
+        )
     if feedConfig.link:
-        fg.link(feedConfig.link)
+        f.write(f"  <link href={quoteattr(feedConfig.link)} rel=\"alternate\"/>\n")
+        selfLink = joinUrl(feedConfig.link, feedConfig.atomPath)
+        f.write(f"  <link href={quoteattr(selfLink)} rel=\"self\"/>\n")
     if feedConfig.icon:
-        fg.subtitle(feedConfig.icon)
-    if feedConfig.contributor:
-        fg.contributor(feedConfig.contributor)
+        f.write(element("icon", feedConfig.icon, "  "))
     if feedConfig.logo:
-        fg.subtitle(feedConfig.logo)
-    if siteConfig.rights:
-        fg.subtitle(siteConfig.rights)
-    if siteConfig.subtitle:
-        fg.subtitle(siteConfig.subtitle)
+        f.write(element("logo", feedConfig.logo, "  "))
+    if feedConfig.rights:
+        f.write(element("rights", feedConfig.rights, "  "))
+    for page in entries:
+        f.write(cachedEntry("atom", feedConfig, page, store, cache, atomEntry))
+    f.write("</feed>\n")
+
+
+def atomEntry(feedConfig, page, store):
+    parts = ["  <entry>\n"]
+    parts.append(element("id", entryId(feedConfig, page)))
+    parts.append(element("title", page.title or ""))
+    parts.append(element("updated", updatedDate(page).isoformat()))
+    parts.append(element("published", pageDate(page).isoformat()))
+    author = page.author if page.author else feedConfig.author
+    if author:
+        name = element("name", author, "      ")
+        parts.append(f"    <author>\n{name}    </author>\n")
+    link = quoteattr(entryLink(feedConfig, page))
+    parts.append(f'    <link href={link} rel="alternate"/>\n')
+    for tag in page.tags:
+        parts.append(f"    <category term={quoteattr(str(tag))}/>\n")
+    if page.description:
+        parts.append(element("summary", page.description))
+    if feedConfig.fullContent:
+        parts.append(element("content", pageContent(page, store), type="html"))
+    parts.append("  </entry>\n")
+    return "".join(parts)
+
+
+def writeRss(f, feedConfig, siteConfig, entries, store, cache):
+    f.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+    f.write(f'<rss xmlns:atom="{ATOM_NAMESPACE}" version="2.0">\n  <channel>\n')
+    f.write(element("title", feedConfig.title or siteConfig.title))
+    f.write(element("link", feedConfig.link if feedConfig.link else feedConfig.id))
+    f.write(
+        element("description", siteConfig.subtitle or siteConfig.description or "")
+    )
+    if feedConfig.link:
+        selfLink = quoteattr(joinUrl(feedConfig.link, feedConfig.rssPath))
+        f.write(
+            f'    <atom:link href={selfLink} rel="self" type="application/rss+xml"/>\n'
+        )
     if feedConfig.language:
-        fg.language(siteConfig.language)
-
-    for page in pages:
-        if groups:
-            if page.group not in groups:
-                continue
-        fe = fg.add_entry()
-        if page.id:
-            fe.id(page.feed_id)
-        else:
-            fe.id(joinUrl(feedConfig.id, page.url))
-        fe.title(page.title)
-        fe.updated(page.updated if page.updated else page.date)
-
-        fe.author(page.author if page.author else siteConfig.author)
-        fe.content(page.content)
-        if page.summary:
-            fe.summary(page.summary)
-        if page.contributor:
-            fe.contributor(page.contributor)
-        fe.published(page.date)
-        if page.rights:
-            fe.rights(page.rights)
-        elif siteConfig.rights:
-            fe.rights(siteConfig.rights)
-    
-    if atomFile:
-        fg.atom_file(atomFile)
-    if rssFile:
-        fg.rss_file(rssFile)
-    if not (atomFile or rssFile):
-        raise RuntimeError("You must provide either an atom or an rss output file")
+        f.write(element("language", feedConfig.language))
+    if feedConfig.rights:
+        f.write(element("copyright", feedConfig.rights))
+    if entries:
+        updated = max(updatedDate(page) for page in entries)
+        f.write(element("lastBuildDate", rfc822(updated)))
+    if feedConfig.logo:
+        f.write("    <image>\n")
+        f.write(element("url", feedConfig.logo, "      "))
+        f.write(element("title", feedConfig.title or siteConfig.title, "      "))
+        f.write(
+            element(
+                "link", feedConfig.link if feedConfig.link else feedConfig.id, "      "
+            )
+        )
+        f.write("    </image>\n")
+    for page in entries:
+        f.write(cachedEntry("rss", feedConfig, page, store, cache, rssEntry))
+    f.write("  </channel>\n</rss>\n")
+
+
+def rssEntry(feedConfig, page, store):
+    parts = ["    <item>\n"]
+    parts.append(element("title", page.title or "", "      "))
+    parts.append(element("link", entryLink(feedConfig, page), "      "))
+    parts.append(
+        element("guid", entryId(feedConfig, page), "      ", isPermaLink="false")
+    )
+    parts.append(element("pubDate", rfc822(pageDate(page)), "      "))
+    for tag in page.tags:
+        parts.append(element("category", tag, "      "))
+    if feedConfig.fullContent:
+        parts.append(element("description", pageContent(page, store), "      "))
+    elif page.description:
+        parts.append(element("description", page.description, "      "))
+    parts.append("    </item>\n")
+    return "".join(parts)
+
+
+def rfc822(value):
+    return email.utils.format_datetime(value)
+
 
 def joinUrl(a, b):
-    while a[-1] == '/':
-        a = a[:-1]
-    while b[0] == '/':
-        b = b[1:]
-    return a + "/" + b
\ No newline at end of file
+    return a.rstrip("/") + "/" + b.lstrip("/")
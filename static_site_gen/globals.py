@@ -1,3 +1,21 @@
 EXAMPLE_SITE_DIR = "example-site"
 CONFIG_FILE_PATH = "config.toml"
-PAGE_EXTENSION = ".html"
\ No newline at end of file
+PAGE_EXTENSION = ".html"
+CACHE_DIRECTORY = ".ssg-cache"
+MANIFEST_FILE = "manifest.pickle"
+# Kept in the directory of each shard of a sharded build
+SHARD_MANIFEST_FILE = ".ssg-shard.pickle"
+KATEX_CACHE_FILE = "katex.sqlite"
+HIGHLIGHT_CACHE_FILE = "highlight.sqlite"
+FEED_CACHE_FILE = "feed.sqlite"
+COMPRESS_CACHE_FILE = "compress.sqlite"
+MINIFY_CACHE_FILE = "minify.sqlite"
+IMAGES_CACHE_FILE = "images.sqlite"
+TEMPLATE_CACHE_DIRECTORY = "templates"
+CONTENT_STORE_FILE = "content.sqlite"
+DEFAULT_CONTENT_MEMORY_BYTES = 16 * 1024 * 1024
+PROFILE_DIRECTORY = "profile"
+PROFILE_TOP_PAGES = 10
+ASSET_COPY_THREADS = 8
+DAEMON_SOCKET_ENV = "SSG_DAEMON_SOCKET"
+DAEMON_WARM_SITES = 8
@@ -0,0 +1,331 @@
+""" Makes smaller copies of the site's images, for templates to offer
+    browsers in srcset attributes.
+
+    Every image asset gets a derivative for each configured width narrower
+    than the image itself, in each configured format, named after the
+    asset's output path: assets/trees.jpg gets assets/trees.480w.jpg,
+    assets/trees.480w.webp and so on. Images are resized in worker
+    processes, and a cache in the build cache directory maps the hash of
+    each image (and the settings) to the derivatives it was resized into,
+    and keeps the derivatives' bytes too, so images whose contents didn't
+    change aren't resized again, even into an empty build directory (as
+    long as the cache hasn't evicted them).
+
+    Resizing needs the Pillow package; without it, no derivatives are made,
+    and srcset() just gives the url of the image itself.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import time
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+from .manifest import hashFile
+
+# Bump this whenever resizing gives different files
+IMAGES_VERSION = 1
+# The extension and Pillow format of each format derivatives can be made in
+FORMATS = {
+    "jpeg": (".jpg", "JPEG"),
+    "png": (".png", "PNG"),
+    "webp": (".webp", "WEBP"),
+}
+EXTENSION_FORMATS = {".jpg": "jpeg", ".jpeg": "jpeg", ".png": "png", ".webp": "webp"}
+EXIF_ORIENTATION = 0x0112
+
+
+def derivativePath(relPath, width, imageFormat):
+    """ The output path of the derivative of the image at relPath
+        (in the output) with the given width and format.
+    """
+    base, extension = os.path.splitext(relPath)
+    if imageFormat != "original":
+        extension = FORMATS[imageFormat][0]
+    return f"{base}.{width}w{extension}"
+
+
+def derivativeSpecs(relPath, imagesConfig):
+    """ Lists the path, width and format of every derivative of the image
+        at relPath (in the output), leaving out formats which come out the
+        same as others (like jpeg and original for a .jpg).
+    """
+    specs = {}
+    for imageFormat in imagesConfig.formats:
+        for width in imagesConfig.widths:
+            path = derivativePath(relPath, width, imageFormat)
+            if path not in specs:
+                specs[path] = (path, width, imageFormat)
+    return list(specs.values())
+
+
+def saveImage(image, path, imageFormat, quality):
+    pillowFormat = FORMATS[imageFormat][1]
+    if pillowFormat == "JPEG":
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(path, "JPEG", quality=quality, optimize=True, progressive=True)
+    elif pillowFormat == "WEBP":
+        image.save(path, "WEBP", quality=quality)
+    else:
+        image.save(path, "PNG", optimize=True)
+
+
+def resizeImage(source, derivatives):
+    """ Resizes the image at source into each of derivatives, a list of
+        (path, width, format, quality) tuples, skipping widths the image
+        isn't wider than.
+
+        Returns the image's width and height, and the height and hash of
+        each derivative (or None for those which were skipped).
+    """
+    with Image.open(source) as opened:
+        sourceFormat = EXTENSION_FORMATS[os.path.splitext(source)[1].lower()]
+        # Photos are often stored sideways, with a tag saying which way is up
+        image = ImageOps.exif_transpose(opened)
+        width, height = image.size
+        results = []
+        for path, targetWidth, imageFormat, quality in derivatives:
+            if targetWidth >= width:
+                results.append(None)
+                continue
+            targetHeight = max(1, round(height * targetWidth / width))
+            resized = image.resize((targetWidth, targetHeight), Image.LANCZOS)
+            if imageFormat == "original":
+                imageFormat = sourceFormat
+            saveImage(resized, path, imageFormat, quality)
+            results.append((targetHeight, hashFile(path)))
+    return width, height, results
+
+
+def derivativeKey(derivativeHash):
+    """ The cache key of the bytes of a derivative.
+    """
+    return f"{IMAGES_VERSION}:file:{derivativeHash}"
+
+
+def restoreDerivatives(derivatives, writer, cache):
+    """ Puts the derivatives of an image (from the cache's record of it)
+        in the output: keeps those which are there already, and writes the
+        rest from the bytes in the cache. Returns how many were written, or
+        None (having written nothing) if the cache no longer has them all.
+    """
+    missing = {}
+    for relPath, _, _, _, derivativeHash in derivatives:
+        if writer.existingHash(relPath) != derivativeHash:
+            data = cache.get(derivativeKey(derivativeHash))
+            if data is None:
+                return None
+            missing[relPath] = data
+    for relPath, _, _, _, _ in derivatives:
+        if relPath in missing:
+            writer.write(relPath, missing[relPath])
+        else:
+            writer.keep(relPath)
+    return len(missing)
+
+
+def resizeInWorker(args):
+    return resizeImage(*args)
+
+
+def plannedHeights(source, widths):
+    """ Works out the size of the image at source from its header, and the
+        heights resizeImage() would give it at each of widths (or None for
+        those it would skip), without resizing anything.
+    """
+    with Image.open(source) as opened:
+        width, height = opened.size
+        # Images which exif_transpose() would turn on their side
+        if opened.getexif().get(EXIF_ORIENTATION, 1) in (5, 6, 7, 8):
+            width, height = height, width
+    heights = [
+        max(1, round(height * targetWidth / width)) if targetWidth < width else None
+        for targetWidth in widths
+    ]
+    return width, height, heights
+
+
+class ImageIndex:
+    """ What templates call as srcset(name) to get the srcset of an image,
+        naming it the same way as asset(name). srcset(name, "webp") lists
+        just the webp derivatives, for a <source> in a <picture>; without a
+        format, the derivatives in the image's own format are listed, along
+        with the image itself.
+    """
+
+    def __init__(self, assets, images=None):
+        self.assets = assets
+        # Maps the path of every image to its width, height and format,
+        # and the list of its derivatives' urls, widths, heights and formats
+        self.images = images if images else {}
+
+    def __call__(self, name, imageFormat=None):
+        url = self.assets(name)
+        path = self.assets.lookup(name)
+        if path not in self.images:
+            return url
+        width, _, sourceFormat, derivatives = self.images[path]
+        candidates = [
+            f"{derivativeUrl} {derivativeWidth}w"
+            for derivativeUrl, derivativeWidth, _, derivativeFormat in derivatives
+            if derivativeFormat == (imageFormat or sourceFormat)
+        ]
+        if imageFormat is None or imageFormat == sourceFormat:
+            candidates.append(f"{url} {width}w")
+        return ", ".join(candidates)
+
+    def describe(self, name=None):
+        """ Changes whenever the srcset of an image (or any image,
+            if name is None) does.
+        """
+        if name is None:
+            return repr((self.assets.describe(), sorted(self.images.items())))
+        path = self.assets.lookup(name)
+        return repr((self.assets.resolve(name), self.images.get(path)))
+
+
+def buildImages(
+    *,
+    imagesConfig,
+    assetRecords,
+    assetIndex,
+    writer,
+    cache=None,
+    jobs=1,
+    resize=True,
+    silent=False,
+):
+    """ Writes the derivatives of every image among the assets.
+
+        Arguments:
+            resize says whether to make the derivatives at all; without it,
+                they're only listed in the index (for the shards of a sharded
+                build which don't write them)
+            assetRecords are the records of the assets, from buildAssetFiles()
+            assetIndex is the AssetIndex saying where each asset was written
+            cache is the DiskCache of the derivatives made from each image
+            jobs is the number of worker processes to resize images in
+
+        Returns an ImageIndex of the derivatives.
+    """
+    start = time.perf_counter()
+    index = ImageIndex(assetIndex)
+    images = [
+        path
+        for path in sorted(assetRecords)
+        if os.path.splitext(path)[1].lower() in imagesConfig.extensions
+    ]
+    if not images:
+        return index
+    if Image is None:
+        if not silent:
+            print("Pillow isn't installed, so no smaller images are made")
+        return index
+    if not resize:
+        for path in images:
+            specs = derivativeSpecs(assetIndex.urls[path], imagesConfig)
+            width, height, heights = plannedHeights(
+                path, [targetWidth for _, targetWidth, _ in specs]
+            )
+            derivatives = [
+                (derivative, targetWidth, targetHeight, imageFormat, None)
+                for (derivative, targetWidth, imageFormat), targetHeight in zip(
+                    specs, heights
+                )
+                if targetHeight is not None
+            ]
+            index.images[path] = imageRecord(path, width, height, derivatives)
+        return index
+
+    settings = (imagesConfig.widths, imagesConfig.formats, imagesConfig.quality)
+    # The images which have to be resized, with their cache keys
+    toResize = []
+    kept = 0
+    restored = 0
+    for path in images:
+        # Derivatives are named after the image's path in the output,
+        # which can change (with fingerprinting) even when it doesn't
+        relPath = assetIndex.urls[path]
+        key = f"{IMAGES_VERSION}:{relPath}:{assetRecords[path][2]}:{settings!r}"
+        cached = cache.get(key) if cache is not None else None
+        if cached is not None:
+            width, height, derivatives = json.loads(cached.decode())
+            written = restoreDerivatives(derivatives, writer, cache)
+            if written is not None:
+                kept += len(derivatives) - written
+                restored += written
+                index.images[path] = imageRecord(path, width, height, derivatives)
+                continue
+        toResize.append((path, key))
+
+    argsList = [
+        (
+            path,
+            [
+                (writer.tempPath(derivative), width, imageFormat, imagesConfig.quality)
+                for derivative, width, imageFormat in derivativeSpecs(
+                    assetIndex.urls[path], imagesConfig
+                )
+            ],
+        )
+        for path, _ in toResize
+    ]
+    if jobs > 1 and len(argsList) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(resizeInWorker, argsList))
+    else:
+        results = [resizeImage(*args) for args in argsList]
+
+    resized = 0
+    for (path, key), (width, height, sizes) in zip(toResize, results):
+        specs = derivativeSpecs(assetIndex.urls[path], imagesConfig)
+        derivatives = []
+        for (derivative, targetWidth, imageFormat), size in zip(specs, sizes):
+            if size is None:
+                continue
+            writer.finishTemp(derivative, size[1])
+            if cache is not None:
+                with open(writer.path(derivative), "rb") as f:
+                    cache.put(derivativeKey(size[1]), f.read())
+            derivatives.append(
+                (derivative, targetWidth, size[0], imageFormat, size[1])
+            )
+        resized += len(derivatives)
+        if cache is not None:
+            cache.put(key, json.dumps([width, height, derivatives]).encode())
+        index.images[path] = imageRecord(path, width, height, derivatives)
+
+    if not silent:
+        print(
+            f"Resized {len(toResize)} of {len(images)} images into {resized} "
+            f"smaller images, kept {kept} and restored {restored} from the "
+            f"cache in {(time.perf_counter() - start) * 1000:.0f} ms"
+        )
+    return index
+
+
+def imageRecord(path, width, height, derivatives):
+    """ The ImageIndex's record of an image and its derivatives.
+    """
+    sourceFormat = EXTENSION_FORMATS[os.path.splitext(path)[1].lower()]
+    return (
+        width,
+        height,
+        sourceFormat,
+        [
+            (
+                "/" + relPath.replace(os.sep, "/"),
+                derivativeWidth,
+                derivativeHeight,
+                sourceFormat if imageFormat == "original" else imageFormat,
+            )
+            for relPath, derivativeWidth, derivativeHeight, imageFormat, _ in (
+                derivatives
+            )
+        ],
+    )
@@ -0,0 +1,160 @@
+""" Keeps track of what went into the last build, so that incremental
+    builds can tell which pages need to be parsed and rendered again.
+"""
+
+import dataclasses
+from dataclasses import dataclass, field
+import hashlib
+import os
+import pickle
+from typing import Any, Dict, Optional, Tuple
+
+# Bump this whenever the layout of the manifest changes
+MANIFEST_VERSION = 9
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+@dataclass
+class PageRecord:
+    sourceHash: str
+    meta: Dict[str, Any]
+    template: str
+    url: str
+    outputHash: Optional[str]
+    # Only held in memory: saved manifests keep the content in a ContentStore
+    content: Optional[str]
+    contentHash: Optional[str]
+    # The filenames and hashes of the templates used to render the page
+    templates: Dict[str, str]
+    # The hashes of the parts of the global context the page's templates read
+    dependencies: Dict[str, str]
+
+
+@dataclass
+class ShardRecord:
+    # Which shard of how many the build was, counting from 1
+    number: int
+    count: int
+    # The hash of the index of the site every shard has to share
+    indexHash: str
+    # The source path of every page in the index
+    pages: Tuple[str, ...]
+
+
+@dataclass
+class Manifest:
+    configHash: str
+    extensionsKey: str
+    pages: Dict[str, PageRecord] = field(default_factory=dict)
+    # Maps every file in the build directory to the hash of its contents
+    outputs: Dict[str, str] = field(default_factory=dict)
+    # Maps the url of every generated archive page to the templates it used
+    # and its dependencies, like the fields of a PageRecord
+    archives: Dict[str, Tuple[Dict[str, str], Dict[str, str]]] = field(
+        default_factory=dict
+    )
+    # Maps the path of every asset to its size, mtime and hash
+    assets: Dict[str, Tuple[int, int, str]] = field(default_factory=dict)
+    # Maps the path of every page in the search index to its id there,
+    # its source hash and the scores of its terms by shard
+    search: Dict[str, Tuple[int, str, Dict[str, Dict[str, int]]]] = field(
+        default_factory=dict
+    )
+    # Set for the builds of single shards of a sharded build
+    shard: Optional[ShardRecord] = None
+    version: int = MANIFEST_VERSION
+
+
+def hashBytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hashFile(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        # In chunks, so big files don't have to fit in memory
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def describeExtensions(extensions):
+    """ Builds a string that changes whenever the set of markdown extensions
+        (or their configuration) changes.
+    """
+    # Imported here, since the server uses this module without markdown
+    import markdown
+
+    parts = [f"markdown={markdown.__version__}"]
+    for ext in extensions:
+        if isinstance(ext, str):
+            parts.append(ext)
+        else:
+            configs = sorted(ext.getConfigs().items())
+            parts.append(f"{type(ext).__module__}.{type(ext).__name__}{configs}")
+    return ";".join(parts)
+
+
+def plainData(value):
+    """ Converts the dict and list subclasses the toml parser produces
+        (some of which can't be pickled) into plain dicts and lists.
+    """
+    if isinstance(value, dict):
+        return {k: plainData(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [plainData(v) for v in value]
+    return value
+
+
+def loadManifest(path):
+    """ Returns the manifest stored at path,
+        or None if there isn't a usable one.
+    """
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            manifest = pickle.load(f)
+    except (
+        OSError,
+        pickle.UnpicklingError,
+        EOFError,
+        AttributeError,
+        ImportError,
+        TypeError,
+        ValueError,
+    ):
+        # Corrupt, or written by a version of the generator with other classes
+        return None
+    if not isinstance(manifest, Manifest) or manifest.version != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def fileStamp(path):
+    """ The size and mtime of the file at path, or None if there isn't one.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def saveManifest(manifest, path, store=None):
+    """ Saves manifest to path. The content of its pages is left out,
+        so loading it stays quick: any the records still hold is put into
+        store (a ContentStore) instead.
+    """
+    pages = {}
+    for key, record in manifest.pages.items():
+        if record.content is not None:
+            if store is not None:
+                store.putContent(record.content)
+            record = dataclasses.replace(record, content=None)
+        pages[key] = record
+    os.makedirs(os.path.dirname(path) or os.curdir, exist_ok=True)
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "wb") as f:
+        pickle.dump(dataclasses.replace(manifest, pages=pages), f)
+    os.replace(tmpPath, path)
@@ -0,0 +1,58 @@
+"""
+Active caches for the cache extensions
+======================================
+The KaTeX and highlighting caches work by patching a function which every
+Markdown instance in the process calls, so the patched function has to find
+the cache of the instance calling it. Each instance makes its extension's
+cache the active one (for its thread) when it starts converting a document,
+and clears it when it's done, so several sites built in one process never
+share a cache, and instances without the extension never use one.
+"""
+
+import threading
+
+from markdown.postprocessors import Postprocessor
+from markdown.preprocessors import Preprocessor
+
+
+class ActiveCache:
+    """ The cache of the Markdown instance converting a document in each
+        thread, if it has one.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def get(self):
+        return getattr(self.local, "cache", None)
+
+    def set(self, cache):
+        self.local.cache = cache
+
+    def register(self, md, cache, name):
+        """ Makes md set cache as the active one before anything else
+            converts a document, and clear it after everything else has.
+        """
+        md.preprocessors.register(ActivateCache(self, cache), name, 1000)
+        md.postprocessors.register(ClearCache(self), f"{name}_clear", 0)
+
+
+class ActivateCache(Preprocessor):
+    def __init__(self, active, cache):
+        super().__init__()
+        self.active = active
+        self.cache = cache
+
+    def run(self, lines):
+        self.active.set(self.cache)
+        return lines
+
+
+class ClearCache(Postprocessor):
+    def __init__(self, active):
+        super().__init__()
+        self.active = active
+
+    def run(self, text):
+        self.active.set(None)
+        return text
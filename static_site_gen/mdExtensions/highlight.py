@@ -0,0 +1,106 @@
+"""
+Highlighting cache extension for Python-Markdown
+================================================
+Keeps the HTML Pygments produces for each code block in a cache, so that
+code which was highlighted before (on another page, or in an earlier build)
+isn't lexed and formatted again.
+
+Both the codehilite and fenced_code extensions highlight code through
+CodeHilite.hilite(), so that's what gets wrapped. Entries are keyed by
+everything hilite() looks at (the code, its language, and the lexer and
+formatter options) along with the Pygments and Markdown versions,
+so the cached HTML is exactly what Pygments would have produced.
+
+hilite() is patched once for every Markdown instance; like the KaTeX cache,
+each instance keeps its own cache on its extension, and makes it the active
+one while it converts a document (see activeCache.py).
+"""
+
+import hashlib
+import inspect
+import json
+
+import markdown
+from markdown.extensions import Extension
+from markdown.extensions.codehilite import CodeHilite
+import pygments
+
+from .activeCache import ActiveCache
+
+originalHilite = CodeHilite.hilite
+# Markdown 3.2 has no shebang argument, keeps each of the lexer and formatter
+# options in an attribute of its own, and has no lang_prefix or
+# pygments_formatter (which always were "language-" and "html" there)
+HILITE_TAKES_SHEBANG = "shebang" in inspect.signature(originalHilite).parameters
+LEGACY_OPTIONS = (
+    "linenums",
+    "css_class",
+    "style",
+    "noclasses",
+    "tab_length",
+    "hl_lines",
+)
+active = ActiveCache()
+
+
+class HighlightCacheExtension(Extension):
+    """ Looks code blocks up in cache (a DiskCache, or None to not cache
+        anything) before highlighting them.
+    """
+
+    def __init__(self, cache=None, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache
+
+    def extendMarkdown(self, md):
+        md.registerExtension(self)
+        active.register(md, self.cache, "highlight_cache")
+        CodeHilite.hilite = cachedHilite
+
+    def reset(self):
+        # In case a conversion failed before clearing the active cache
+        active.set(None)
+
+
+def callHilite(codeHilite, shebang):
+    if HILITE_TAKES_SHEBANG:
+        return originalHilite(codeHilite, shebang)
+    return originalHilite(codeHilite)
+
+
+def cachedHilite(self, shebang=True):
+    activeCache = active.get()
+    if activeCache is None:
+        return callHilite(self, shebang)
+
+    formatter = getattr(self, "pygments_formatter", "html")
+    if not isinstance(formatter, str):
+        formatter = f"{formatter.__module__}.{formatter.__qualname__}"
+    options = getattr(self, "options", None)
+    if options is None:
+        options = {name: getattr(self, name, None) for name in LEGACY_OPTIONS}
+    key = json.dumps(
+        [
+            pygments.__version__,
+            markdown.__version__,
+            self.src,
+            self.lang,
+            self.guess_lang,
+            self.use_pygments,
+            getattr(self, "lang_prefix", "language-"),
+            formatter,
+            repr(sorted(options.items())),
+            shebang,
+        ]
+    )
+    key = hashlib.sha256(key.encode()).hexdigest()
+    html = activeCache.get(key)
+    if html is not None:
+        return html.decode()
+    html = callHilite(self, shebang)
+    activeCache.put(key, html.encode())
+    return html
+
+
+def makeExtension(**kwargs):  # pragma: no cover
+    return HighlightCacheExtension(**kwargs)
@@ -0,0 +1,88 @@
+"""
+Cached KaTeX extension for Python-Markdown
+==========================================
+Wraps the KatexExtension from markdown_katex so that the HTML rendered for
+each formula is kept in a persistent cache. markdown_katex renders every
+formula by running the KaTeX binary, so without this every formula costs a
+subprocess (its own cache only lives in the temp directory for a day).
+
+Entries are keyed by the formula source, its options (which include the
+display mode) and the identity of the KaTeX binary, so upgrading KaTeX
+invalidates them.
+
+markdown_katex renders formulas through a module-level function, which is
+patched once for every Markdown instance; each instance keeps its own cache
+on its extension, and makes it the active one while it converts a document
+(see activeCache.py).
+"""
+
+import hashlib
+import json
+import os
+import subprocess
+
+from markdown_katex import KatexExtension, wrapper
+import markdown_katex.extension as katexModule
+
+from .activeCache import ActiveCache
+
+# markdown_katex renders both inline and block math through this function
+originalTex2html = katexModule.tex2html
+active = ActiveCache()
+katexVersion = None
+
+
+class CachedKatexExtension(KatexExtension):
+    """ A KatexExtension which looks formulas up in cache
+        (a DiskCache, or None to not cache anything) before rendering them.
+    """
+
+    def __init__(self, cache=None, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache
+
+    def extendMarkdown(self, md):
+        super().extendMarkdown(md)
+        active.register(md, self.cache, "katex_cache")
+        katexModule.tex2html = cachedTex2html
+
+    def reset(self):
+        # In case a conversion failed before clearing the active cache
+        active.set(None)
+
+
+def cachedTex2html(tex, options=None):
+    activeCache = active.get()
+    if activeCache is None:
+        return originalTex2html(tex, options)
+
+    key = json.dumps([getKatexVersion(), tex, options or {}], sort_keys=True)
+    key = hashlib.sha256(key.encode()).hexdigest()
+    html = activeCache.get(key)
+    if html is not None:
+        return html.decode()
+    html = originalTex2html(tex, options)
+    activeCache.put(key, html.encode())
+    return html
+
+
+def getKatexVersion():
+    """ Identifies the KaTeX binary without running it, if we can.
+    """
+    global katexVersion
+    if katexVersion is None:
+        cmd = wrapper.get_bin_cmd()
+        stat = os.stat(cmd[0])
+        katexVersion = f"{' '.join(cmd)}:{stat.st_size}:{stat.st_mtime_ns}"
+        if len(cmd) > 1:
+            # Something like `npx katex`, where the binary doesn't tell us
+            # which version of KaTeX we'll get
+            output = subprocess.run(
+                cmd + ["--version"], stdout=subprocess.PIPE, check=True
+            ).stdout
+            katexVersion += ":" + output.decode().strip()
+    return katexVersion
+
+
+def makeExtension(**kwargs):  # pragma: no cover
+    return CachedKatexExtension(**kwargs)
@@ -43,19 +43,48 @@ class MetaPreprocessor(Preprocessor):
 
     def run(self, lines):
         """ Parse Meta-Data and store in Markdown.Meta. """
-        key = None
-        if lines and BEGIN_RE.match(lines[0]):
-            lines.pop(0)
-            meta = ""
-            while lines:
-                line = lines.pop(0)
-                if END_RE.match(line):
-                    break
-                else:
-                    meta += line
-                    meta += "\n"
-            self.md.Meta = toml.loads(meta)
-        return lines
+        meta, bodyStart = parseFrontMatter(lines)
+        if meta is not None:
+            self.md.Meta = meta
+        return lines[bodyStart:]
+
+
+def parseFrontMatter(lines):
+    """ Parses the TOML front matter at the start of lines.
+        Returns the metadata (or None if there's no front matter)
+        and the index of the first line after it.
+    """
+    if not lines or not BEGIN_RE.match(lines[0]):
+        return None, 0
+    end = 1
+    while end < len(lines) and not END_RE.match(lines[end]):
+        end += 1
+    meta = toml.loads("".join(line + "\n" for line in lines[1:end]))
+    return meta, min(end + 1, len(lines))
+
+
+def readFrontMatter(path, tabLength=4):
+    """ Reads just the front matter of the markdown file at path, without
+        reading the rest of the file. Returns the metadata, which is the
+        same as what Markdown.Meta holds after converting the whole file.
+    """
+    lines = []
+    with open(path) as f:
+        for i, line in enumerate(f):
+            line = line.rstrip("\n")
+            if i == 0:
+                if not BEGIN_RE.match(line):
+                    return {}
+            elif END_RE.match(line):
+                break
+            # Whitespace is normalized the same way Markdown does it
+            # before the preprocessor sees the lines
+            line = line.expandtabs(tabLength)
+            lines.append("" if i > 0 and not line.strip(" ") else line)
+    if not lines:
+        return {}
+    meta, _ = parseFrontMatter(lines)
+    return meta
 
 
 def makeExtension(**kwargs):  # pragma: no cover
@@ -0,0 +1,377 @@
+""" Minifies the HTML and CSS the build writes.
+
+    HTML loses its comments and the indentation templates give it: runs of
+    whitespace become a single space (or newline), and whitespace next to
+    block-level tags, where browsers ignore it anyway, goes entirely.
+    Tags themselves are left as they are, and so is everything inside
+    <pre>, <code>, <textarea> and <script> elements and KaTeX's output,
+    where whitespace matters. CSS (including <style> elements) loses its
+    comments and the whitespace around its punctuation.
+
+    Outputs are minified on their way into the OutputWriter, so files whose
+    minified contents didn't change are still left alone. A cache in the
+    build cache directory maps the hash of each unminified output to the
+    hash of its minified version, so outputs which are rendered again but
+    come out the same aren't minified again, and with more than one job
+    the minifying happens in worker processes while the build carries on.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import os
+import re
+import shutil
+import threading
+import time
+
+from .manifest import hashBytes
+
+# Bump this whenever the minifiers' output changes
+MINIFY_VERSION = 1
+MINIFIERS = {".html": "html", ".htm": "html", ".css": "css"}
+# How much unminified output can wait for worker processes at once
+MAX_PENDING_BYTES = 32 * 1024 * 1024
+
+TAG_RE = re.compile(
+    r"""<!--.*?-->|<!(?:[^>"']|"[^"]*"|'[^']*')*>"""
+    r"""|<(?P<closing>/?)(?P<name>[A-Za-z][\w:-]*)(?:[^>"']|"[^"]*"|'[^']*')*>""",
+    re.DOTALL,
+)
+SPAN_RE = re.compile(r"""<(/?)span\b(?:[^>"']|"[^"]*"|'[^']*')*>""", re.IGNORECASE)
+KATEX_CLASS_RE = re.compile(r"""\sclass\s*=\s*["']?[^"'>]*\bkatex\b""")
+WHITESPACE_RE = re.compile(r"[ \t\r\n\f]+")
+# Elements whose contents are left exactly as they are
+PRESERVED_ELEMENTS = {"pre", "code", "textarea", "script", "math"}
+# Elements which whitespace around doesn't show up next to
+BLOCK_ELEMENTS = {
+    "!",
+    "html",
+    "head",
+    "body",
+    "title",
+    "meta",
+    "link",
+    "base",
+    "script",
+    "style",
+    "noscript",
+    "template",
+    "div",
+    "p",
+    "ul",
+    "ol",
+    "li",
+    "dl",
+    "dt",
+    "dd",
+    "nav",
+    "header",
+    "footer",
+    "main",
+    "section",
+    "article",
+    "aside",
+    "h1",
+    "h2",
+    "h3",
+    "h4",
+    "h5",
+    "h6",
+    "hr",
+    "pre",
+    "blockquote",
+    "figure",
+    "figcaption",
+    "address",
+    "details",
+    "summary",
+    "form",
+    "fieldset",
+    "legend",
+    "table",
+    "caption",
+    "colgroup",
+    "col",
+    "thead",
+    "tbody",
+    "tfoot",
+    "tr",
+    "td",
+    "th",
+}
+
+CSS_LITERAL_RE = re.compile(
+    r"""(?P<literal>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|url\((?:\\.|[^)\\])*\))"""
+    r"""|(?P<comment>/\*.*?\*/)""",
+    re.DOTALL,
+)
+CSS_PUNCTUATION_RE = re.compile(r"\s*([{};,>])\s*")
+
+
+def collapseWhitespace(match):
+    return "\n" if "\n" in match.group(0) else " "
+
+
+def minifyCss(css):
+    """ Removes the comments (except /*! ones, which are usually licenses)
+        and the unneeded whitespace from a stylesheet.
+    """
+    parts = []
+    code = []
+
+    def flushCode():
+        text = WHITESPACE_RE.sub(" ", "".join(code))
+        text = CSS_PUNCTUATION_RE.sub(r"\1", text)
+        # Spaces after colons are never needed, but ones before them are
+        # part of selectors like "a :hover"
+        text = re.sub(r":\s+", ":", text).replace(";}", "}")
+        parts.append(text)
+        code.clear()
+
+    position = 0
+    for match in CSS_LITERAL_RE.finditer(css):
+        code.append(css[position : match.start()])
+        position = match.end()
+        if match["comment"] is not None:
+            if match["comment"].startswith("/*!"):
+                flushCode()
+                parts.append(match["comment"])
+            else:
+                code.append(" ")
+            continue
+        flushCode()
+        parts.append(match["literal"])
+    code.append(css[position:])
+    flushCode()
+    return "".join(parts).strip()
+
+
+def preservedEnd(html, match, name):
+    """ Returns where the element whose opening tag is match ends,
+        if its contents have to be left as they are, or None.
+    """
+    tag = match.group(0)
+    if match["closing"] or tag.endswith("/>"):
+        return None
+    if name == "span":
+        if not KATEX_CLASS_RE.search(tag):
+            return None
+        # KaTeX's output is nested spans
+        depth = 1
+        for span in SPAN_RE.finditer(html, match.end()):
+            depth += -1 if span.group(1) else 1
+            if depth == 0:
+                return span.end()
+        return len(html)
+    if name in PRESERVED_ELEMENTS or name == "style":
+        end = re.compile(r"</%s\s*>" % name, re.IGNORECASE).search(html, match.end())
+        return end.end() if end else len(html)
+    return None
+
+
+def minifyHtml(html):
+    """ Removes comments and collapses whitespace in an HTML document,
+        leaving elements where whitespace matters alone.
+    """
+    parts = []
+    text = []
+    # The name of the last tag, "!" for comments and doctypes,
+    # or None at the start
+    previous = None
+
+    def flushText(following):
+        collapsed = WHITESPACE_RE.sub(collapseWhitespace, "".join(text))
+        text.clear()
+        if previous is None or previous in BLOCK_ELEMENTS:
+            collapsed = collapsed.lstrip(" \n")
+        if following is None or following in BLOCK_ELEMENTS:
+            collapsed = collapsed.rstrip(" \n")
+        parts.append(collapsed)
+
+    position = 0
+    while True:
+        match = TAG_RE.search(html, position)
+        if match is None:
+            text.append(html[position:])
+            flushText(None)
+            break
+        text.append(html[position : match.start()])
+        tag = match.group(0)
+        position = match.end()
+        if tag.startswith("<!--"):
+            # Conditional comments and <!--! ... --> are kept
+            if tag.startswith(("<!--[if", "<!--<![endif]", "<!--!")):
+                flushText("!")
+                parts.append(tag)
+                previous = "!"
+            continue
+        name = match["name"].lower() if match["name"] else "!"
+        flushText(name)
+        end = preservedEnd(html, match, name)
+        if end is None:
+            parts.append(tag)
+        elif name == "style":
+            closing = html.rfind("</", match.end(), end)
+            closing = end if closing == -1 else closing
+            parts.append(tag)
+            parts.append(minifyCss(html[match.end() : closing]))
+            parts.append(html[closing:end])
+            position = end
+        else:
+            parts.append(html[match.start() : end])
+            position = end
+        previous = name
+    return "".join(parts)
+
+
+def minifyData(kind, data):
+    """ Minifies the contents of a file (as bytes) of the given kind.
+    """
+    text = data.decode()
+    if kind == "html":
+        return minifyHtml(text).encode()
+    return minifyCss(text).encode()
+
+
+def minifyInWorker(args):
+    return minifyData(*args)
+
+
+class Minifier:
+    """ Stands in for an OutputWriter, minifying the files written or copied
+        through it which have one of the extensions in minifyConfig.
+        Everything else is passed through to the writer.
+
+        Arguments:
+            writer is the OutputWriter to write into
+            cache is the DiskCache of the hashes of minified outputs
+            jobs is the number of worker processes to minify HTML in;
+                with more than one, write() doesn't wait for them, so
+                finish() has to be called once everything is written
+    """
+
+    def __init__(self, minifyConfig, writer, cache=None, jobs=1):
+        self.minifyConfig = minifyConfig
+        self.writer = writer
+        self.cache = cache
+        self.jobs = jobs
+        self.executor = None
+        # The writes waiting for worker processes, oldest first
+        self.pending = deque()
+        self.pendingBytes = 0
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.minified = 0
+        self.kept = 0
+        self.bytesBefore = 0
+        self.bytesAfter = 0
+
+    def __getattr__(self, name):
+        return getattr(self.writer, name)
+
+    def kind(self, relPath):
+        extension = os.path.splitext(relPath)[1].lower()
+        if extension not in self.minifyConfig.extensions:
+            return None
+        return MINIFIERS[extension]
+
+    def cacheKey(self, kind, sourceHash):
+        return f"{kind}:{MINIFY_VERSION}:{sourceHash}"
+
+    def keepIfMinified(self, relPath, key, size):
+        """ Keeps relPath as it is if it's already the minified version of
+            the contents key stands for. Returns its hash, or None.
+        """
+        if self.cache is None:
+            return None
+        with self.lock:
+            cached = self.cache.get(key)
+        if cached is None or cached.decode() != self.writer.existingHash(relPath):
+            return None
+        with self.lock:
+            self.kept += 1
+            self.bytesBefore += size
+            self.bytesAfter += os.path.getsize(self.writer.path(relPath))
+        return self.writer.keep(relPath)
+
+    def write(self, relPath, data):
+        """ Like OutputWriter.write(), but returns None instead of the hash
+            if the file is being minified in a worker process.
+        """
+        kind = self.kind(relPath)
+        if kind is None:
+            return self.writer.write(relPath, data)
+        if isinstance(data, str):
+            data = data.encode()
+        key = self.cacheKey(kind, hashBytes(data))
+        keptHash = self.keepIfMinified(relPath, key, len(data))
+        if keptHash is not None:
+            return keptHash
+        if self.jobs <= 1:
+            return self.finishWrite(relPath, key, len(data), minifyData(kind, data))
+
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.jobs)
+            future = self.executor.submit(minifyInWorker, (kind, data))
+            self.pending.append((relPath, key, len(data), future))
+            self.pendingBytes += len(data)
+        # Don't let unminified output pile up in memory
+        while self.pendingBytes > MAX_PENDING_BYTES:
+            self.finishOldest()
+        return None
+
+    def copy(self, source, relPath, sourceHash=None, copyFunction=shutil.copy2):
+        """ Like OutputWriter.copy(), but minifies the file (right away)
+            instead of copying it.
+        """
+        kind = self.kind(relPath)
+        if kind is None:
+            return self.writer.copy(source, relPath, sourceHash, copyFunction)
+        size = os.path.getsize(source)
+        if sourceHash is not None:
+            key = self.cacheKey(kind, sourceHash)
+            keptHash = self.keepIfMinified(relPath, key, size)
+            if keptHash is not None:
+                return keptHash
+        with open(source, "rb") as f:
+            data = f.read()
+        key = self.cacheKey(kind, hashBytes(data))
+        return self.finishWrite(relPath, key, len(data), minifyData(kind, data))
+
+    def finishWrite(self, relPath, key, size, minified):
+        newHash = self.writer.write(relPath, minified)
+        with self.lock:
+            if self.cache is not None:
+                self.cache.put(key, newHash.encode())
+            self.minified += 1
+            self.bytesBefore += size
+            self.bytesAfter += len(minified)
+        return newHash
+
+    def finishOldest(self):
+        with self.lock:
+            relPath, key, size, future = self.pending.popleft()
+            self.pendingBytes -= size
+        self.finishWrite(relPath, key, size, future.result())
+
+    def finish(self, silent=False):
+        """ Waits for the files being minified in worker processes to be
+            written, and reports how much smaller minifying made the outputs.
+        """
+        try:
+            while self.pending:
+                self.finishOldest()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+        if not silent and (self.minified or self.kept):
+            saved = self.bytesBefore - self.bytesAfter
+            percent = 100 * saved / self.bytesBefore if self.bytesBefore else 0
+            print(
+                f"Minified {self.minified} files and kept {self.kept} minified "
+                f"files in {(time.perf_counter() - self.start) * 1000:.0f} ms: "
+                f"{self.bytesBefore / 1024:.0f} KB down to "
+                f"{self.bytesAfter / 1024:.0f} KB ({percent:.0f}% smaller)"
+            )
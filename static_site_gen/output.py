@@ -0,0 +1,264 @@
+""" Writes the build's output files.
+
+    The site is built into a staging directory next to the build directory,
+    which starts out as a hard-linked copy of the published site.
+    Files whose contents didn't change are left alone (so they keep their
+    bytes and mtimes, and sync tools see nothing to upload), files which
+    weren't produced by this build are removed, and the staging directory
+    is then swapped into place, so a failed build never leaves a
+    half-written site behind.
+
+    Linking the published site into the staging directory takes time in
+    proportion to the number of files in it, however few of them a build
+    changes, so builds can also write straight into the build directory
+    (replacing each file in one step, but not the site as a whole).
+"""
+
+import ctypes
+import ctypes.util
+import os
+import shutil
+import threading
+
+from .manifest import hashBytes, hashFile
+
+STAGING_SUFFIX = ".staging"
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2
+
+
+class OutputWriter:
+    """ Arguments:
+            buildDir is the published build directory
+            staged says whether to build into a staging directory and swap it
+                into place at the end (otherwise files are written directly
+                into buildDir, which is quicker for small rebuilds)
+            knownHashes maps the output paths of the previous build (relative
+                to buildDir) to the hashes of their contents, so that existing
+                files don't have to be read to tell whether they changed
+
+        Files can be copied from several threads at once.
+    """
+
+    def __init__(self, buildDir, staged=True, knownHashes=None):
+        self.buildDir = buildDir
+        self.staged = staged
+        self.knownHashes = knownHashes if knownHashes else {}
+        if staged:
+            self.outDir = os.path.normpath(buildDir) + STAGING_SUFFIX
+        else:
+            self.outDir = buildDir
+        # Maps each relative path produced by this build to its hash
+        self.hashes = {}
+        self.written = 0
+        self.unchanged = 0
+        self.removed = 0
+        self.lock = threading.Lock()
+
+    def begin(self):
+        """ Sets up the directory the build writes into.
+        """
+        if not self.staged:
+            os.makedirs(self.outDir, exist_ok=True)
+            return
+        if os.path.exists(self.outDir):
+            # Left behind by a build which crashed
+            shutil.rmtree(self.outDir)
+        if os.path.isdir(self.buildDir):
+            shutil.copytree(self.buildDir, self.outDir, copy_function=linkOrCopy)
+        else:
+            os.makedirs(self.outDir)
+
+    def path(self, relPath):
+        return os.path.join(self.outDir, relPath)
+
+    def existingHash(self, relPath):
+        path = self.path(relPath)
+        if not os.path.isfile(path):
+            return None
+        if relPath in self.hashes:
+            return self.hashes[relPath]
+        if relPath in self.knownHashes:
+            return self.knownHashes[relPath]
+        return hashFile(path)
+
+    def write(self, relPath, data):
+        """ Writes data (a str or bytes) to relPath, unless the file
+            already has exactly those contents. Returns the data's hash.
+        """
+        relPath = os.path.normpath(relPath)
+        if isinstance(data, str):
+            data = data.encode()
+        newHash = hashBytes(data)
+        if self.existingHash(relPath) == newHash:
+            self.record(relPath, newHash, False)
+        else:
+            tmpPath = self.tempPath(relPath)
+            with open(tmpPath, "wb") as f:
+                f.write(data)
+            # Replacing the file rather than writing into it breaks the
+            # hard link to the published copy
+            os.replace(tmpPath, self.path(relPath))
+            self.record(relPath, newHash, True)
+        return newHash
+
+    def copy(self, source, relPath, sourceHash=None, copyFunction=shutil.copy2):
+        """ Copies the file at source to relPath if it changed,
+            using copyFunction, which must keep the source's mtime.
+            sourceHash is the hash of the source, if it's known already.
+            Returns the file's hash.
+        """
+        relPath = os.path.normpath(relPath)
+        dest = self.path(relPath)
+        if sourceHash is None and os.path.isfile(dest) and relPath in self.knownHashes:
+            sourceStat = os.stat(source)
+            destStat = os.stat(dest)
+            # Copies keep the source's mtime, so this means it's untouched
+            if (sourceStat.st_size, sourceStat.st_mtime_ns) == (
+                destStat.st_size,
+                destStat.st_mtime_ns,
+            ):
+                self.record(relPath, self.knownHashes[relPath], False)
+                return self.knownHashes[relPath]
+
+        newHash = sourceHash if sourceHash is not None else hashFile(source)
+        if self.existingHash(relPath) == newHash:
+            self.record(relPath, newHash, False)
+        else:
+            tmpPath = self.tempPath(relPath)
+            if os.path.lexists(tmpPath):
+                # Left behind by a build which crashed, and in the way of links
+                os.remove(tmpPath)
+            copyFunction(source, tmpPath)
+            os.replace(tmpPath, dest)
+            self.record(relPath, newHash, True)
+        return newHash
+
+    def keep(self, relPath):
+        """ Marks a file from the previous build as part of this one,
+            without touching it. Returns its hash.
+        """
+        relPath = os.path.normpath(relPath)
+        existingHash = self.existingHash(relPath)
+        self.record(relPath, existingHash, False)
+        return existingHash
+
+    def record(self, relPath, newHash, written):
+        """ Notes that relPath is part of this build, and whether it was
+            written or left as it was.
+        """
+        with self.lock:
+            self.hashes[relPath] = newHash
+            if written:
+                self.written += 1
+            else:
+                self.unchanged += 1
+
+    def tempPath(self, relPath):
+        """ Returns a path which something can write relPath's new contents
+            to, before they're moved into place by finishTemp().
+        """
+        path = self.path(relPath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path + ".tmp"
+
+    def finishTemp(self, relPath, newHash=None):
+        """ Moves the file written to tempPath(relPath) into place,
+            if it's different from what's there already.
+            newHash is the hash of the file, if it's known already.
+        """
+        relPath = os.path.normpath(relPath)
+        tmpPath = self.path(relPath) + ".tmp"
+        if newHash is None:
+            newHash = hashFile(tmpPath)
+        if self.existingHash(relPath) == newHash:
+            os.remove(tmpPath)
+            self.record(relPath, newHash, False)
+        else:
+            os.replace(tmpPath, self.path(relPath))
+            self.record(relPath, newHash, True)
+        return newHash
+
+    def commit(self):
+        """ Removes files which this build didn't produce, then publishes
+            the staging directory.
+        """
+        if self.staged and not self.knownHashes:
+            # Without a record of what the last build made, anything in the
+            # build directory may be left over
+            orphans = []
+            for (dirPath, _, files) in os.walk(self.outDir):
+                for f in files:
+                    relPath = os.path.relpath(os.path.join(dirPath, f), self.outDir)
+                    if relPath not in self.hashes:
+                        orphans.append(relPath)
+        else:
+            # Only remove what we know we made, since walking a big output
+            # directory on every small rebuild would be slow
+            orphans = [p for p in self.knownHashes if p not in self.hashes]
+        for relPath in orphans:
+            path = self.path(relPath)
+            if os.path.isfile(path):
+                os.remove(path)
+                self.removed += 1
+                removeEmptyParents(os.path.dirname(path), self.outDir)
+
+        if self.staged:
+            swapDirectories(self.outDir, self.buildDir)
+            if os.path.exists(self.outDir):
+                shutil.rmtree(self.outDir)
+
+    def abort(self):
+        if self.staged and os.path.exists(self.outDir):
+            shutil.rmtree(self.outDir)
+
+    def summary(self):
+        return (
+            f"{self.written} files written, {self.unchanged} unchanged, "
+            f"{self.removed} removed."
+        )
+
+
+def linkOrCopy(source, dest):
+    try:
+        os.link(source, dest)
+    except OSError:
+        shutil.copy2(source, dest)
+
+
+def removeEmptyParents(path, stopAt):
+    stopAt = os.path.normpath(stopAt)
+    while os.path.normpath(path) != stopAt and not os.listdir(path):
+        os.rmdir(path)
+        path = os.path.dirname(path)
+
+
+def swapDirectories(newDir, oldDir):
+    """ Moves newDir to oldDir's path, leaving whatever was at oldDir
+        (if anything) at newDir's path. Where the OS supports it the two
+        are exchanged in one step, so oldDir's path is never empty.
+    """
+    if os.path.exists(oldDir):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            result = libc.renameat2(
+                AT_FDCWD,
+                os.fsencode(newDir),
+                AT_FDCWD,
+                os.fsencode(oldDir),
+                RENAME_EXCHANGE,
+            )
+            if result == 0:
+                return
+        except (OSError, AttributeError, TypeError):
+            pass
+        # Fall back to two renames, which leaves a tiny window where
+        # there's nothing at oldDir
+        asideDir = newDir + ".old"
+        if os.path.exists(asideDir):
+            shutil.rmtree(asideDir)
+        os.rename(oldDir, asideDir)
+        os.rename(newDir, oldDir)
+        os.rename(asideDir, newDir)
+    else:
+        os.rename(newDir, oldDir)
@@ -0,0 +1,157 @@
+""" Checks that the markdown-it backend turns pages into the same HTML
+    as Python-Markdown, so switching backends can't silently change a site.
+
+    Every example in CASES which the backends module considers plain must
+    convert identically with both backends, and every example in REJECTED
+    must not be considered plain (these are the places where the engines
+    are known to disagree). The plain pages of the site in the pwd are
+    checked the same way. Run it with `ssg parity`.
+"""
+
+import difflib
+import os
+
+import markdown
+import toml
+
+from .backends import CommonMarkBackend, isPlain, markdown_it, splitFrontMatter
+from .build import listGroupFiles, markdownExtensions
+from .config_structs import parseGroups
+from .globals import *
+
+# Pages both backends must agree on
+CASES = {
+    "paragraphs": "One paragraph.\n\nAnother paragraph,\nover two lines.",
+    "emphasis": "Some *emphasis*, _more_, **strong** and __strong__ text.",
+    "code span": "Call `render()` with `x * y` and `[a]`.",
+    "headings": "# One\n\n## Two\n\nText\n\n### Three\n\n###### Six",
+    "bullets": "Items:\n\n* one\n* two\n* three\n\nAfter.",
+    "dashes as bullets": "- one\n- two",
+    "numbered": "1. one\n2. two\n3. three",
+    "numbered from": "3. three\n4. four",
+    "links": "A [link](https://example.org) and [another](/x.html).",
+    "autolink-like": "Mail me at someone@example.org or visit example.org.",
+    "apostrophes": "Don't stop, it's the site's way.",
+    "blockquote": "> Quoted\n> text\n\nAfter.",
+    "greater than": "5 > 3 and 6 = 2 + 4",
+    "unicode": "Café naïve 日本語",
+    "blank lines": "Text\n\n\n\nMore text",
+    "front matter": '---\ntitle = "Hello"\ntags = ["a"]\n---\n# Hello\n\nBody.',
+}
+
+# Pages the engines disagree on, which must not be considered plain
+REJECTED = {
+    "raw html": "<div>html</div>",
+    "entity": "Fish &amp; chips",
+    "double quotes": 'He said "hi".',
+    "single quotes": "'quoted'",
+    "dashes": "a -- b --- c",
+    "ellipsis": "Wait...",
+    "image": "![alt](a.png)",
+    "fenced code": "```\ncode\n```",
+    "indented code": "    code",
+    "math": "$x^2$",
+    "admonition": '!!! note "Title"\n    Body',
+    "table": "a | b\n--|--\n1 | 2",
+    "horizontal rule": "* * *",
+    "list after paragraph": "Text\n* item",
+    "mixed bullets": "* a\n- b",
+    "nested list": "* a\n    * b",
+    "reference link": "[a][1]\n\n[1]: https://example.org",
+    "heading without space": "#Heading",
+    "parenthesis list": "1) a",
+    "escape": "\\*not emphasis\\*",
+    "strong emphasis": "***both***",
+    "tilde fence": "~~~\ncode\n~~~",
+    "hard break": "line  \nbreak",
+    "trailing spaces": "Text   \n\nMore text",
+    "setext heading": "Title\n=====",
+    "loose list": "* one\n\n* two",
+    "split blockquote": "> one\n\n> two",
+    "closed heading": "## Two ##",
+    "link title": "[a](/x.html 'Title')",
+}
+
+
+def pythonMarkdown():
+    return markdown.Markdown(extensions=markdownExtensions())
+
+
+def compare(name, source, md, fast):
+    """ Returns a diff of the two backends' HTML for source,
+        or None if they agree.
+    """
+    md.reset()
+    expected = md.convert(source)
+    meta, body = splitFrontMatter(source)
+    actual = fast.convert(body)
+    if meta != md.Meta:
+        actual = f"{meta}\n{actual}"
+        expected = f"{md.Meta}\n{expected}"
+    if actual == expected:
+        return None
+    return "".join(
+        difflib.unified_diff(
+            expected.splitlines(keepends=True),
+            actual.splitlines(keepends=True),
+            fromfile=f"{name} (python-markdown)",
+            tofile=f"{name} (markdown-it)",
+        )
+    )
+
+
+def sitePages():
+    """ Yields the paths of the pages of the site in the pwd, if there is one.
+    """
+    global CONFIG_FILE_PATH
+    if not os.path.exists(CONFIG_FILE_PATH):
+        return
+    with open(CONFIG_FILE_PATH) as f:
+        config = toml.loads(f.read())
+    for group in parseGroups(config["pages"] if "pages" in config else {}):
+        yield from listGroupFiles(group)
+
+
+def runParity(silent=False):
+    """ Runs the checks, printing a diff for each failure.
+        Returns the number of failures.
+    """
+    if markdown_it is None:
+        print("markdown-it-py isn't installed, so there is nothing to compare")
+        return 1
+    md = pythonMarkdown()
+    fast = CommonMarkBackend()
+    failures = 0
+    checked = 0
+    sitePlain = 0
+
+    for name, source in REJECTED.items():
+        if isPlain(splitFrontMatter(source)[1]):
+            print(f"{name}: should not be converted with markdown-it")
+            failures += 1
+
+    examples = [(f"case {name}", source) for name, source in CASES.items()]
+    for path in sitePages():
+        with open(path) as f:
+            examples.append((path, f.read()))
+    for name, source in examples:
+        if not isPlain(splitFrontMatter(source)[1]):
+            if name.startswith("case "):
+                print(f"{name}: not plain, so it isn't compared")
+                failures += 1
+            continue
+        checked += 1
+        if not name.startswith("case "):
+            sitePlain += 1
+        diff = compare(name, source, md, fast)
+        if diff is not None:
+            print(diff)
+            failures += 1
+
+    if not silent:
+        print(
+            f"Compared {checked} plain pages ({sitePlain} of the site's "
+            f"{len(examples) - len(CASES)}) and checked {len(REJECTED)} "
+            f"pages which aren't plain: {failures} failures"
+        )
+    return failures
@@ -0,0 +1,254 @@
+""" Measures where a build spends its time, for `build --profile`.
+
+    The build is split into phases, each of which records its wall time, its
+    CPU time (including that of any worker processes it ran) and how much
+    memory it allocated. Each page records how long it took to convert and
+    render and how big its output was, and each markdown processor records
+    how long it ran in total.
+
+    The results are printed as tables, and written out as JSON and in
+    Chrome's trace event format (which chrome://tracing and Perfetto open).
+"""
+
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, dataclass
+import json
+import os
+import resource
+import time
+import tracemalloc
+from typing import Dict, List
+
+
+@dataclass
+class PhaseProfile:
+    name: str
+    start: float
+    wall: float
+    cpu: float
+    # Net bytes allocated by the main process during the phase
+    allocated: int
+    # The most memory the main process had allocated during the phase
+    peak: int
+
+
+@dataclass
+class PageProfile:
+    path: str
+    parse: float = 0.0
+    render: float = 0.0
+    outputBytes: int = 0
+
+    @property
+    def total(self):
+        return self.parse + self.render
+
+
+class Profiler:
+    """ Arguments:
+            traceAllocations says whether to track memory allocations,
+                which makes the build noticeably slower
+    """
+
+    def __init__(self, traceAllocations=True):
+        self.origin = time.perf_counter()
+        self.phases: List[PhaseProfile] = []
+        self.pages: Dict[str, PageProfile] = {}
+        self.processors: Dict[str, float] = {}
+        self.events = []
+        self.traceAllocations = traceAllocations
+        if traceAllocations:
+            tracemalloc.start()
+
+    @contextmanager
+    def phase(self, name):
+        """ Measures the code run inside a `with` block as a phase.
+        """
+        if self.traceAllocations:
+            tracemalloc.reset_peak()
+            allocatedBefore = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        cpuStart = cpuTime()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            cpu = cpuTime() - cpuStart
+            allocated = peak = 0
+            if self.traceAllocations:
+                current, peak = tracemalloc.get_traced_memory()
+                allocated = current - allocatedBefore
+            self.phases.append(
+                PhaseProfile(name, start - self.origin, wall, cpu, allocated, peak)
+            )
+            self.addEvent(name, "phase", start, wall)
+
+    def page(self, path):
+        if path not in self.pages:
+            self.pages[path] = PageProfile(path)
+        return self.pages[path]
+
+    def recordConversion(self, path, timing):
+        """ Records a page's conversion, as timed by timedConvert().
+        """
+        self.page(path).parse += timing["seconds"]
+        for name, seconds in timing["processors"].items():
+            self.processors[name] = self.processors.get(name, 0.0) + seconds
+        self.addEvent(
+            path, "convert", timing["start"], timing["seconds"], pid=timing["pid"]
+        )
+
+    @contextmanager
+    def rendering(self, path):
+        """ Times the rendering of the page at path inside a `with` block,
+            which gets the page's PageProfile to set outputBytes on.
+        """
+        start = time.perf_counter()
+        try:
+            yield self.page(path)
+        finally:
+            seconds = time.perf_counter() - start
+            self.page(path).render += seconds
+            self.addEvent(path, "render", start, seconds)
+
+    def addEvent(self, name, category, start, seconds, pid=None):
+        # perf_counter is the same clock in every process on Linux and macOS,
+        # so times from workers line up with the main process
+        self.events.append(
+            {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": (start - self.origin) * 1e6,
+                "dur": seconds * 1e6,
+                "pid": pid if pid is not None else os.getpid(),
+                "tid": 0,
+            }
+        )
+
+    def stop(self):
+        if self.traceAllocations:
+            tracemalloc.stop()
+
+    def report(self, top=10):
+        """ Returns the tables of phases, slowest pages,
+            and markdown processors, as a string.
+        """
+        lines = [
+            f"{'Phase':<24}{'Wall ms':>10}{'CPU ms':>10}{'Alloc KB':>12}{'Peak KB':>12}"
+        ]
+        for p in self.phases:
+            lines.append(
+                f"{p.name:<24}{p.wall * 1000:>10.1f}{p.cpu * 1000:>10.1f}"
+                f"{p.allocated / 1024:>12.0f}{p.peak / 1024:>12.0f}"
+            )
+
+        slowest = sorted(self.pages.values(), key=lambda p: p.total, reverse=True)
+        lines.append("")
+        lines.append(
+            f"{'Slowest pages':<44}{'Parse ms':>10}{'Render ms':>10}{'Bytes':>10}"
+        )
+        for p in slowest[:top]:
+            lines.append(
+                f"{shorten(p.path, 43):<44}{p.parse * 1000:>10.1f}"
+                f"{p.render * 1000:>10.1f}{p.outputBytes:>10}"
+            )
+
+        if self.processors:
+            lines.append("")
+            lines.append(f"{'Markdown processor':<44}{'Total ms':>10}")
+            for name, seconds in sorted(
+                self.processors.items(), key=lambda x: x[1], reverse=True
+            ):
+                lines.append(f"{name:<44}{seconds * 1000:>10.1f}")
+        return "\n".join(lines)
+
+    def save(self, directory):
+        """ Writes profile.json and trace.json into directory,
+            returning their paths.
+        """
+        os.makedirs(directory, exist_ok=True)
+        profilePath = os.path.join(directory, "profile.json")
+        tracePath = os.path.join(directory, "trace.json")
+        data = {
+            "phases": [asdict(p) for p in self.phases],
+            "pages": [
+                dict(asdict(p), total=p.total)
+                for p in sorted(self.pages.values(), key=lambda p: p.path)
+            ],
+            "processors": self.processors,
+        }
+        with open(profilePath, "w") as f:
+            json.dump(data, f, indent=2)
+        with open(tracePath, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+        return profilePath, tracePath
+
+
+def profilePhase(profiler, name):
+    """ Profiler.phase(), for when there may not be a profiler.
+    """
+    return profiler.phase(name) if profiler is not None else nullcontext()
+
+
+def timeRendering(profiler, path):
+    """ Profiler.rendering(), for when there may not be a profiler;
+        the `with` block gets None then.
+    """
+    return profiler.rendering(path) if profiler is not None else nullcontext()
+
+
+def cpuTime():
+    """ The CPU time used by this process and its finished children.
+    """
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+def shorten(text, width):
+    return text if len(text) <= width else "..." + text[-(width - 3) :]
+
+
+def instrumentMarkdown(md):
+    """ Wraps the processors of md so that they time themselves,
+        adding up their times by name in md.processorTimes.
+    """
+    if hasattr(md, "processorTimes"):
+        return
+    md.processorTimes = {}
+    for kind in ("preprocessors", "treeprocessors", "postprocessors"):
+        for processor in getattr(md, kind):
+            processor.run = timed(
+                processor.run, f"{kind}.{type(processor).__name__}", md.processorTimes
+            )
+    md.parser.parseDocument = timed(
+        md.parser.parseDocument, "blockparser", md.processorTimes
+    )
+
+
+def timed(function, name, times):
+    def timedFunction(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            times[name] = times.get(name, 0.0) + time.perf_counter() - start
+
+    return timedFunction
+
+
+def timedConvert(convert, md):
+    """ Calls convert(), returning its result along with a dict of how long
+        it took, for Profiler.recordConversion().
+        md should have been instrumented by instrumentMarkdown().
+    """
+    md.processorTimes.clear()
+    start = time.perf_counter()
+    result = convert()
+    timing = {
+        "start": start,
+        "seconds": time.perf_counter() - start,
+        "pid": os.getpid(),
+        "processors": dict(md.processorTimes),
+    }
+    return result, timing
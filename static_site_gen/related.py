@@ -0,0 +1,104 @@
+""" Links every page to its neighbours, so templates don't have to search
+    the whole site for them on every page.
+
+    Pages in groups sorted by date get the pages published just before and
+    after them, as `previous` and `next`. Every page gets a list of the
+    pages which share the most tags with it, as `related`: each shared tag
+    counts for more the fewer pages have it, and ties go to newer pages.
+    Related pages are found through an index of the pages with each tag,
+    so only pages which share a tag with a page are ever scored for it,
+    and pages with the same tags share their scores.
+"""
+
+import heapq
+import math
+import time
+
+
+def linkPages(content, pagesConfig, relatedConfig, silent=False):
+    """ Sets the previous, next and related attributes of every page.
+
+        Arguments:
+            content is the dict of pages by group
+            pagesConfig is the list of PagesConfigs, which say how the groups
+                are sorted
+            relatedConfig is the RelatedConfig saying how many related pages
+                to find, and in which groups
+    """
+    start = time.perf_counter()
+    for group in pagesConfig:
+        pages = content[group.groupName]
+        for i, page in enumerate(pages):
+            page.related = []
+            if not group.sortByDate:
+                page.previous = page.next = None
+                continue
+            before = pages[i - 1] if i > 0 else None
+            after = pages[i + 1] if i + 1 < len(pages) else None
+            # Groups sorted newest first list the previous page after each page
+            if group.sortReverse:
+                page.previous, page.next = after, before
+            else:
+                page.previous, page.next = before, after
+
+    groups = relatedConfig.groups if relatedConfig.groups else list(content)
+    for groupName in groups:
+        if groupName not in content:
+            print(f"Config error: related lists unknown group {groupName}")
+            raise KeyError(groupName)
+    if relatedConfig.count <= 0:
+        return
+    candidates = []
+    seen = set()
+    for groupName in groups:
+        for page in content[groupName]:
+            if id(page) not in seen:
+                seen.add(id(page))
+                candidates.append(page)
+    relatedPages(candidates, relatedConfig.count)
+    if not silent:
+        print(
+            f"Found related pages for {len(candidates)} pages "
+            f"in {(time.perf_counter() - start) * 1000:.0f} ms"
+        )
+
+
+def relatedPages(pages, count):
+    """ Sets the related attribute of each page in pages to the (up to) count
+        other pages in pages which have the most in common with it.
+    """
+    # Ties go to newer pages, then to pages earlier in the url order
+    order = sorted(range(len(pages)), key=lambda i: pages[i].url)
+    order.sort(key=lambda i: str(pages[i].date) if pages[i].date else "", reverse=True)
+    rank = [0] * len(pages)
+    for position, i in enumerate(order):
+        rank[i] = -position
+
+    # Maps each tag to the indexes of the pages with it
+    tagIndex = {}
+    for i, page in enumerate(pages):
+        for tag in set(page.tags):
+            tagIndex.setdefault(tag, []).append(i)
+    # Rarer tags say more about what a page is about
+    weights = {
+        tag: math.log(1 + len(pages) / len(indexes))
+        for tag, indexes in tagIndex.items()
+    }
+
+    # The best pages for each set of tags, including the page itself,
+    # shared by every page with that set
+    memo = {}
+    for i, page in enumerate(pages):
+        tags = frozenset(page.tags)
+        if not tags:
+            continue
+        if tags not in memo:
+            scores = {}
+            for tag in tags:
+                weight = weights[tag]
+                for other in tagIndex[tag]:
+                    scores[other] = scores.get(other, 0.0) + weight
+            memo[tags] = heapq.nlargest(
+                count + 1, scores, key=lambda other: (scores[other], rank[other])
+            )
+        page.related = [pages[other] for other in memo[tags] if other != i][:count]
@@ -0,0 +1,297 @@
+""" Builds an index for searching the site in the browser.
+
+    Every page's title, tags, description and text (its content without
+    the markup) are split into lowercase terms, and each term gets a score
+    per page: the number of times it appears in each field, times that
+    field's boost. The index is written as JSON files into one directory:
+
+        index.json lists the shards and the settings the index was made
+            with, so the browser can split queries into terms the same way
+        pages.json lists the url, title and description of every page,
+            by its id (the ids of removed pages are null until reused)
+        shards/ has one file per shard, mapping each term starting with the
+            shard's prefix to a list of [page id, score] pairs, best first
+
+    so the browser only downloads the shards for the terms it looks up.
+    The terms of each page are kept in the manifest, and pages keep their
+    ids between builds, so after a small change only the shards holding
+    the terms of the pages which changed are written again.
+"""
+
+import html
+import json
+import os
+import re
+import time
+
+INDEX_VERSION = 1
+TERM_RE = re.compile(r"\w+")
+# Elements whose contents aren't text a reader would search for
+HIDDEN_ELEMENTS_RE = re.compile(
+    r"<(script|style|annotation)\b.*?</\1\s*>", re.DOTALL | re.IGNORECASE
+)
+TAG_RE = re.compile(r"<[^>]*>")
+SHARD_NAME_RE = re.compile(r"[a-z0-9]+")
+FIELDS = ("title", "tags", "description", "content")
+
+
+def stripHtml(content):
+    """ The text of a page's HTML, without its markup.
+    """
+    text = HIDDEN_ELEMENTS_RE.sub(" ", content)
+    return html.unescape(TAG_RE.sub(" ", text))
+
+
+def pageTerms(page, content, searchConfig):
+    """ Returns the scores of the terms of a page, grouped by shard.
+        content is the page's HTML.
+    """
+    fields = {
+        "title": page.title or "",
+        "tags": " ".join(str(tag) for tag in page.tags),
+        "description": page.description or "",
+        "content": stripHtml(content or ""),
+    }
+    scores = {}
+    for field in FIELDS:
+        boost = searchConfig.boosts[field]
+        for term in TERM_RE.findall(fields[field].lower()):
+            if len(term) < searchConfig.minTermLength:
+                continue
+            if term in searchConfig.stopWords:
+                continue
+            scores[term] = scores.get(term, 0) + boost
+    shards = {}
+    for term, score in scores.items():
+        shard = term[: searchConfig.prefixLength]
+        if shard not in shards:
+            shards[shard] = {}
+        shards[shard][term] = score
+    return shards
+
+
+def shardPath(searchConfig, shard):
+    """ The output path of a shard. Prefixes which can't be used as file
+        names as they are (like ones with accented letters) are hex encoded.
+    """
+    if SHARD_NAME_RE.fullmatch(shard):
+        name = shard
+    else:
+        name = "_" + shard.encode().hex()
+    return os.path.join(searchConfig.directory, "shards", name + ".json")
+
+
+def dumpJson(value):
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def checkGroups(searchConfig, content):
+    """ Returns the names of the groups to index.
+    """
+    groups = searchConfig.groups if searchConfig.groups else list(content)
+    for groupName in groups:
+        if groupName not in content:
+            print(f"Config error: search lists unknown group {groupName}")
+            raise KeyError(groupName)
+    return groups
+
+
+def buildSearchIndex(
+    *, searchConfig, content, writer, previous=None, store=None, silent=False
+):
+    """ Writes the search index of the pages in content through writer.
+
+        Arguments:
+            content is the dict of pages by group
+            previous is the search index kept in the last build's manifest,
+                if any; pages whose sources haven't changed since then
+                aren't split into terms again, and shards without any terms
+                of changed pages are kept as they are
+            store is the ContentStore of a streaming build, if any
+
+        Returns the search index for the manifest, which maps each page's
+        source path to its id, source hash and terms.
+    """
+    start = time.perf_counter()
+    previous = previous if previous else {}
+    records = {}
+    pages = {}
+    # The shards which have to be written again
+    changedShards = set()
+    newPages = []
+    for groupName in checkGroups(searchConfig, content):
+        for page in content[groupName]:
+            if page.path in pages:
+                continue
+            pages[page.path] = page
+            record = previous.get(page.path)
+            if record is not None and record[1] == page.sourceHash:
+                records[page.path] = record
+                continue
+            if store is not None:
+                terms = pageTerms(page, store.getContent(page), searchConfig)
+            else:
+                terms = pageTerms(page, page.content, searchConfig)
+            changedShards.update(terms)
+            if record is not None:
+                changedShards.update(record[2])
+                records[page.path] = (record[0], page.sourceHash, terms)
+            else:
+                newPages.append((page.path, page.sourceHash, terms))
+    for path, record in previous.items():
+        if path not in pages:
+            changedShards.update(record[2])
+    assignIds(records, newPages, changedShards)
+
+    shards, written = writeSearchIndex(
+        searchConfig=searchConfig,
+        records=records,
+        pages=pages,
+        writer=writer,
+        changedShards=changedShards,
+    )
+    if not silent:
+        print(
+            f"Indexed {len(records)} pages for search in {len(shards)} shards, "
+            f"writing {written} of them, "
+            f"in {(time.perf_counter() - start) * 1000:.0f} ms"
+        )
+    return records
+
+
+def assignIds(records, newPages, changedShards):
+    """ Adds the records of newPages (a list of their paths, source hashes
+        and terms) to records, with ids of their own.
+    """
+    # New pages take the ids of removed ones before getting new ones
+    usedIds = {record[0] for record in records.values()}
+    pageId = 0
+    for path, sourceHash, terms in newPages:
+        while pageId in usedIds:
+            pageId += 1
+        usedIds.add(pageId)
+        changedShards.update(terms)
+        records[path] = (pageId, sourceHash, terms)
+
+
+def writeSearchIndex(*, searchConfig, records, pages, writer, changedShards):
+    """ Writes the files of the search index, given the records of every
+        page in it and the pages themselves (by source path).
+        Only the shards in changedShards (and missing ones) are written.
+
+        Returns the set of every shard, and how many of them were written.
+    """
+    usedIds = {record[0] for record in records.values()}
+    documents = [None] * (max(usedIds) + 1 if usedIds else 0)
+    for path, record in records.items():
+        page = pages[path]
+        documents[record[0]] = [page.url.replace(os.sep, "/"), page.title or ""]
+        if searchConfig.descriptions:
+            documents[record[0]].append(page.description or "")
+    writer.write(
+        os.path.join(searchConfig.directory, "pages.json"), dumpJson(documents)
+    )
+
+    # Shards only need writing again if one of their terms changed,
+    # or if they're missing
+    shards = set()
+    for record in records.values():
+        shards.update(record[2])
+    toWrite = set()
+    for shard in shards:
+        path = shardPath(searchConfig, shard)
+        if shard in changedShards or writer.existingHash(path) is None:
+            toWrite.add(shard)
+        else:
+            writer.keep(path)
+    if toWrite:
+        postings = {shard: {} for shard in toWrite}
+        for record in records.values():
+            for shard in toWrite.intersection(record[2]):
+                for term, score in record[2][shard].items():
+                    postings[shard].setdefault(term, []).append([record[0], score])
+        for shard, terms in postings.items():
+            for termPostings in terms.values():
+                termPostings.sort(key=lambda posting: (-posting[1], posting[0]))
+            writer.write(
+                shardPath(searchConfig, shard),
+                dumpJson({term: terms[term] for term in sorted(terms)}),
+            )
+
+    index = {
+        "version": INDEX_VERSION,
+        "prefixLength": searchConfig.prefixLength,
+        "minTermLength": searchConfig.minTermLength,
+        "stopWords": sorted(searchConfig.stopWords),
+        "shards": {
+            shard: os.path.relpath(
+                shardPath(searchConfig, shard), searchConfig.directory
+            ).replace(os.sep, "/")
+            for shard in sorted(shards)
+        },
+    }
+    writer.write(os.path.join(searchConfig.directory, "index.json"), dumpJson(index))
+    return shards, len(toWrite)
+
+
+def shardSearchRecords(*, searchConfig, content, owned, previous=None, store=None):
+    """ Splits just the pages in owned (a set of source paths) into terms,
+        for one shard of a sharded build. The ids in the records are left as
+        None, for mergeSearchIndex() to fill in.
+    """
+    previous = previous if previous else {}
+    records = {}
+    for groupName in checkGroups(searchConfig, content):
+        for page in content[groupName]:
+            if page.path not in owned or page.path in records:
+                continue
+            record = previous.get(page.path)
+            if record is not None and record[1] == page.sourceHash:
+                records[page.path] = record
+            elif store is not None:
+                terms = pageTerms(page, store.getContent(page), searchConfig)
+                records[page.path] = (None, page.sourceHash, terms)
+            else:
+                terms = pageTerms(page, page.content, searchConfig)
+                records[page.path] = (None, page.sourceHash, terms)
+    return records
+
+
+def mergeSearchIndex(
+    *, searchConfig, shardRecords, pages, writer, previous=None, silent=False
+):
+    """ Writes the search index of a sharded build, from the records every
+        shard made of its own pages (see shardSearchRecords()).
+        Pages keep the ids they had in previous, the search index of the
+        last merged build, if any; new pages get ids in the order of
+        shardRecords.
+
+        Returns the search index for the manifest.
+    """
+    start = time.perf_counter()
+    previous = previous if previous else {}
+    records = {}
+    newPages = []
+    for path, (_, sourceHash, terms) in shardRecords.items():
+        if path in previous:
+            records[path] = (previous[path][0], sourceHash, terms)
+        else:
+            newPages.append((path, sourceHash, terms))
+    changedShards = set()
+    assignIds(records, newPages, changedShards)
+    # The shards were made separately, so any of them could have changed
+    for record in records.values():
+        changedShards.update(record[2])
+    shards, written = writeSearchIndex(
+        searchConfig=searchConfig,
+        records=records,
+        pages=pages,
+        writer=writer,
+        changedShards=changedShards,
+    )
+    if not silent:
+        print(
+            f"Indexed {len(records)} pages for search in {len(shards)} shards "
+            f"in {(time.perf_counter() - start) * 1000:.0f} ms"
+        )
+    return records
@@ -0,0 +1,354 @@
+""" Serves the built site over HTTP, for previewing it locally or sharing
+    a preview.
+
+    Requests are handled in threads, and the contents of recently served
+    files are kept in memory (up to a size limit), so a slow client doesn't
+    hold anyone else up. Responses carry ETags and Last-Modified dates and
+    conditional requests get 304s, precompressed .br and .gz siblings are
+    served to clients which accept them, and single byte ranges are
+    supported. Every request is logged with how long it took.
+"""
+
+from collections import OrderedDict
+import email.utils
+import functools
+import http.server
+import os
+import re
+import threading
+import time
+import urllib.parse
+
+from .assets import FINGERPRINT_LENGTH
+
+RELOAD_PATH = "/__ssg/reload"
+# Injected into every HTML page when live reload is on;
+# the page reloads itself whenever the server says the site was rebuilt
+RELOAD_SCRIPT = (
+    "<script>new EventSource('%s').addEventListener('reload', "
+    "function () { location.reload(); });</script>" % RELOAD_PATH
+).encode()
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+# Bigger files are always sent straight from disk
+MAX_CACHED_FILE_BYTES = 4 * 1024 * 1024
+# The encodings precompressed siblings can have, most preferred first
+SIBLING_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+# Assets with a content hash in their name never change, and neither do
+# the resized images made from them (like trees.<hash>.480w.jpg)
+FINGERPRINTED_RE = re.compile(
+    r"\.[0-9a-f]{%d}(\.[0-9]+w)?\.[^./]+$" % FINGERPRINT_LENGTH
+)
+
+
+class Reloader:
+    """ Lets request handlers wait for the next rebuild.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.generation = 0
+
+    def notify(self):
+        with self.condition:
+            self.generation += 1
+            self.condition.notify_all()
+
+    def wait(self, generation, timeout=None):
+        """ Waits until a rebuild newer than generation happens,
+            and returns the new generation.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.generation > generation, timeout)
+            return self.generation
+
+
+class FileCache:
+    """ Keeps the contents of recently served files in memory, evicting the
+        least recently used ones when they add up to more than maxBytes.
+        Entries are checked against their file's size, mtime and inode
+        whenever they're used, so files changed by a rebuild are read again.
+    """
+
+    def __init__(self, maxBytes=DEFAULT_CACHE_BYTES):
+        self.maxBytes = maxBytes
+        # Maps paths to their stat keys and contents, most recently used last
+        self.entries = OrderedDict()
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def read(self, path, stat):
+        """ Returns the contents of the file at path (whose stat is given),
+            or None if it's too big to cache.
+        """
+        if stat.st_size > min(self.maxBytes, MAX_CACHED_FILE_BYTES):
+            return None
+        key = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        with self.lock:
+            if path in self.entries and self.entries[path][0] == key:
+                self.entries.move_to_end(path)
+                return self.entries[path][1]
+        with open(path, "rb") as f:
+            body = f.read()
+        with self.lock:
+            if path in self.entries:
+                self.used -= len(self.entries.pop(path)[1])
+            self.entries[path] = (key, body)
+            self.used += len(body)
+            while self.used > self.maxBytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.used -= len(evicted)
+        return body
+
+
+class UnsatisfiableRange(Exception):
+    pass
+
+
+def parseRange(header, size):
+    """ Returns the start and end (exclusive) of the byte range asked for by
+        a Range header, or None if the whole file should be sent instead
+        (which is allowed for anything but a single byte range).
+        Raises UnsatisfiableRange if the range is outside the file.
+    """
+    match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", header)
+    if match is None or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":
+        # The last so many bytes
+        start, end = max(0, size - int(last)), size
+    else:
+        start = int(first)
+        end = min(int(last) + 1, size) if last else size
+    if start >= size or start >= end:
+        raise UnsatisfiableRange(header)
+    return start, end
+
+
+def acceptedEncodings(header):
+    """ The encodings an Accept-Encoding header allows.
+    """
+    encodings = set()
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        quality = re.search(r"q=([0-9.]+)", params)
+        if name and (quality is None or float(quality.group(1)) > 0):
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+class SiteRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """ Serves files from the build directory, adding the live reload script
+        to HTML pages if a Reloader is set.
+    """
+
+    protocol_version = "HTTP/1.1"
+    reloader = None
+    cache = None
+
+    def handle_one_request(self):
+        self.started = time.perf_counter()
+        self.status = None
+        self.sent = 0
+        super().handle_one_request()
+        if self.status is not None:
+            elapsed = (time.perf_counter() - self.started) * 1000
+            self.log_message(
+                '"%s" %s %s %.1f ms', self.requestline, self.status, self.sent, elapsed
+            )
+
+    def send_response(self, code, message=None):
+        self.status = code
+        super().send_response(code, message)
+
+    def log_request(self, code="-", size="-"):
+        # Requests are logged once they're done, with their latency
+        pass
+
+    def do_GET(self):
+        self.serveFile(sendBody=True)
+
+    def do_HEAD(self):
+        self.serveFile(sendBody=False)
+
+    def serveFile(self, sendBody):
+        urlPath = urllib.parse.urlsplit(self.path).path
+        if self.reloader is not None and urlPath == RELOAD_PATH:
+            return self.sendReloadEvents()
+
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            if not urlPath.endswith("/"):
+                self.send_response(301)
+                self.send_header("Location", urlPath + "/")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            path = os.path.join(path, "index.html")
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return self.send_error(404, "File not found")
+        if not os.path.isfile(path):
+            return self.send_error(404, "File not found")
+
+        reload = self.reloader is not None and path.endswith(".html")
+        encoding, servedPath, servedStat = None, path, stat
+        if not reload and "Range" not in self.headers:
+            encoding, servedPath, servedStat = self.chooseSibling(path, stat)
+
+        etag = f'"{servedStat.st_size:x}-{servedStat.st_mtime_ns:x}'
+        etag += (f"-{encoding}" if encoding else "") + ('-r"' if reload else '"')
+        if self.notModified(etag, stat):
+            self.send_response(304)
+            self.sendCacheHeaders(path, stat, etag)
+            self.end_headers()
+            return
+
+        body = self.cache.read(servedPath, servedStat) if self.cache else None
+        if reload:
+            if body is None:
+                with open(path, "rb") as f:
+                    body = f.read()
+            body = injectReloadScript(body)
+        size = len(body) if body is not None else servedStat.st_size
+
+        start, end = 0, size
+        status = 200
+        if "Range" in self.headers and self.rangeApplies(etag, stat):
+            try:
+                byteRange = parseRange(self.headers["Range"], size)
+            except UnsatisfiableRange:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if byteRange is not None:
+                start, end = byteRange
+                status = 206
+
+        self.send_response(status)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Length", str(end - start))
+        self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{size}")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.sendCacheHeaders(path, stat, etag)
+        self.end_headers()
+        if not sendBody:
+            return
+        try:
+            if body is not None:
+                self.wfile.write(body[start:end])
+            else:
+                with open(servedPath, "rb") as f:
+                    self.connection.sendfile(f, start, end - start)
+            self.sent = end - start
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def chooseSibling(self, path, stat):
+        """ Picks the precompressed sibling of the file at path to send,
+            if the client accepts one and it's up to date.
+            Returns its encoding (or None), path and stat.
+        """
+        accepted = acceptedEncodings(self.headers.get("Accept-Encoding"))
+        for encoding, extension in SIBLING_ENCODINGS:
+            if encoding not in accepted:
+                continue
+            try:
+                siblingStat = os.stat(path + extension)
+            except OSError:
+                continue
+            # Siblings are written after the file they're compressed from
+            if siblingStat.st_mtime_ns >= stat.st_mtime_ns:
+                return encoding, path + extension, siblingStat
+        return None, path, stat
+
+    def notModified(self, etag, stat):
+        if "If-None-Match" in self.headers:
+            tags = [t.strip() for t in self.headers["If-None-Match"].split(",")]
+            return etag in tags or "*" in tags
+        if "If-Modified-Since" in self.headers:
+            try:
+                since = email.utils.parsedate_to_datetime(
+                    self.headers["If-Modified-Since"]
+                )
+            except (TypeError, ValueError):
+                return False
+            return int(stat.st_mtime) <= since.timestamp()
+        return False
+
+    def rangeApplies(self, etag, stat):
+        """ A Range request with an If-Range header only gets a range
+            if the file is still the version the client has part of.
+        """
+        ifRange = self.headers.get("If-Range")
+        if ifRange is None:
+            return True
+        if ifRange.startswith('"'):
+            return ifRange == etag
+        return ifRange == email.utils.formatdate(stat.st_mtime, usegmt=True)
+
+    def sendCacheHeaders(self, path, stat, etag):
+        self.send_header("ETag", etag)
+        self.send_header(
+            "Last-Modified", email.utils.formatdate(stat.st_mtime, usegmt=True)
+        )
+        self.send_header("Vary", "Accept-Encoding")
+        if self.reloader is None and FINGERPRINTED_RE.search(path):
+            self.send_header("Cache-Control", "public, max-age=31536000, immutable")
+        else:
+            self.send_header("Cache-Control", "no-cache")
+
+    def sendReloadEvents(self):
+        """ Holds the connection open as a server-sent event stream,
+            sending an event after each rebuild.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        # The stream has no length, so it lasts as long as the connection
+        self.close_connection = True
+        generation = self.reloader.generation
+        try:
+            while True:
+                newGeneration = self.reloader.wait(generation, timeout=15)
+                if newGeneration > generation:
+                    self.wfile.write(b"event: reload\ndata: {}\n\n")
+                    generation = newGeneration
+                else:
+                    # Keep the connection alive
+                    self.wfile.write(b": ping\n\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class SiteServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    # Connections waiting to be accepted, for when a lot of them open at once
+    request_queue_size = 64
+
+
+def injectReloadScript(body):
+    index = body.rfind(b"</body>")
+    if index == -1:
+        return body + RELOAD_SCRIPT
+    return body[:index] + RELOAD_SCRIPT + body[index:]
+
+
+def makeServer(directory, port, reloader=None, cacheBytes=DEFAULT_CACHE_BYTES):
+    """ Makes a threaded HTTP server for the files in directory,
+        which keeps up to cacheBytes of them in memory.
+    """
+    cache = FileCache(cacheBytes) if cacheBytes else None
+    handler = type(
+        "Handler", (SiteRequestHandler,), {"reloader": reloader, "cache": cache},
+    )
+    handler = functools.partial(handler, directory=directory)
+    return SiteServer(("", port), handler)
@@ -0,0 +1,334 @@
+""" Splits a build across several processes (or machines), each of which
+    renders a share of the pages into a directory of its own, and merges
+    what they wrote into the build directory.
+
+    Every shard reads the front matter of the whole site, so templates see
+    the same pages, groups and site.tags on every shard, and each page is
+    rendered by the shard its source path hashes to. Only the first shard
+    writes the assets, images, archives and feeds; the search index is put
+    together from the terms every shard found in its pages while merging.
+
+    Each shard saves its manifest in its own directory, along with the hash
+    of the site's index it saw, so merging can check that every shard built
+    the same site and that every page and file came from exactly one shard.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import time
+
+import toml
+
+from .assets import Copier
+from .compress import compressOutputs
+from .config_structs import *
+from .dependencies import analyseTemplate
+from .feed import selectEntries
+from .globals import (
+    ASSET_COPY_THREADS,
+    CONFIG_FILE_PATH,
+    CONTENT_STORE_FILE,
+    MANIFEST_FILE,
+    SHARD_MANIFEST_FILE,
+)
+from .manifest import Manifest, hashBytes, loadManifest, saveManifest
+from .output import OutputWriter
+from .search import mergeSearchIndex
+from .store import ContentStore
+
+
+def parseShard(text):
+    """ Parses a shard given as "i/N" (the i-th of N shards, counting from 1)
+        into (i, N).
+    """
+    number, _, count = text.partition("/")
+    try:
+        number, count = int(number), int(count)
+    except ValueError:
+        print(f"Config error: shards are given as i/N, like 1/4, not {text}")
+        raise
+    if count < 1 or not 1 <= number <= count:
+        print(f"Config error: shard {text} doesn't exist; i/N needs 1 <= i <= N")
+        raise ValueError(text)
+    return number, count
+
+
+def shardOf(path, count):
+    """ The number of the shard (counting from 1) which renders the page
+        whose source is at path.
+    """
+    key = os.path.normpath(path).replace(os.sep, "/").encode()
+    return int(hashlib.sha256(key).hexdigest()[:16], 16) % count + 1
+
+
+def shardDirectory(buildDir, number, count):
+    """ The directory a shard builds into, next to the build directory.
+    """
+    return f"{os.path.normpath(buildDir)}.shard-{number}-of-{count}"
+
+
+def shardFileName(fileName, number, count):
+    """ Names a shard's own copy of a file in the cache directory.
+    """
+    base, extension = os.path.splitext(fileName)
+    return f"{base}.shard-{number}-of-{count}{extension}"
+
+
+def indexHash(content):
+    """ Hashes the index of the site (which pages there are, in which groups
+        and order, and their front matter), which every shard has to agree on.
+    """
+    h = hashlib.sha256()
+    for groupName, group in content.items():
+        h.update(f"\0{groupName}".encode())
+        for page in group:
+            h.update(f"\0{page.path}\0{page.url}\0{page.meta!r}".encode())
+    return h.hexdigest()
+
+
+def ownedPages(content, number, count):
+    """ The source paths of the pages in content which shard number renders.
+    """
+    return set(
+        page.path
+        for group in content.values()
+        for page in group
+        if shardOf(page.path, count) == number
+    )
+
+
+def pagesToConvert(
+    *,
+    content,
+    owned,
+    templates,
+    archives=None,
+    feedConfig=None,
+    pagesConfig=None,
+    first=False,
+    silent=False,
+):
+    """ Works out which pages' bodies a shard has to convert: its own pages,
+        plus those the first shard puts in the feeds, unless a template
+        might read the content of other pages, in which case it needs them
+        all. Returns a set of source paths, or None for every page.
+    """
+    used = set(
+        page.template
+        for group in content.values()
+        for page in group
+        if page.path in owned
+    )
+    if first and archives:
+        used.update(archiveConfig.template for archiveConfig in archives)
+    for name in sorted(used):
+        if name not in templates:
+            # Reported when the page or archive is rendered
+            continue
+        fields = analyseTemplate(templates[name], templates).pageFields
+        if fields is None or "content" in fields:
+            if not silent:
+                print(
+                    f"Converting every page, since {name} might read "
+                    f"the content of other pages"
+                )
+            return None
+    paths = set(owned)
+    if first and feedConfig:
+        paths.update(
+            page.path for page in selectEntries(feedConfig, content, pagesConfig)
+        )
+    return paths
+
+
+def mergeShards(count, silent=False):
+    """ Merges the output of the count shards of a sharded build of the site
+        in the pwd into its build directory, after checking that they all
+        built the same site, and that every page and file came from exactly
+        one of them.
+
+        Returns the manifest of the merged build, which is saved like any
+        other build's, so incremental builds can pick up from it.
+    """
+    global CONFIG_FILE_PATH
+    global MANIFEST_FILE
+    global SHARD_MANIFEST_FILE
+    start = time.perf_counter()
+    with open(CONFIG_FILE_PATH, "rb") as f:
+        configBytes = f.read()
+    config = toml.loads(configBytes.decode())
+    assetsConfig = AssetsConfig(config["assets"] if "assets" in config else {})
+    buildConfig = BuildConfig(config["build"])
+    compressConfig = (
+        CompressConfig(config["compress"]) if "compress" in config else None
+    )
+    searchConfig = SearchConfig(config["search"]) if "search" in config else None
+    configHash = hashBytes(configBytes)
+
+    errors = []
+    shards = {}
+    for number in range(1, count + 1):
+        directory = shardDirectory(buildConfig.buildDirectory, number, count)
+        manifest = loadManifest(os.path.join(directory, SHARD_MANIFEST_FILE))
+        if manifest is None or manifest.shard is None:
+            errors.append(
+                f"shard {number} of {count} hasn't been built in {directory}"
+            )
+        elif (manifest.shard.number, manifest.shard.count) != (number, count):
+            errors.append(
+                f"{directory} holds shard {manifest.shard.number} "
+                f"of {manifest.shard.count}"
+            )
+        elif manifest.configHash != configHash:
+            errors.append(
+                f"shard {number} was built with a different {CONFIG_FILE_PATH}"
+            )
+        else:
+            shards[number] = (directory, manifest)
+    if not errors:
+        first = shards[1][1]
+        for number, (_, manifest) in shards.items():
+            if manifest.extensionsKey != first.extensionsKey:
+                errors.append(f"shards 1 and {number} converted markdown differently")
+            if manifest.shard.indexHash != first.shard.indexHash:
+                errors.append(f"shards 1 and {number} saw different sets of pages")
+    if not errors:
+        errors = checkShards(shards, count)
+    if errors:
+        for error in errors:
+            print(f"Merge error: {error}")
+        raise ValueError(f"{len(errors)} problems merging {count} shards")
+
+    first = shards[1][1]
+    merged = Manifest(configHash=configHash, extensionsKey=first.extensionsKey)
+    merged.assets = first.assets
+    merged.archives = first.archives
+    for _, manifest in shards.values():
+        merged.pages.update(manifest.pages)
+
+    manifestPath = os.path.join(buildConfig.cacheDirectory, MANIFEST_FILE)
+    previous = loadManifest(manifestPath)
+    if previous is not None and not os.path.isdir(buildConfig.buildDirectory):
+        previous = None
+    writer = OutputWriter(
+        buildConfig.buildDirectory,
+        knownHashes=previous.outputs if previous else None,
+    )
+    writer.begin()
+    try:
+        copier = Copier(assetsConfig.copyMode)
+        with ThreadPoolExecutor(max_workers=ASSET_COPY_THREADS) as executor:
+            for _ in executor.map(
+                lambda args: writer.copy(*args, copyFunction=copier),
+                [
+                    (os.path.join(directory, relPath), relPath, outputHash)
+                    for directory, manifest in shards.values()
+                    for relPath, outputHash in manifest.outputs.items()
+                ],
+            ):
+                pass
+        if searchConfig:
+            copied = set(writer.hashes)
+            pages = {
+                path: PageInfo(
+                    record.meta, path=path, slug=None, url=record.url, content=None
+                )
+                for path, record in merged.pages.items()
+            }
+            merged.search = mergeSearchIndex(
+                searchConfig=searchConfig,
+                # In the order of the site's index, like a normal build
+                shardRecords={
+                    path: shards[shardOf(path, count)][1].search[path]
+                    for path in first.shard.pages
+                    if path in shards[shardOf(path, count)][1].search
+                },
+                pages=pages,
+                writer=writer,
+                previous=previous.search if previous else None,
+                silent=silent,
+            )
+            if compressConfig:
+                compressOutputs(
+                    compressConfig=compressConfig,
+                    writer=writer,
+                    paths=set(writer.hashes) - copied,
+                    silent=silent,
+                )
+        writer.commit()
+    except BaseException:
+        writer.abort()
+        raise
+    merged.outputs = writer.hashes
+
+    if buildConfig.streaming:
+        mergeContentStores(buildConfig, shards, count, merged)
+    saveManifest(merged, manifestPath)
+    if not silent:
+        print(
+            f"Merged {len(merged.pages)} pages from {count} shards "
+            f"in {(time.perf_counter() - start) * 1000:.0f} ms"
+        )
+        print(writer.summary())
+    return merged
+
+
+def checkShards(shards, count):
+    """ Checks that every page was rendered by the shard it belongs to and
+        no other, and that every file a shard wrote exists and wasn't written
+        by another shard too. Returns a list of what's wrong.
+    """
+    errors = []
+    for path in shards[1][1].shard.pages:
+        number = shardOf(path, count)
+        if path not in shards[number][1].pages:
+            errors.append(f"{path} is missing from shard {number}")
+    for number, (directory, manifest) in shards.items():
+        for path in sorted(manifest.pages):
+            if shardOf(path, count) != number:
+                errors.append(
+                    f"{path} belongs in shard {shardOf(path, count)}, "
+                    f"not shard {number}"
+                )
+    owners = {}
+    for number, (directory, manifest) in shards.items():
+        for relPath in sorted(manifest.outputs):
+            if relPath in owners:
+                errors.append(
+                    f"{relPath} was written by shards {owners[relPath]} and {number}"
+                )
+            else:
+                owners[relPath] = number
+            if not os.path.isfile(os.path.join(directory, relPath)):
+                errors.append(f"{relPath} is missing from {directory}")
+    return errors
+
+
+def mergeContentStores(buildConfig, shards, count, merged):
+    """ Copies the bodies of the pages of a streaming build from the shards'
+        content stores into the site's own.
+    """
+    global CONTENT_STORE_FILE
+    store = ContentStore(
+        os.path.join(buildConfig.cacheDirectory, CONTENT_STORE_FILE), 0
+    )
+    try:
+        for number, (_, manifest) in shards.items():
+            shardStore = ContentStore(
+                os.path.join(
+                    buildConfig.cacheDirectory,
+                    shardFileName(CONTENT_STORE_FILE, number, count),
+                ),
+                0,
+            )
+            try:
+                for record in manifest.pages.values():
+                    if not store.has(record.contentHash):
+                        data = shardStore.get(record.contentHash)
+                        store.put(record.contentHash, data)
+            finally:
+                shardStore.close()
+        store.retain(set(record.contentHash for record in merged.pages.values()))
+    finally:
+        store.close()
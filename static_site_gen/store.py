@@ -0,0 +1,125 @@
+""" Keeps the converted bodies of pages out of memory, for building sites
+    too big to hold all at once.
+
+    In a streaming build, each page's HTML is written to a store in the build
+    cache directory as soon as it's converted, and the PageViews templates
+    get only load a page's content from the store when it's used.
+"""
+
+from collections.abc import Mapping
+import resource
+import sys
+
+from .cache import DiskCache
+from .config_structs import NAVIGATION_FIELDS, PAGE_TEMPLATE_FIELDS
+from .manifest import hashBytes
+
+
+class ContentStore(DiskCache):
+    """ Page bodies, keyed by the hash of their contents.
+        Only the bodies of the pages in the current build are kept,
+        so unlike a DiskCache the store has no size limit.
+
+        Arguments:
+            path is the SQLite database file to keep the store in
+            memoryBytes is how much of it to keep in memory
+    """
+
+    def __init__(self, path, memoryBytes):
+        super().__init__(path, float("inf"), memoryBytes)
+
+    def putContent(self, content):
+        """ Stores a page body, returning the key it's stored under.
+        """
+        data = content.encode()
+        key = hashBytes(data)
+        if key not in self.memory and not self.has(key):
+            self.put(key, data)
+        return key
+
+    def getContent(self, page):
+        if page.content is not None:
+            return page.content
+        data = self.get(page.contentHash)
+        if data is None:
+            print(f"The content of {page.path} is missing from {self.path}")
+            raise KeyError(page.contentHash)
+        return data.decode()
+
+    def has(self, key):
+        return (
+            self.connect()
+            .execute("SELECT 1 FROM entries WHERE key = ?", (key,))
+            .fetchone()
+            is not None
+        )
+
+    def retain(self, keys):
+        """ Removes every body whose key isn't in keys.
+        """
+        connection = self.connect()
+        stale = [
+            (key,)
+            for (key,) in connection.execute("SELECT key FROM entries")
+            if key not in keys
+        ]
+        connection.executemany("DELETE FROM entries WHERE key = ?", stale)
+        for (key,) in stale:
+            if key in self.memory:
+                self.memoryUsed -= len(self.memory.pop(key))
+
+
+class PageView(Mapping):
+    """ A read-only view of a page for templates, which works like a dict of
+        the page's PAGE_TEMPLATE_FIELDS, but reads them off the page instead
+        of copying them, and only loads the page's content from the store
+        (if there is one) when it's used.
+        The rest of the page's attributes can be read from it too.
+        Its previous, next and related slots hold the views of the pages the
+        page links to (see linkPages()), once the TemplateContext has filled
+        them in.
+    """
+
+    __slots__ = ("page", "store") + NAVIGATION_FIELDS
+
+    def __init__(self, page, store=None):
+        self.page = page
+        self.store = store
+
+    def __getattr__(self, name):
+        # Only called for what isn't in the view's own slots
+        if name == "content" and self.store is not None:
+            return self.store.getContent(self.page)
+        return getattr(self.page, name)
+
+    def __getitem__(self, key):
+        if key not in PAGE_TEMPLATE_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(PAGE_TEMPLATE_FIELDS)
+
+    def __len__(self):
+        return len(PAGE_TEMPLATE_FIELDS)
+
+    def __eq__(self, other):
+        # Comparing a page with itself (as in `page == currentPage`) is common,
+        # and shouldn't load its content or walk the pages it links to
+        if isinstance(other, PageView) and other.page is self.page:
+            return True
+        return Mapping.__eq__(self, other)
+
+    __hash__ = None
+
+
+def peakMemory():
+    """ Returns the peak resident memory of this process and of the largest
+        of its finished child processes (like page conversion workers),
+        in bytes.
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    scale = 1 if sys.platform == "darwin" else 1024
+    return own * scale, children * scale
@@ -0,0 +1,96 @@
+""" Loads the site's Jinja templates.
+
+    All templates share one environment, so a template pulled in with
+    `extends` or `include` is only compiled once, and compiled templates are
+    kept in a bytecode cache in the build cache directory between builds.
+    Jinja checks each cached template against its source and its own
+    version before using it, so edited templates are always recompiled.
+"""
+
+import os
+import time
+
+from jinja2 import (
+    BaseLoader,
+    ChoiceLoader,
+    Environment,
+    FileSystemBytecodeCache,
+    FileSystemLoader,
+    TemplateNotFound,
+)
+
+
+class TemplateLoader(BaseLoader):
+    """ Loads templates by the names they're given in the config:
+        the file name of each template, mapped to its path.
+    """
+
+    def __init__(self, mapping):
+        self.mapping = mapping
+
+    def get_source(self, environment, template):
+        if template not in self.mapping:
+            raise TemplateNotFound(template)
+        path = self.mapping[template]
+        mtime = os.path.getmtime(path)
+        with open(path) as f:
+            source = f.read()
+        return source, path, lambda: os.path.getmtime(path) == mtime
+
+    def list_templates(self):
+        return sorted(self.mapping)
+
+
+class TemplateEnvironment(Environment):
+    """ An Environment which keeps track of how long loading and compiling
+        its templates took.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.loadTime = 0.0
+        self.compileTime = 0.0
+        self.compiled = 0
+
+    def compile(self, *args, **kwargs):
+        # Only called for templates which weren't in the bytecode cache
+        start = time.perf_counter()
+        try:
+            return super().compile(*args, **kwargs)
+        finally:
+            self.compileTime += time.perf_counter() - start
+            self.compiled += 1
+
+    def loadReport(self, count):
+        return (
+            f"Loaded {count} templates in {self.loadTime * 1000:.0f} ms "
+            f"({self.compiled} compiled in {self.compileTime * 1000:.0f} ms, "
+            f"the rest from the bytecode cache)"
+        )
+
+
+def templateMapping(templateConfig):
+    """ Maps the name of every template in the config to its path.
+    """
+    mapping = {}
+    for f in templateConfig.files:
+        mapping[os.path.basename(f)] = f
+    for d in templateConfig.directories:
+        for f in os.listdir(d):
+            mapping[f] = os.path.join(d, f)
+    return mapping
+
+
+def makeTemplateEnvironment(templateConfig, bytecodeDirectory=None):
+    loader = ChoiceLoader(
+        [
+            TemplateLoader(templateMapping(templateConfig)),
+            # Templates could always pull in others by their path
+            FileSystemLoader(os.curdir),
+        ]
+    )
+    bytecodeCache = None
+    if bytecodeDirectory:
+        os.makedirs(bytecodeDirectory, exist_ok=True)
+        bytecodeCache = FileSystemBytecodeCache(bytecodeDirectory)
+    return TemplateEnvironment(loader=loader, bytecode_cache=bytecodeCache)
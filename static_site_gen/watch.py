@@ -0,0 +1,274 @@
+""" Watches the site's source files for changes and rebuilds the site
+    in memory when they happen. Used by `serve --watch`.
+
+    On Linux, changes are picked up with inotify (through ctypes, so there's
+    nothing extra to install); elsewhere we fall back to polling mtimes.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+import traceback
+
+import toml
+
+from .build import BuildState, buildSite, openContentStore
+from .config_structs import BuildConfig, FilesConfig, parseGroups
+from .globals import CONFIG_FILE_PATH, MANIFEST_FILE
+from .manifest import saveManifest
+
+# How long to wait for more events once something changed, since editors
+# often save a file in several steps
+DEBOUNCE_SECONDS = 0.02
+POLL_INTERVAL_SECONDS = 0.25
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def watchedRoots(config):
+    """ Lists the files and directories a site is built from.
+    """
+    roots = [CONFIG_FILE_PATH]
+    sections = [
+        FilesConfig(config[name]) for name in ("templates", "assets") if name in config
+    ]
+    sections.extend(parseGroups(config["pages"] if "pages" in config else {}))
+    for section in sections:
+        roots.extend(section.files)
+        roots.extend(section.directories)
+    return [os.path.normpath(root) for root in roots if os.path.exists(root)]
+
+
+class PollingWatcher:
+    """ Finds changes by comparing the size and mtime of every file
+        in the watched roots every so often.
+    """
+
+    def __init__(self, roots):
+        self.roots = roots
+        self.snapshot = self.scan()
+
+    def scan(self):
+        snapshot = {}
+        for root in self.roots:
+            if os.path.isfile(root):
+                paths = [root]
+            else:
+                paths = (
+                    os.path.join(dirPath, f)
+                    for (dirPath, _, files) in os.walk(root)
+                    for f in files
+                )
+            for path in paths:
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                snapshot[os.path.normpath(path)] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def wait(self, timeout=None):
+        """ Blocks until something changes (or timeout runs out),
+            and returns the set of changed paths.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self.scan()
+            changed = set(
+                path
+                for path in snapshot.keys() | self.snapshot.keys()
+                if snapshot.get(path) != self.snapshot.get(path)
+            )
+            self.snapshot = snapshot
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+            time.sleep(POLL_INTERVAL_SECONDS)
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """ Finds changes using Linux's inotify.
+    """
+
+    def __init__(self, roots):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.addWatch = libc.inotify_add_watch
+        self.addWatch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs = {}
+        # Whole directory trees are watched for the directories in the config,
+        # but single files are watched through their parent directory,
+        # and only changes to those files are reported
+        self.wholeDirs = set()
+        self.files = set()
+        for root in roots:
+            if os.path.isdir(root):
+                for (dirPath, _, _) in os.walk(root):
+                    self.watchDirectory(dirPath, whole=True)
+            else:
+                self.files.add(root)
+                self.watchDirectory(os.path.dirname(root) or os.curdir)
+
+    def watchDirectory(self, path, whole=False):
+        wd = self.addWatch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"Couldn't watch {path}")
+        self.dirs[wd] = path
+        if whole:
+            self.wholeDirs.add(os.path.normpath(path))
+
+    def isWatched(self, path):
+        parent = os.path.dirname(path) or os.curdir
+        return path in self.files or parent in self.wholeDirs
+
+    def readEvents(self):
+        changed = set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if wd not in self.dirs or not name:
+                continue
+            path = os.path.normpath(os.path.join(self.dirs[wd], os.fsdecode(name)))
+            if not self.isWatched(path):
+                continue
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Watch new directories, and report what's already in them
+                    for (subDir, _, files) in os.walk(path):
+                        self.watchDirectory(subDir, whole=True)
+                        changed.update(
+                            os.path.normpath(os.path.join(subDir, f)) for f in files
+                        )
+            else:
+                changed.add(path)
+        return changed
+
+    def wait(self, timeout=None):
+        """ Blocks until something changes (or timeout runs out),
+            and returns the set of changed paths.
+        """
+        changed = set()
+        while not changed:
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+            if not ready:
+                return changed
+            changed |= self.readEvents()
+        # Pick up the rest of a burst of events
+        while select.select([self.fd], [], [], DEBOUNCE_SECONDS)[0]:
+            changed |= self.readEvents()
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def makeWatcher(roots):
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(roots)
+        except (OSError, AttributeError, TypeError):
+            # No inotify (or no libc to find it in), so poll instead
+            pass
+    return PollingWatcher(roots)
+
+
+def loadConfig():
+    with open(CONFIG_FILE_PATH) as f:
+        return toml.loads(f.read())
+
+
+def watchSite(onRebuild=None, jobs=1):
+    """ Builds the site, then rebuilds it whenever its sources change,
+        keeping the templates, markdown pipeline and pages in memory.
+        onRebuild is called after every successful rebuild.
+        Runs until interrupted.
+    """
+    state = BuildState()
+    buildSite(silent=True, incremental=True, jobs=jobs, state=state)
+    config = loadConfig()
+    watcher = makeWatcher(watchedRoots(config))
+    print(f"Watching for changes ({type(watcher).__name__})")
+
+    # Whether the last rebuild failed, leaving the build directory
+    # partly rewritten
+    failed = False
+    try:
+        while True:
+            changed = watcher.wait()
+            if not changed:
+                continue
+            start = time.perf_counter()
+            state.changedPaths = changed
+            try:
+                buildSite(silent=True, incremental=not failed, jobs=jobs, state=state)
+            except Exception:
+                traceback.print_exc()
+                print("Rebuild failed; waiting for more changes.")
+                # We don't know how far the build got, so the next one
+                # rebuilds everything, comparing with what's actually in the
+                # build directory rather than with the hashes in the manifest
+                # (which the manifest saved on disk is older than)
+                failed = True
+                state.changedPaths = None
+                state.manifest = None
+                continue
+            failed = False
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f"Rebuilt {len(changed)} changed files in {elapsed:.0f} ms")
+
+            if os.path.normpath(CONFIG_FILE_PATH) in changed:
+                # The set of directories to watch may have changed
+                watcher.close()
+                config = loadConfig()
+                watcher = makeWatcher(watchedRoots(config))
+            if onRebuild:
+                onRebuild()
+    finally:
+        watcher.close()
+        for cache in (state.caches or {}).values():
+            cache.close()
+        if state.manifest is not None:
+            buildConfig = BuildConfig(config["build"])
+            bodies = state.store if state.store else openContentStore(buildConfig)
+            saveManifest(
+                state.manifest,
+                os.path.join(buildConfig.cacheDirectory, MANIFEST_FILE),
+                bodies,
+            )
+            bodies.close()
@@ -0,0 +1,67 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from static_site_gen.benchmark.sitegen import SiteSpec, generateSite
+
+EXAMPLE_SITE = os.path.join(os.path.dirname(__file__), os.pardir, "example-site")
+SSG = os.path.join(os.path.dirname(__file__), os.pardir, "ssg")
+# Big enough to split across shards and processes, small enough to be quick
+SMALL_SITE = SiteSpec(pages=40, tags=8, assets=4, assetBytes=1024)
+
+
+def copySite(source, destination):
+    """ Copies the site in source to destination, without its output
+        or caches.
+    """
+    shutil.copytree(
+        source, destination, ignore=shutil.ignore_patterns("output", ".ssg-cache")
+    )
+    return destination
+
+
+def treeContents(directory):
+    """ Maps the path of every file under directory (relative to it)
+        to its contents.
+    """
+    contents = {}
+    for dirPath, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(dirPath, name)
+            with open(path, "rb") as f:
+                contents[os.path.relpath(path, directory)] = f.read()
+    return contents
+
+
+def runSsg(*args, cwd):
+    """ Runs ssg with args in a process of its own, in cwd.
+    """
+    return subprocess.run(
+        [sys.executable, SSG, *args],
+        cwd=cwd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+    )
+
+
+@pytest.fixture
+def exampleSite(tmp_path, monkeypatch):
+    """ A copy of the example site, which the test runs in.
+    """
+    siteDir = copySite(EXAMPLE_SITE, str(tmp_path / "site"))
+    monkeypatch.chdir(siteDir)
+    return siteDir
+
+
+@pytest.fixture
+def generatedSite(tmp_path, monkeypatch):
+    """ A small generated site, which the test runs in.
+    """
+    siteDir = str(tmp_path / "generated")
+    generateSite(siteDir, SMALL_SITE)
+    monkeypatch.chdir(siteDir)
+    return siteDir
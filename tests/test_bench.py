@@ -0,0 +1,21 @@
+import json
+import os
+import subprocess
+import sys
+
+SSG = os.path.join(os.path.dirname(__file__), os.pardir, "ssg")
+
+
+def test_bench_runs_at_a_tiny_scale(tmp_path):
+    output = tmp_path / "benchmark.json"
+    subprocess.run(
+        [sys.executable, SSG, "bench", "--scales", "5", "--output", str(output)],
+        cwd=tmp_path,
+        check=True,
+    )
+    with open(output) as f:
+        results = json.load(f)
+    (scale,) = results["scales"]
+    assert set(scale["runs"]) == {"cold", "warm", "incremental", "edit"}
+    for run in scale["runs"].values():
+        assert run["wall"] > 0
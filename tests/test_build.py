@@ -0,0 +1,57 @@
+import os
+import re
+
+import pytest
+import toml
+
+from static_site_gen.build import (
+    TemplateContext,
+    buildSite,
+    enrichSiteConfig,
+    readSiteFiles,
+)
+from static_site_gen.config_structs import SiteConfig, parseGroups
+from static_site_gen.globals import CACHE_DIRECTORY, CONFIG_FILE_PATH, MANIFEST_FILE
+from static_site_gen.manifest import loadManifest
+from static_site_gen.profiling import Profiler
+from static_site_gen.store import PageView
+
+
+def test_incremental_build_keeps_archive_pages(exampleSite):
+    buildSite(silent=True)
+    buildSite(silent=True, incremental=True)
+    manifest = loadManifest(os.path.join(CACHE_DIRECTORY, MANIFEST_FILE))
+    assert manifest.archives
+    for record in manifest.archives.values():
+        templates, dependencies = record
+        assert "archive" in dependencies
+
+    profiler = Profiler(traceAllocations=False)
+    buildSite(silent=True, incremental=True, profiler=profiler)
+    for url in manifest.archives:
+        assert url not in profiler.pages
+
+
+def test_templates_get_read_only_views_of_pages(exampleSite):
+    with open(CONFIG_FILE_PATH) as f:
+        config = toml.loads(f.read())
+    siteConfig = SiteConfig(config["site"])
+    content = readSiteFiles(parseGroups(config["pages"]))
+    enrichSiteConfig(siteConfig, content)
+    context = TemplateContext(siteConfig, content)
+    for view in context.pages.values():
+        assert isinstance(view, PageView)
+        with pytest.raises(AttributeError):
+            view.title = "Changed"
+
+
+def test_tag_pages_only_list_posts(exampleSite):
+    with open("tags.md") as f:
+        source = f.read()
+    with open("tags.md", "w") as f:
+        f.write(source.replace('title = "Tags"', 'title = "Tags"\ntags = ["example"]'))
+    buildSite(silent=True)
+    with open(os.path.join("output", "tags", "example.html")) as f:
+        html = f.read()
+    listed = re.findall(r'<a href="/([^"]*)">\s*<div class="card">', html)
+    assert listed == ["posts/sample2.html", "posts/sample1.html"]
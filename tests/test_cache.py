@@ -0,0 +1,37 @@
+import os
+import sqlite3
+
+from static_site_gen.build import BuildState, buildSite
+from static_site_gen.cache import DiskCache
+from static_site_gen.globals import CACHE_DIRECTORY, KATEX_CACHE_FILE
+
+
+def storedBytes(path):
+    with sqlite3.connect(path) as connection:
+        (total,) = connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+    return total
+
+
+def test_evicting_brings_a_cache_under_its_limit(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache.sqlite"), 1000)
+    for i in range(20):
+        cache.put(f"key{i}", bytes(100))
+    cache.evict()
+    assert storedBytes(cache.path) <= 1000
+    assert cache.stats.evictions > 0
+    cache.close()
+
+
+def test_long_running_builds_keep_caches_in_bounds(exampleSite):
+    with open("config.toml", "a") as f:
+        f.write("\n[cache]\nkatexMaxMB = 0.001\n")
+    state = BuildState()
+    buildSite(silent=True, state=state)
+    # The caches stay open between builds, but are still held to their limit
+    assert state.caches["katex"].connection is not None
+    path = os.path.join(CACHE_DIRECTORY, KATEX_CACHE_FILE)
+    assert storedBytes(path) <= state.caches["katex"].maxBytes
+    for cache in state.caches.values():
+        cache.close()
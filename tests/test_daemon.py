@@ -0,0 +1,64 @@
+import json
+import os
+import sqlite3
+
+from static_site_gen.daemon import BuildDaemon
+from static_site_gen.globals import (
+    CACHE_DIRECTORY,
+    HIGHLIGHT_CACHE_FILE,
+    KATEX_CACHE_FILE,
+)
+
+from .conftest import EXAMPLE_SITE, copySite
+
+
+class Connection:
+    """ Collects the messages the daemon sends back.
+    """
+
+    def __init__(self):
+        self.messages = []
+
+    def sendall(self, data):
+        self.messages.extend(json.loads(line) for line in data.decode().splitlines())
+
+
+def build(daemon, directory):
+    connection = Connection()
+    daemon.build(connection, {"directory": directory, "incremental": True})
+    assert connection.messages[-1] == {"status": "ok"}, connection.messages[-1]
+
+
+def cacheKeys(directory, fileName):
+    path = os.path.join(directory, CACHE_DIRECTORY, fileName)
+    with sqlite3.connect(path) as connection:
+        return set(key for (key,) in connection.execute("SELECT key FROM entries"))
+
+
+def test_warm_sites_use_their_own_caches(tmp_path):
+    siteA = copySite(EXAMPLE_SITE, str(tmp_path / "a"))
+    siteB = copySite(EXAMPLE_SITE, str(tmp_path / "b"))
+    daemon = BuildDaemon(str(tmp_path / "daemon.sock"))
+    try:
+        build(daemon, siteA)
+        build(daemon, siteB)
+        keysB = {
+            fileName: cacheKeys(siteB, fileName)
+            for fileName in (KATEX_CACHE_FILE, HIGHLIGHT_CACHE_FILE)
+        }
+
+        # Site B was set up last, but a new formula and code block on
+        # site A still go into site A's caches
+        with open(os.path.join(siteA, "posts", "sample1.md"), "a") as f:
+            f.write("\nAnd $`a + b = c`$ more math.\n\n```python\nprint(1)\n```\n")
+        keysA = {
+            fileName: cacheKeys(siteA, fileName)
+            for fileName in (KATEX_CACHE_FILE, HIGHLIGHT_CACHE_FILE)
+        }
+        build(daemon, siteA)
+        for fileName in (KATEX_CACHE_FILE, HIGHLIGHT_CACHE_FILE):
+            assert cacheKeys(siteA, fileName) > keysA[fileName]
+            assert cacheKeys(siteB, fileName) == keysB[fileName]
+    finally:
+        for site in daemon.sites.values():
+            site.close()
@@ -0,0 +1,90 @@
+import datetime
+import os
+import re
+import xml.etree.ElementTree as ElementTree
+from types import SimpleNamespace
+
+from static_site_gen.build import buildSite
+from static_site_gen.config_structs import FeedConfig, PagesConfig
+from static_site_gen.feed import ATOM_NAMESPACE, selectEntries
+
+ATOM = "{" + ATOM_NAMESPACE + "}"
+
+
+def writePost(name, date=None):
+    dateLine = f"date = {date}\n" if date else ""
+    with open(os.path.join("posts", f"{name}.md"), "w") as f:
+        f.write(f'---\ntitle = "{name}"\n{dateLine}template = "page.html"\n---\n\nText')
+
+
+def setFeed(**settings):
+    with open("config.toml") as f:
+        config = f.read()
+    for key, value in settings.items():
+        config = re.sub(f"(?m)^{key} = .*$", f"{key} = {value}", config)
+    with open("config.toml", "w") as f:
+        f.write(config)
+
+
+def atomTitles():
+    root = ElementTree.parse(os.path.join("output", "atom.xml")).getroot()
+    assert root.tag == ATOM + "feed"
+    return [entry.find(ATOM + "title").text for entry in root.iter(ATOM + "entry")]
+
+
+def rssTitles():
+    root = ElementTree.parse(os.path.join("output", "rss.xml")).getroot()
+    assert root.tag == "rss"
+    return [item.find("title").text for item in root.iter("item")]
+
+
+def test_feeds_are_well_formed_and_newest_first(exampleSite):
+    writePost("Newest", "2021-03-01")
+    writePost("Oldest", "2019-01-01")
+    buildSite(silent=True)
+    expected = ["Newest", "Sample Post 2", "Sample Post 1", "Oldest"]
+    assert atomTitles() == expected
+    assert rssTitles() == expected
+
+
+def test_feeds_hold_at_most_max_entries(exampleSite):
+    setFeed(maxEntries=2)
+    for year in range(2010, 2016):
+        writePost(f"Post {year}", f"{year}-01-01")
+    buildSite(silent=True)
+    assert atomTitles() == ["Sample Post 2", "Sample Post 1"]
+    assert rssTitles() == ["Sample Post 2", "Sample Post 1"]
+
+
+def test_feeds_leave_out_undated_pages(exampleSite):
+    writePost("Undated")
+    writePost("Dated", "2021-01-01")
+    buildSite(silent=True)
+    assert atomTitles() == ["Dated", "Sample Post 2", "Sample Post 1"]
+    assert rssTitles() == ["Dated", "Sample Post 2", "Sample Post 1"]
+
+
+def test_select_entries_merges_sorted_and_unsorted_groups():
+    def page(title, date):
+        return SimpleNamespace(title=title, date=date)
+
+    sortedGroup = PagesConfig({"sortByDate": True, "sortReverse": False})
+    sortedGroup.groupName = "posts"
+    unsortedGroup = PagesConfig({})
+    unsortedGroup.groupName = "notes"
+    content = {
+        "posts": [
+            page("a", datetime.date(2020, 1, 1)),
+            page("c", datetime.date(2020, 3, 1)),
+            page("undated post", None),
+        ],
+        "notes": [
+            page("undated note", None),
+            page("d", datetime.datetime(2020, 4, 1, 8, 30)),
+            page("b", datetime.date(2020, 2, 1)),
+        ],
+    }
+    feedConfig = FeedConfig({"id": "x", "atomPath": "atom.xml", "maxEntries": 3})
+    feedConfig.groups = ["posts", "notes"]
+    entries = selectEntries(feedConfig, content, [sortedGroup, unsortedGroup])
+    assert [entry.title for entry in entries] == ["d", "c", "b"]
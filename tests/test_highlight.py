@@ -0,0 +1,89 @@
+import markdown
+
+from static_site_gen.build import markdownExtensions
+from static_site_gen.cache import CacheStats, DiskCache
+from static_site_gen.mdExtensions import highlight
+
+CODE = "```python\ndef f(x):\n    return x * 2\n```\n\nText.\n\n```\nplain code\n```"
+
+
+def openCache(tmp_path, name="highlight.sqlite"):
+    return DiskCache(str(tmp_path / name), 1024 * 1024)
+
+
+def test_other_markdown_instances_dont_use_the_cache(tmp_path):
+    cache = openCache(tmp_path)
+    md = markdown.Markdown(extensions=markdownExtensions({"highlight": cache}))
+    md.convert(CODE)
+    stats = cache.takeStats()
+    assert stats.misses > 0
+
+    # Converted in the same thread, after the cached instance
+    other = markdown.Markdown(extensions=["fenced_code", "codehilite"])
+    other.convert(CODE.replace("x * 2", "x * 3"))
+    assert cache.takeStats() == CacheStats()
+    cache.close()
+
+
+def convert(source, cache=None):
+    caches = {"highlight": cache} if cache is not None else {}
+    md = markdown.Markdown(extensions=markdownExtensions(caches))
+    return md.convert(source)
+
+
+def test_cached_html_matches_uncached_html(tmp_path):
+    source = CODE + "\n\n```rust\nfn main() {}\n```\n\n    indented code\n"
+    cache = openCache(tmp_path)
+    cold = convert(source, cache)
+    coldStats = cache.takeStats()
+    warm = convert(source, cache)
+    warmStats = cache.takeStats()
+    cache.close()
+    assert "codehilite" in cold
+    assert coldStats.misses > 0 and coldStats.hits == 0
+    assert warmStats.hits == coldStats.misses and warmStats.misses == 0
+    assert cold == warm == convert(source)
+
+
+class LegacyCodeHilite:
+    """ A CodeHilite like Markdown 3.2's, which keeps each option in an
+        attribute of its own and has no lang_prefix or pygments_formatter.
+    """
+
+    def __init__(self, src, css_class="codehilite"):
+        self.src = src
+        self.lang = "python"
+        self.guess_lang = True
+        self.use_pygments = True
+        self.linenums = None
+        self.css_class = css_class
+        self.style = "default"
+        self.noclasses = False
+        self.tab_length = 4
+        self.hl_lines = []
+
+
+def legacyHilite(self):
+    return f'<div class="{self.css_class}"><pre>{self.src}</pre></div>\n'
+
+
+def test_legacy_code_hilite_is_cached_by_its_options(tmp_path, monkeypatch):
+    monkeypatch.setattr(highlight, "originalHilite", legacyHilite)
+    monkeypatch.setattr(highlight, "HILITE_TAKES_SHEBANG", False)
+    cache = openCache(tmp_path)
+    highlight.active.set(cache)
+    try:
+        results = [
+            highlight.cachedHilite(LegacyCodeHilite("x = 1", cssClass))
+            for cssClass in ("codehilite", "codehilite", "other")
+        ]
+    finally:
+        highlight.active.set(None)
+    stats = cache.takeStats()
+    cache.close()
+    assert results == [
+        legacyHilite(LegacyCodeHilite("x = 1", cssClass))
+        for cssClass in ("codehilite", "codehilite", "other")
+    ]
+    # The second is a hit, and the third has options of its own
+    assert (stats.hits, stats.misses) == (1, 2)
@@ -0,0 +1,36 @@
+import os
+import shutil
+
+import pytest
+
+from static_site_gen import images
+from static_site_gen.build import buildSite
+
+pytest.importorskip("PIL")
+
+
+def test_derivatives_come_back_from_the_cache(exampleSite, monkeypatch):
+    with open("config.toml", "a") as f:
+        f.write("\n[images]\nwidths = [64, 128]\n")
+    buildSite(silent=True)
+    derivatives = sorted(
+        name for name in os.listdir(os.path.join("output", "assets")) if "w." in name
+    )
+    assert derivatives
+    originals = {}
+    for name in derivatives:
+        with open(os.path.join("output", "assets", name), "rb") as f:
+            originals[name] = f.read()
+
+    # Without its output, the build writes the derivatives from the cache
+    # rather than resizing the images again
+    shutil.rmtree("output")
+
+    def resizeImage(*args):
+        raise AssertionError("resized an image again")
+
+    monkeypatch.setattr(images, "resizeImage", resizeImage)
+    buildSite(silent=True)
+    for name, data in originals.items():
+        with open(os.path.join("output", "assets", name), "rb") as f:
+            assert f.read() == data
@@ -0,0 +1,63 @@
+import os
+
+from static_site_gen import build
+from static_site_gen.store import PageView
+
+from .conftest import copySite, treeContents
+
+
+def plain(value):
+    """ Turns the views in a template value into their urls,
+        so values from different builds can be compared.
+    """
+    if isinstance(value, PageView):
+        return value.url
+    if isinstance(value, list):
+        return [plain(item) for item in value]
+    if isinstance(value, dict):
+        return {key: plain(item) for key, item in value.items()}
+    return value
+
+
+def describeContext(context):
+    """ What templates get from a TemplateContext, besides currentPage.
+    """
+    return {
+        "groups": {
+            name: [{field: plain(view[field]) for field in view} for view in group]
+            for name, group in context.groups.items()
+        },
+        "pages": sorted(plain(context.pages).items()),
+        "site": {
+            name: plain(getattr(context.site, name))
+            for name in ("tags", "tagCounts", "tagPages", "recent", "topTags")
+        },
+        "archives": context.site.archives,
+    }
+
+
+def buildWithJobs(siteDir, jobs, monkeypatch):
+    """ Builds the site in siteDir with jobs processes, returning what its
+        templates got and what it wrote.
+    """
+    contexts = []
+
+    class RecordingContext(build.TemplateContext):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            contexts.append(self)
+
+    monkeypatch.setattr(build, "TemplateContext", RecordingContext)
+    monkeypatch.chdir(siteDir)
+    build.buildSite(silent=True, jobs=jobs)
+    (context,) = contexts
+    return describeContext(context), treeContents(os.path.join(siteDir, "output"))
+
+
+def test_parallel_builds_match_serial_builds(generatedSite, tmp_path, monkeypatch):
+    parallelSite = copySite(generatedSite, str(tmp_path / "parallel"))
+    serialContext, serialOutput = buildWithJobs(generatedSite, 1, monkeypatch)
+    parallelContext, parallelOutput = buildWithJobs(parallelSite, 4, monkeypatch)
+    assert serialContext["groups"]["posts"]
+    assert parallelContext == serialContext
+    assert parallelOutput == serialOutput
@@ -0,0 +1,105 @@
+import os
+import pickle
+
+import pytest
+
+from static_site_gen.build import buildSite
+from static_site_gen.globals import CACHE_DIRECTORY, MANIFEST_FILE
+from static_site_gen.manifest import MANIFEST_VERSION, Manifest, loadManifest
+from static_site_gen.profiling import Profiler
+
+from .conftest import copySite, treeContents
+
+MANIFEST_PATH = os.path.join(CACHE_DIRECTORY, MANIFEST_FILE)
+
+
+def converted(profiler):
+    """ The paths of the pages a profiled build converted.
+    """
+    return {os.path.normpath(path) for path, p in profiler.pages.items() if p.parse}
+
+
+def fullBuildOutput(siteDir, tmp_path, monkeypatch):
+    """ The output of a full build of a copy of the site in siteDir.
+    """
+    fresh = copySite(siteDir, str(tmp_path / "fresh"))
+    monkeypatch.chdir(fresh)
+    buildSite(silent=True)
+    monkeypatch.chdir(siteDir)
+    return treeContents(os.path.join(fresh, "output"))
+
+
+def test_saved_manifest_leaves_out_page_content(exampleSite):
+    buildSite(silent=True)
+    with open(MANIFEST_PATH, "rb") as f:
+        data = f.read()
+    assert b"fancy" not in data
+    manifest = loadManifest(MANIFEST_PATH)
+    assert manifest.pages
+    assert all(record.content is None for record in manifest.pages.values())
+
+    profiler = Profiler(traceAllocations=False)
+    buildSite(silent=True, incremental=True, profiler=profiler)
+    assert converted(profiler) == set()
+    with open(os.path.join("output", "posts", "sample1.html")) as f:
+        assert "fancy" in f.read()
+
+
+def test_incremental_build_converts_only_edited_pages(
+    exampleSite, tmp_path, monkeypatch
+):
+    buildSite(silent=True)
+    path = os.path.join("posts", "sample1.md")
+    with open(path) as f:
+        source = f.read()
+    with open(path, "w") as f:
+        f.write(source.replace("fancy", "edited"))
+
+    profiler = Profiler(traceAllocations=False)
+    buildSite(silent=True, incremental=True, profiler=profiler)
+    assert converted(profiler) == {path}
+    output = treeContents("output")
+    assert b"edited" in output[os.path.join("posts", "sample1.html")]
+    assert output == fullBuildOutput(exampleSite, tmp_path, monkeypatch)
+
+
+def test_incremental_build_removes_deleted_pages(exampleSite, tmp_path, monkeypatch):
+    buildSite(silent=True)
+    os.remove(os.path.join("posts", "sample2.md"))
+
+    buildSite(silent=True, incremental=True)
+    output = treeContents("output")
+    assert os.path.join("posts", "sample2.html") not in output
+    assert output == fullBuildOutput(exampleSite, tmp_path, monkeypatch)
+    manifest = loadManifest(MANIFEST_PATH)
+    assert os.path.join("posts", "sample2.md") not in manifest.pages
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"",
+        b"not a pickle",
+        # Cut off halfway
+        pickle.dumps(Manifest(configHash="x", extensionsKey="y"))[:40],
+        # A class from a module which no longer exists
+        b"cmissing_module\nManifest\n.",
+        # A class which can't be made from what was saved
+        b"cstatic_site_gen.manifest\nManifest\n)R.",
+        pickle.dumps({"version": MANIFEST_VERSION}),
+        pickle.dumps(Manifest(configHash="x", extensionsKey="y", version=0)),
+    ],
+)
+def test_unusable_manifests_lead_to_full_builds(
+    exampleSite, tmp_path, monkeypatch, data
+):
+    buildSite(silent=True)
+    with open(MANIFEST_PATH, "wb") as f:
+        f.write(data)
+    assert loadManifest(MANIFEST_PATH) is None
+
+    profiler = Profiler(traceAllocations=False)
+    buildSite(silent=True, incremental=True, profiler=profiler)
+    assert os.path.join("posts", "sample1.md") in converted(profiler)
+    assert loadManifest(MANIFEST_PATH) is not None
+    assert treeContents("output") == fullBuildOutput(exampleSite, tmp_path, monkeypatch)
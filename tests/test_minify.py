@@ -0,0 +1,111 @@
+import os
+
+import pytest
+
+from static_site_gen.cache import DiskCache
+from static_site_gen.config_structs import MinifyConfig
+from static_site_gen.manifest import hashBytes
+from static_site_gen.minify import Minifier, minifyCss, minifyHtml
+from static_site_gen.output import OutputWriter
+
+HTML_CASES = {
+    "whitespace and comments": (
+        "<div>\n  <p>Some   text\n   here</p>\n  <!-- comment -->\n</div>\n",
+        "<div><p>Some text\nhere</p></div>",
+    ),
+    "inline elements": (
+        "<p>a <b>bold</b>  <i>it</i>\tb</p>",
+        "<p>a <b>bold</b> <i>it</i> b</p>",
+    ),
+    "pre": (
+        "<div>\n<pre>  keep\n    this   </pre>\n</div>",
+        "<div><pre>  keep\n    this   </pre></div>",
+    ),
+    "code": (
+        "<p>Call <code>f(  x )</code>  now</p>",
+        "<p>Call <code>f(  x )</code> now</p>",
+    ),
+    "textarea": (
+        "<form>\n  <textarea>\n  a   b\n</textarea>\n</form>",
+        "<form><textarea>\n  a   b\n</textarea></form>",
+    ),
+    "script": (
+        '<head>\n  <script>\n  var s = "a   b"; // <!-- x -->\n  </script>\n</head>',
+        '<head><script>\n  var s = "a   b"; // <!-- x -->\n  </script></head>',
+    ),
+    "katex": (
+        '<p>Math <span class="katex"><span class="katex-mathml"><math>  x </math>'
+        '</span><span class="base">  <span class="mord">x</span> </span></span>'
+        "  after</p>",
+        '<p>Math <span class="katex"><span class="katex-mathml"><math>  x </math>'
+        '</span><span class="base">  <span class="mord">x</span> </span></span>'
+        " after</p>",
+    ),
+    "style": (
+        '<style>\n  a  >  b { content: "  x  ;  " ; }\n</style>',
+        '<style>a>b{content:"  x  ;  "}</style>',
+    ),
+    "attributes": (
+        '<div   title="a  >  b"\n  class="x">\n  text\n</div>',
+        '<div   title="a  >  b"\n  class="x">text</div>',
+    ),
+    "kept comments": (
+        "<div>\n<!--[if IE]><p>old</p><![endif]-->\n</div>",
+        "<div><!--[if IE]><p>old</p><![endif]--></div>",
+    ),
+}
+CSS_CASES = {
+    "punctuation": (
+        "a , b {\n  color: red ;\n  margin: 0;\n}\n",
+        "a,b{color:red;margin:0}",
+    ),
+    "strings": (
+        'p::before { content: "a  /* not a comment */  b" }',
+        'p::before{content:"a  /* not a comment */  b"}',
+    ),
+    "urls": (
+        'a { background: url( "x  y.png" ) ; }',
+        'a{background:url( "x  y.png" )}',
+    ),
+    "comments": ("/* gone */\na { }\n/*! kept */\n", "a{}/*! kept */"),
+    "selectors": ("a :hover { margin: 0 }", "a :hover{margin:0}"),
+}
+
+
+@pytest.mark.parametrize("name", sorted(HTML_CASES))
+def test_minify_html(name):
+    source, expected = HTML_CASES[name]
+    assert minifyHtml(source) == expected
+
+
+@pytest.mark.parametrize("name", sorted(CSS_CASES))
+def test_minify_css(name):
+    source, expected = CSS_CASES[name]
+    assert minifyCss(source) == expected
+
+
+def test_minifying_in_worker_processes(tmp_path):
+    writer = OutputWriter(str(tmp_path / "output"), staged=False)
+    writer.begin()
+    cache = DiskCache(str(tmp_path / "minify.sqlite"), 1024 * 1024)
+    minifier = Minifier(MinifyConfig({}), writer, cache=cache, jobs=2)
+    pages = {
+        f"page{i}.html": (source, expected)
+        for i, (source, expected) in enumerate(HTML_CASES.values())
+    }
+    for relPath, (source, _) in pages.items():
+        assert minifier.write(relPath, source) is None
+    # Files which aren't minified are written right away
+    assert minifier.write("data.json", "{ }") == hashBytes(b"{ }")
+    minifier.finish(silent=True)
+    for relPath, (_, expected) in pages.items():
+        with open(os.path.join(writer.outDir, relPath)) as f:
+            assert f.read() == expected
+        assert writer.hashes[relPath] == hashBytes(expected.encode())
+
+    # What's minified already is kept without waiting for the workers
+    again = Minifier(MinifyConfig({}), writer, cache=cache, jobs=2)
+    relPath, (source, expected) = next(iter(pages.items()))
+    assert again.write(relPath, source) == hashBytes(expected.encode())
+    again.finish(silent=True)
+    cache.close()
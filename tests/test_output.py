@@ -0,0 +1,105 @@
+import os
+
+import pytest
+
+from static_site_gen import build
+from static_site_gen.globals import CACHE_DIRECTORY, MANIFEST_FILE
+from static_site_gen.output import STAGING_SUFFIX, OutputWriter
+
+from .conftest import treeContents
+
+
+def publish(buildDir, files, knownHashes=None):
+    """ Builds files (a dict of contents by path) into buildDir with a staged
+        OutputWriter. Returns the writer.
+    """
+    writer = OutputWriter(buildDir, knownHashes=knownHashes)
+    writer.begin()
+    for relPath, data in files.items():
+        writer.write(relPath, data)
+    writer.commit()
+    return writer
+
+
+def test_staged_builds_are_swapped_in_at_commit(tmp_path):
+    buildDir = str(tmp_path / "output")
+    publish(buildDir, {"index.html": "one", "a/page.html": "a"})
+
+    writer = OutputWriter(buildDir)
+    writer.begin()
+    writer.write("index.html", "two")
+    writer.write("b/page.html", "b")
+    # Nothing is published until the build commits
+    assert treeContents(buildDir) == {"index.html": b"one", "a/page.html": b"a"}
+    writer.commit()
+    assert treeContents(buildDir) == {"index.html": b"two", "b/page.html": b"b"}
+    assert not os.path.exists(buildDir + STAGING_SUFFIX)
+    # The directory of the removed page goes with it
+    assert not os.path.exists(os.path.join(buildDir, "a"))
+    assert writer.removed == 1
+
+
+def test_aborted_builds_leave_the_site_alone(tmp_path):
+    buildDir = str(tmp_path / "output")
+    publish(buildDir, {"index.html": "one"})
+    writer = OutputWriter(buildDir)
+    writer.begin()
+    writer.write("index.html", "two")
+    writer.abort()
+    assert treeContents(buildDir) == {"index.html": b"one"}
+    assert not os.path.exists(buildDir + STAGING_SUFFIX)
+
+
+def test_unchanged_files_are_left_alone(tmp_path):
+    buildDir = str(tmp_path / "output")
+    first = publish(buildDir, {"same.html": "same", "changed.html": "old"})
+    before = os.stat(os.path.join(buildDir, "same.html"))
+    second = publish(
+        buildDir, {"same.html": "same", "changed.html": "new"}, first.hashes
+    )
+    after = os.stat(os.path.join(buildDir, "same.html"))
+    assert (before.st_ino, before.st_mtime_ns) == (after.st_ino, after.st_mtime_ns)
+    assert (second.written, second.unchanged) == (1, 1)
+
+
+@pytest.mark.parametrize("staged", [True, False])
+def test_orphans_are_found_from_the_known_hashes(tmp_path, staged):
+    buildDir = str(tmp_path / "output")
+    first = publish(buildDir, {"kept.html": "k", "gone.html": "g"})
+    writer = OutputWriter(buildDir, staged=staged, knownHashes=first.hashes)
+    writer.begin()
+    writer.write("kept.html", "k")
+    writer.commit()
+    assert treeContents(buildDir) == {"kept.html": b"k"}
+    assert writer.removed == 1
+
+
+def test_orphans_are_found_by_walking_without_known_hashes(tmp_path):
+    buildDir = str(tmp_path / "output")
+    os.makedirs(os.path.join(buildDir, "old"))
+    with open(os.path.join(buildDir, "old", "stray.html"), "w") as f:
+        f.write("stray")
+    publish(buildDir, {"index.html": "one"})
+    assert treeContents(buildDir) == {"index.html": b"one"}
+
+
+def test_failed_unstaged_builds_drop_the_manifest(exampleSite, monkeypatch, capsys):
+    with open("config.toml") as f:
+        config = f.read()
+    with open("config.toml", "w") as f:
+        f.write(config.replace("[build]\n", "[build]\nstaged = false\n"))
+    build.buildSite(silent=True)
+    manifestPath = os.path.join(CACHE_DIRECTORY, MANIFEST_FILE)
+    assert os.path.isfile(manifestPath)
+
+    def failingArchives(*args, **kwargs):
+        raise RuntimeError("archives failed")
+
+    with monkeypatch.context() as patches:
+        patches.setattr(build, "buildArchiveFiles", failingArchives)
+        with pytest.raises(RuntimeError):
+            build.buildSite(silent=True, incremental=True)
+    assert not os.path.exists(manifestPath)
+    capsys.readouterr()
+    build.buildSite(incremental=True)
+    assert "Doing a full build" in capsys.readouterr().out
@@ -0,0 +1,82 @@
+import markdown
+import pytest
+
+from static_site_gen.backends import Renderer, isPlain, splitFrontMatter
+from static_site_gen.build import markdownExtensions
+from static_site_gen.parity import CASES, REJECTED, runParity
+
+pytest.importorskip("markdown_it")
+
+# Pages in the plain subset, which markdown-it must convert byte for byte
+# like Python-Markdown does
+PLAIN = dict(
+    CASES,
+    **{
+        "tight list": "Before.\n\n* one\n* two with *emphasis*\n* three",
+        "numbered list": "1. first\n2. second with `code`\n3. third",
+        "emphasis mix": "Some *em*, **strong**, _under_ and snake_case_words.",
+        "links in text": "See [the docs](https://example.org/docs) and [home](/).",
+        "heading levels": "# One\n\nText.\n\n## Two\n\n### Three\n\nMore text.",
+        "quote and list": "> A quote\n> over lines\n\n* a\n* b",
+        "page": (
+            '---\ntitle = "Plain"\ndate = 2020-01-01\n---\n'
+            "# Plain page\n\nIt's **plain**, with a [link](/x.html).\n\n"
+            "- one\n- two\n\n> Quoted."
+        ),
+    },
+)
+# Pages which need Python-Markdown, or its extensions
+NOT_PLAIN = dict(
+    REJECTED,
+    **{
+        "table with header": "| a | b |\n|---|---|\n| 1 | 2 |",
+        "inline html": "Some <span>inline</span> html.",
+        "html comment": "Text <!-- comment --> text.",
+        "escaped underscore": "snake\\_case",
+        "escaped bracket": "\\[not a link\\]",
+        "display math": "```math\nx^2\n```",
+        "inline math": "Math $`x + y`$ here.",
+        "admonition with class": '!!! is-danger "Info"\n    Body.',
+        "highlighted code": "```python\nprint(1)\n```",
+    },
+)
+
+
+@pytest.fixture(scope="module")
+def renderer():
+    return Renderer(markdown.Markdown(extensions=markdownExtensions()), "auto")
+
+
+@pytest.fixture(scope="module")
+def reference():
+    return markdown.Markdown(extensions=markdownExtensions())
+
+
+@pytest.mark.parametrize("name", sorted(PLAIN))
+def test_plain_pages_convert_identically(name, renderer, reference):
+    source = PLAIN[name]
+    assert isPlain(splitFrontMatter(source)[1])
+    reference.reset()
+    expected = reference.convert(source)
+    renderer.takeCounts()
+    meta, html = renderer.convert(source)
+    assert renderer.takeCounts() == {"markdown-it": 1}
+    assert html == expected
+    assert meta == reference.Meta
+
+
+@pytest.mark.parametrize("name", sorted(NOT_PLAIN))
+def test_other_pages_go_to_python_markdown(name, renderer, reference):
+    source = NOT_PLAIN[name]
+    assert not isPlain(splitFrontMatter(source)[1])
+    reference.reset()
+    expected = reference.convert(source)
+    renderer.takeCounts()
+    _, html = renderer.convert(source)
+    assert renderer.takeCounts() == {"python-markdown": 1}
+    assert html == expected
+
+
+def test_backends_agree_on_the_example_site(exampleSite, capsys):
+    failures = runParity()
+    assert failures == 0, capsys.readouterr().out
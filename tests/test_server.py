@@ -0,0 +1,120 @@
+import email.utils
+import http.client
+import threading
+
+import pytest
+
+from static_site_gen.server import makeServer
+
+BODY = bytes(range(256)) * 4
+FINGERPRINT = "0123456789"
+
+
+@pytest.fixture
+def server(tmp_path):
+    """ Serves a directory with a few files from a thread, along with a
+        secret file just outside it.
+    """
+    site = tmp_path / "site"
+    (site / "assets").mkdir(parents=True)
+    (site / "data.bin").write_bytes(BODY)
+    (site / "index.html").write_text("<html><body>Home</body></html>")
+    (site / "assets" / f"app.{FINGERPRINT}.css").write_text("body {}")
+    (site / "assets" / f"trees.{FINGERPRINT}.480w.jpg").write_bytes(b"jpg")
+    (tmp_path / "secret.txt").write_text("secret")
+    httpd = makeServer(str(site), 0)
+    thread = threading.Thread(
+        target=httpd.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+    )
+    thread.start()
+    yield httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def get(port, path, **headers):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    connection.request("GET", path, headers=headers)
+    response = connection.getresponse()
+    body = response.read()
+    connection.close()
+    return response, body
+
+
+def test_etags_and_dates_get_304s(server):
+    response, body = get(server, "/data.bin")
+    assert response.status == 200 and body == BODY
+    etag = response.getheader("ETag")
+    lastModified = response.getheader("Last-Modified")
+
+    response, body = get(server, "/data.bin", **{"If-None-Match": etag})
+    assert response.status == 304 and body == b""
+    assert response.getheader("ETag") == etag
+    response, _ = get(server, "/data.bin", **{"If-None-Match": '"other"'})
+    assert response.status == 200
+
+    response, _ = get(server, "/data.bin", **{"If-Modified-Since": lastModified})
+    assert response.status == 304
+    earlier = email.utils.formatdate(0, usegmt=True)
+    response, _ = get(server, "/data.bin", **{"If-Modified-Since": earlier})
+    assert response.status == 200
+
+
+@pytest.mark.parametrize(
+    "header, start, end",
+    [("bytes=0-9", 0, 10), ("bytes=1000-", 1000, 1024), ("bytes=-24", 1000, 1024)],
+)
+def test_ranges(server, header, start, end):
+    response, body = get(server, "/data.bin", Range=header)
+    assert response.status == 206
+    assert body == BODY[start:end]
+    assert response.getheader("Content-Range") == f"bytes {start}-{end - 1}/1024"
+
+
+@pytest.mark.parametrize("header", ["bytes=1024-", "bytes=2000-3000", "bytes=9-5"])
+def test_unsatisfiable_ranges_get_416s(server, header):
+    response, body = get(server, "/data.bin", Range=header)
+    assert response.status == 416
+    assert response.getheader("Content-Range") == "bytes */1024"
+    assert body == b""
+
+
+def test_if_range_only_sends_ranges_of_the_same_version(server):
+    response, _ = get(server, "/data.bin")
+    etag = response.getheader("ETag")
+    lastModified = response.getheader("Last-Modified")
+
+    for validator in (etag, lastModified):
+        response, body = get(
+            server, "/data.bin", Range="bytes=0-9", **{"If-Range": validator}
+        )
+        assert response.status == 206 and body == BODY[:10]
+    for validator in ('"stale"', email.utils.formatdate(0, usegmt=True)):
+        response, body = get(
+            server, "/data.bin", Range="bytes=0-9", **{"If-Range": validator}
+        )
+        assert response.status == 200 and body == BODY
+
+
+@pytest.mark.parametrize(
+    "path", ["/../secret.txt", "/%2e%2e/secret.txt", "/assets/../../secret.txt"]
+)
+def test_paths_cant_leave_the_directory(server, path):
+    response, body = get(server, path)
+    assert response.status == 404
+    assert b"secret" not in body
+
+
+@pytest.mark.parametrize(
+    "path, immutable",
+    [
+        (f"/assets/app.{FINGERPRINT}.css", True),
+        (f"/assets/trees.{FINGERPRINT}.480w.jpg", True),
+        ("/data.bin", False),
+        ("/index.html", False),
+    ],
+)
+def test_only_fingerprinted_files_are_immutable(server, path, immutable):
+    response, _ = get(server, path)
+    assert response.status == 200
+    assert ("immutable" in response.getheader("Cache-Control")) == immutable
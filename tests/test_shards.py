@@ -0,0 +1,98 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from static_site_gen.benchmark.sitegen import generateSite
+from static_site_gen.globals import SHARD_MANIFEST_FILE
+from static_site_gen.manifest import loadManifest, saveManifest
+from static_site_gen.shards import mergeShards, shardDirectory
+
+from .conftest import SMALL_SITE, SSG, copySite, runSsg, treeContents
+
+SHARDS = 3
+
+
+def buildShards(siteDir):
+    """ Builds each shard of the site in siteDir in a process of its own,
+        all at once.
+    """
+    processes = [
+        subprocess.Popen(
+            [sys.executable, SSG, "build", "--shard", f"{number}/{SHARDS}"],
+            cwd=siteDir,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+        for number in range(1, SHARDS + 1)
+    ]
+    for process in processes:
+        output, _ = process.communicate()
+        assert process.returncode == 0, output.decode()
+
+
+@pytest.fixture(scope="module")
+def builtShards(tmp_path_factory):
+    siteDir = str(tmp_path_factory.mktemp("sharded") / "site")
+    generateSite(siteDir, SMALL_SITE)
+    buildShards(siteDir)
+    return siteDir
+
+
+@pytest.fixture
+def shardedSite(builtShards, tmp_path, monkeypatch):
+    """ A copy of a generated site with its shards built but not merged,
+        which the test runs in.
+    """
+    siteDir = shutil.copytree(builtShards, str(tmp_path / "site"))
+    monkeypatch.chdir(siteDir)
+    return siteDir
+
+
+def test_merged_shards_match_a_plain_build(shardedSite, tmp_path):
+    plainSite = copySite(shardedSite, str(tmp_path / "plain"))
+    for name in os.listdir(plainSite):
+        if ".shard-" in name:
+            shutil.rmtree(os.path.join(plainSite, name))
+    result = runSsg("build", cwd=plainSite)
+    assert result.returncode == 0, result.stdout
+
+    result = runSsg("merge", "--shards", str(SHARDS), cwd=shardedSite)
+    assert result.returncode == 0, result.stdout
+    merged = treeContents(os.path.join(shardedSite, "output"))
+    assert merged
+    assert merged == treeContents(os.path.join(plainSite, "output"))
+
+
+def mergeErrors(capsys):
+    with pytest.raises(ValueError):
+        mergeShards(SHARDS, silent=True)
+    return capsys.readouterr().out
+
+
+def test_merge_rejects_a_missing_shard(shardedSite, capsys):
+    shutil.rmtree(shardDirectory("output", 2, SHARDS))
+    assert "shard 2 of 3 hasn't been built" in mergeErrors(capsys)
+
+
+def test_merge_rejects_a_duplicate_output(shardedSite, capsys):
+    firstDir = shardDirectory("output", 1, SHARDS)
+    secondDir = shardDirectory("output", 2, SHARDS)
+    first = loadManifest(os.path.join(firstDir, SHARD_MANIFEST_FILE))
+    second = loadManifest(os.path.join(secondDir, SHARD_MANIFEST_FILE))
+    relPath = sorted(first.outputs)[0]
+    os.makedirs(os.path.dirname(os.path.join(secondDir, relPath)), exist_ok=True)
+    shutil.copy2(os.path.join(firstDir, relPath), os.path.join(secondDir, relPath))
+    second.outputs[relPath] = first.outputs[relPath]
+    saveManifest(second, os.path.join(secondDir, SHARD_MANIFEST_FILE))
+    assert f"{relPath} was written by shards 1 and 2" in mergeErrors(capsys)
+
+
+def test_merge_rejects_a_changed_config(shardedSite, capsys):
+    with open("config.toml", "a") as f:
+        f.write("\n# Changed since the shards were built\n")
+    errors = mergeErrors(capsys)
+    for number in range(1, SHARDS + 1):
+        assert f"shard {number} was built with a different config.toml" in errors